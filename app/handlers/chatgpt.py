@@ -1,10 +1,9 @@
-import os
-from openai import OpenAI
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 from pydantic import BaseModel
 from typing import List
 from app.states.state import ChatGptStates
+from app.utils.llm import ApiKeyError, get_llm
 
 async def chatgpt(message: Message, state: FSMContext) -> None:
     """Handle /chatgpt command and set the state"""
@@ -14,10 +13,10 @@ async def chatgpt(message: Message, state: FSMContext) -> None:
 async def process_chatgpt(message: Message, state: FSMContext) -> None:
     """Process user input when in chat_gpt state"""
     text = message.text
-    api_key = os.getenv("API_CHATGPT")
-    api_base = os.getenv("API_BASE")  # Получаем базовый URL из переменных окружения
     
-    if not api_key:
+    try:
+        llm = get_llm()
+    except ApiKeyError:
         await message.answer("Ошибка: API ключ не настроен. Проверьте файл .env и убедитесь, что API_CHATGPT установлен.")
         await state.clear()
         return
@@ -25,12 +24,6 @@ async def process_chatgpt(message: Message, state: FSMContext) -> None:
     try:
         await message.answer("Обрабатываю ваш запрос...")
         
-        # Initialize OpenAI client with custom base URL
-        client = OpenAI(
-            api_key=api_key,
-            base_url=api_base  # Указываем кастомный endpoint
-        )
-
         class Question(BaseModel):
             question: str
             options: List[str]
@@ -39,9 +32,8 @@ async def process_chatgpt(message: Message, state: FSMContext) -> None:
         class Quiz(BaseModel):
             questions: List[Question]
         
-        # Используем beta.chat.completions.parse вместо chat.completions.create
-        response = client.beta.chat.completions.parse(
-            model="openai/gpt-4o-mini",
+        # Общий асинхронный клиент с ограничением параллельных запросов
+        quiz_data = await llm.parse(
             messages=[
                 {
                     "role": "system",
@@ -56,12 +48,9 @@ async def process_chatgpt(message: Message, state: FSMContext) -> None:
             response_format=Quiz
         )
         
-        # Теперь response - это уже объект Quiz, можно работать с ним напрямую
+        # llm.parse возвращает уже объект Quiz, можно работать с ним напрямую
         quiz_result = "📝 Квиз по вашему тексту:\n\n"
         
-        # Получаем доступ к parsed объекту из ответа
-        quiz_data = response.choices[0].message.parsed
-        
         for i, question in enumerate(quiz_data.questions, 1):
             quiz_result += f"Вопрос {i}: {question.question}\n"
             for j, option in enumerate(question.options, 1):
@@ -1,29 +1,69 @@
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Poll, PollAnswer
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Poll, PollAnswer, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from app.utils.database import store_lesson_text, get_lesson_text, check_user_exists, save_user, get_user_name, store_quiz_result, get_teacher_links, get_quiz_results_by_link
-from app.utils.language import get_text, get_user_language, get_user_text
+from app.utils.database import store_lesson_text, get_lesson_text, get_lesson_author, get_user_profile, save_user, quiz_result_row, get_teacher_link_previews, get_quiz_stats, get_lesson_pacing, set_lesson_pacing
+from app.utils.language import DEFAULT_LANGUAGE, LANGUAGES, get_text, get_user_language, get_user_text
+from app.utils.quiz import (
+    QUESTION_BANK_SIZE, ApiKeyError, QuizStream, build_question_bank, get_bank, get_quiz_stream,
+    pack_question, prefill_quiz_cache, regenerate_quiz, sample_quiz
+)
+from app.utils.poll_scheduler import PollRecord, get_poll_scheduler
+from app.utils.pacing import DEFAULT_PACING, PACING_MODES, POLL_DEADLINE_GRACE, pause_before_next, poll_open_period
+from app.utils.result_writer import get_result_writer
+from app.utils.job_queue import FatalJobError, Job, JobQueue, JobType, get_job_queue
+from app.utils.cache import TTLCache
+from app.utils.chunking import split_text
+from app.utils.singleflight import SingleFlight
+from app.utils.metrics import counter, gauge, histogram, register_cache
+from app.utils.export import FORMATS, export_results, iter_lesson_results, iter_teacher_results
 from app.states.state import TeacherStates, StudentStates
-from app.handlers.chatgpt import process_chatgpt
+from weakref import WeakValueDictionary
+from typing import List, Optional, Tuple
 import os
-from openai import OpenAI
-from pydantic import BaseModel
-from typing import List, Dict
 import asyncio
+import logging
+import secrets
+import time
 
 
-class Question(BaseModel):
-    question: str
-    options: List[str]
-    correctAnswer: int
-    explanation: str  # Add explanation field to the model
+# Number of students on one page of quiz results, keeps the message under
+# the Telegram limit of 4096 characters
+RESULTS_PAGE_SIZE = 40
 
-class Quiz(BaseModel):
-    questions: List[Question]
+# Number of lessons on one page of /links
+LINKS_PAGE_SIZE = 20
 
+# Long lesson texts are sent in several messages: Telegram allows 4096
+# characters per message, the rest is left for the page header
+LESSON_PAGE_CHARS = 4000
 
-# Dictionary to store active polls and their associated data
-active_polls: Dict[str, Dict] = {}
+# Lessons longer than one message can be sent as a .txt file
+LESSON_FILE_MAX_BYTES = 512 * 1024
+
+# Keyboards of /links by (teacher ID, language, cursor). Dropped when the teacher
+# saves a lesson; the TTL bounds staleness when several processes serve the bot
+_links_keyboards = TTLCache(maxsize=4096, ttl=60)
+register_cache("links_keyboards", _links_keyboards)
+_NOT_CACHED = object()
+
+# Students who open the same lesson at once share one lesson text fetch and quiz
+quiz_flights = SingleFlight()
+
+# Job queue priorities, lower runs first: a waiting student, a teacher waiting
+# for /regenerate, then quizzes generated ahead of the students
+PRIORITY_QUIZ = 0
+PRIORITY_REGENERATE = 1
+PRIORITY_PREFILL = 2
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_QUIZZES = gauge("active_quizzes", "Quizzes started and not finished yet")
+TIME_TO_FIRST_QUESTION = histogram("quiz_first_question_seconds", "Time from the quiz start to the first question")
+counter("quiz_loads_total", "Lesson text and quiz lookups").set_function(lambda: quiz_flights.calls)
+counter("quiz_loads_shared_total", "Quiz lookups that joined a concurrent one").set_function(lambda: quiz_flights.shared)
+
+# Quiz state locks by chat ID, dropped when nobody holds them
+_quiz_locks: "WeakValueDictionary[int, asyncio.Lock]" = WeakValueDictionary()
 
 
 async def start(message: Message, state: FSMContext) -> None:
@@ -34,12 +74,12 @@ async def start(message: Message, state: FSMContext) -> None:
             deep_link_data = message.text.split()[1]
             lesson_id = int(deep_link_data)
             
-            # Check if user exists in the database
+            # Name and language of the user in one lookup
             user_id = float(message.from_user.id)
-            user_exists = await check_user_exists(user_id)
+            profile = await get_user_profile(user_id)
             
             
-            if not user_exists:
+            if profile is None:
                 # User doesn't exist, ask for name
                 await state.set_state(StudentStates.waiting_for_name)
                 await state.update_data(lesson_id=lesson_id)
@@ -48,96 +88,219 @@ async def start(message: Message, state: FSMContext) -> None:
                 )
                 return
             
-            lesson_text = await get_lesson_text(lesson_id)
-            name = await get_user_name(user_id)
-            language = await get_user_language(user_id)
+            name = profile["name"]
+            language = profile.get("language") or DEFAULT_LANGUAGE
             
-            # Send welcome message with lesson text
+            # Send welcome message
             await message.answer(
                 get_text("welcome_back_student", language, name)
             )
 
-            # Generate quiz using ChatGPT
-            api_key = os.getenv("API_CHATGPT")
-            api_base = os.getenv("API_BASE")
-            
-            if not api_key:
-                await message.answer(get_text("api_key_error", language))
-                return
-
-            client = OpenAI(
-                api_key=api_key,
-                base_url=api_base
-            )
-
-            response = client.beta.chat.completions.parse(
-                model="openai/gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": get_text("quiz_system_prompt", language)
-                    },
-                    {
-                        "role": "user",
-                        "content": lesson_text
-                    }
-                ],
-                temperature=0.4,
-                response_format=Quiz
-            )
-
-            # Get quiz data
-            quiz_data = response.choices[0].message.parsed
-            
-            # Send text of the lesson
-            await message.answer(get_text("lesson_text", language, lesson_text))
-            await message.answer(get_text("quiz_start", language))
-            
-            # Wait a moment before starting the quiz
-            await asyncio.sleep(2)
-            
-            # Store quiz data in state for the poll_answer handler
-            await state.update_data(
-                quiz_data=quiz_data.dict(),
-                current_question=0,
-                total_questions=len(quiz_data.questions),
-                user_id=message.from_user.id,
-                chat_id=message.chat.id,
-                correct_answers=0,
-                lesson_id=lesson_id,
-                language=language
-            )
-            
-            # Send the first question
-            await send_next_question(message.chat.id, state, message.bot)
+            # A worker sends the lesson text and the quiz
+            await enqueue_quiz(message, lesson_id, language)
 
         except ValueError:
-            language = await get_user_language(float(message.from_user.id)) if await check_user_exists(float(message.from_user.id)) else "ru"
+            language = await get_user_language(float(message.from_user.id))
             await message.answer(get_text("lesson_not_found", language))
-        except Exception as e:
-            print(e)
-            language = await get_user_language(float(message.from_user.id)) if await check_user_exists(float(message.from_user.id)) else "ru"
+        except Exception:
+            logger.exception("Error in start")
+            language = await get_user_language(float(message.from_user.id))
             await message.answer(get_text("general_error", language))
     else:
         # This is a regular start - teacher mode
         user_id = float(message.from_user.id)
-        language = await get_user_language(user_id) if await check_user_exists(user_id) else "ru"
+        language = await get_user_language(user_id)
         
         await state.set_state(TeacherStates.waiting_for_lesson_text)
         await message.answer(get_text("welcome_teacher", language))
 
 
+def quiz_lock(chat_id: int) -> asyncio.Lock:
+    """Lock for read-modify-write of a chat's quiz state within this process"""
+    lock = _quiz_locks.get(chat_id)
+    if lock is None:
+        lock = _quiz_locks[chat_id] = asyncio.Lock()
+    return lock
+
+
+async def load_quiz(lesson_id: int, language: str) -> Tuple[str, str, QuizStream]:
+    """
+    Get the lesson text, its pacing and its quiz stream
+    
+    Concurrent requests for the same lesson and language share one call.
+    With a question bank every student gets an own sample of its questions,
+    otherwise every student iterates the same stream from the first question.
+    
+    Raises:
+        ValueError: If the lesson does not exist
+        ApiKeyError: If the quiz has to be generated and the LLM is not configured
+    """
+    async def load() -> Tuple[str, str, list, Optional[QuizStream]]:
+        lesson_text, pacing = await asyncio.gather(get_lesson_text(lesson_id), get_lesson_pacing(lesson_id))
+        if QUESTION_BANK_SIZE:
+            bank = await get_bank(lesson_id, language)
+            if bank:
+                return lesson_text, pacing, bank, None
+        # No bank yet: the lesson was saved before banks or is still being generated
+        return lesson_text, pacing, [], await get_quiz_stream(lesson_id, language, lesson_text)
+    
+    lesson_text, pacing, bank, stream = await quiz_flights.do((lesson_id, language), load)
+    if stream is None:
+        stream = QuizStream(sample_quiz(bank), done=True)
+    return lesson_text, pacing, stream
+
+
+async def enqueue_quiz(message: Message, lesson_id: int, language: str) -> None:
+    """Queue the quiz of a lesson for the student and tell them if they have to wait"""
+    position = await get_job_queue().put(
+        "quiz",
+        {
+            "chat_id": message.chat.id,
+            "user_id": message.from_user.id,
+            "lesson_id": lesson_id,
+            "language": language
+        },
+        priority=PRIORITY_QUIZ
+    )
+    # None: the quiz of this lesson is already on its way to the student
+    if position:
+        await message.answer(get_text("quiz_queued", language, position))
+
+
+def lesson_pages(lesson_text: str, language: str) -> List[str]:
+    """Split the lesson text into messages that fit the Telegram limit"""
+    if len(lesson_text) <= LESSON_PAGE_CHARS:
+        return [get_text("lesson_text", language, lesson_text)]
+    
+    pages = split_text(lesson_text, LESSON_PAGE_CHARS)
+    return [
+        get_text("lesson_text_page", language, number, len(pages), page)
+        for number, page in enumerate(pages, 1)
+    ]
+
+
+async def run_quiz(
+    bot,
+    state: FSMContext,
+    chat_id: int,
+    user_id: int,
+    lesson_id: int,
+    lesson_text: str,
+    stream: QuizStream,
+    language: str,
+    pacing: str = DEFAULT_PACING
+) -> None:
+    """Stream the lesson quiz, sending every question as soon as it is generated"""
+    started = time.perf_counter()
+    
+    # Send text of the lesson while the questions are being generated
+    for page in lesson_pages(lesson_text, language):
+        await bot.send_message(chat_id=chat_id, text=page)
+    await bot.send_message(chat_id=chat_id, text=get_text("quiz_start", language))
+    
+    # Start a new quiz session: questions are added to the state as they arrive,
+    # and the first one is sent right away. A restart replaces the running quiz
+    quiz_id = secrets.token_hex(4)
+    async with quiz_lock(chat_id):
+        data = await state.get_data()
+        if not data.get("quiz_id"):
+            ACTIVE_QUIZZES.inc()
+        # Close the poll of the replaced quiz: its answer or deadline must not count
+        if data.get("current_poll_id"):
+            get_poll_scheduler().cancel(data["current_poll_id"])
+        await state.update_data(
+            quiz_id=quiz_id,
+            questions=[],
+            current_question=0,
+            total_questions=None,
+            waiting_for_question=True,
+            current_poll_id=None,
+            user_id=user_id,
+            chat_id=chat_id,
+            correct_answers=0,
+            lesson_id=lesson_id,
+            language=language,
+            pacing=pacing
+        )
+    
+    try:
+        async for question in stream:
+            if not await add_question(chat_id, state, bot, quiz_id, pack_question(question)):
+                # The student restarted the quiz in the meantime
+                return
+            
+            if started is not None:
+                TIME_TO_FIRST_QUESTION.observe(time.perf_counter() - started)
+                started = None
+    except Exception as e:
+        if started is not None:
+            # Nothing was sent: drop this quiz, unless the student has started
+            # a newer one meanwhile, and let the handler report the error
+            async with quiz_lock(chat_id):
+                data = await state.get_data()
+                if data.get("quiz_id") != quiz_id:
+                    return
+                await state.clear()
+                ACTIVE_QUIZZES.dec()
+            raise
+        logger.warning("Quiz generation stopped early", extra={"lesson_id": lesson_id, "error": repr(e)})
+    
+    await finish_questions(chat_id, state, bot, quiz_id)
+
+
+async def add_question(chat_id: int, state: FSMContext, bot, quiz_id: str, row: list) -> bool:
+    """Add a generated question to the quiz state and send it if the student is waiting"""
+    async with quiz_lock(chat_id):
+        data = await state.get_data()
+        if data.get("quiz_id") != quiz_id:
+            return False
+        
+        waiting = data.get("waiting_for_question", False)
+        await state.update_data(
+            questions=data.get("questions", []) + [row],
+            waiting_for_question=False
+        )
+    
+    if waiting:
+        await send_next_question(chat_id, state, bot)
+    return True
+
+
+async def finish_questions(chat_id: int, state: FSMContext, bot, quiz_id: str) -> None:
+    """Fix the number of questions once generation is over"""
+    async with quiz_lock(chat_id):
+        data = await state.get_data()
+        if data.get("quiz_id") != quiz_id:
+            return
+        
+        waiting = data.get("waiting_for_question", False)
+        await state.update_data(
+            total_questions=len(data.get("questions", [])),
+            waiting_for_question=False
+        )
+    
+    # The student has already answered every question: finish the quiz
+    if waiting:
+        await send_next_question(chat_id, state, bot)
+
+
 async def send_next_question(chat_id: int, state: FSMContext, bot) -> None:
     """Send the next question in the quiz"""
-    # Get the current state data
-    data = await state.get_data()
-    current_question = data.get("current_question", 0)
-    total_questions = data.get("total_questions", 0)
-    quiz_data = data.get("quiz_data", {})
-    language = data.get("language", "ru")
+    async with quiz_lock(chat_id):
+        # Get the current state data
+        data = await state.get_data()
+        current_question = data.get("current_question", 0)
+        total_questions = data.get("total_questions")  # None while questions are being generated
+        questions = data.get("questions", [])
+        language = data.get("language", "ru")
+        
+        # The next question is still being generated, it is sent as soon as it is ready
+        if current_question >= len(questions) and total_questions is None:
+            await state.update_data(waiting_for_question=True)
+            return
     
     # Check if we've reached the end of the quiz
-    if current_question >= total_questions:
+    if current_question >= len(questions):
         correct_answers = data.get("correct_answers", 0)
         # Calculate score from 0 to 100
         average_score = int((correct_answers / total_questions) * 100) if total_questions > 0 else 0
@@ -146,161 +309,169 @@ async def send_next_question(chat_id: int, state: FSMContext, bot) -> None:
         user_id = data.get("user_id")
         link_id = data.get("lesson_id")
         
-        # Store the result in the database
-        try:
-            await store_quiz_result(float(user_id), link_id, correct_answers, total_questions)
-            await bot.send_message(
-                chat_id=chat_id,
-                text=get_text("quiz_completed", language, correct_answers, total_questions, average_score)
-            )
-        except Exception as e:
-            print(f"Error storing quiz result: {e}")
-            await bot.send_message(
-                chat_id=chat_id,
-                text=get_text("quiz_completed", language, correct_answers, total_questions, average_score)
-            )
+        # Queue the result for the next bulk insert into the database
+        get_result_writer().add(quiz_result_row(float(user_id), link_id, correct_answers, total_questions))
+        await bot.send_message(
+            chat_id=chat_id,
+            text=get_text("quiz_completed", language, correct_answers, total_questions, average_score)
+        )
         
         # Clear the state
         await state.clear()
+        ACTIVE_QUIZZES.dec()
         return
     
-    # Get the current question data
-    question = quiz_data.get("questions", [])[current_question]
-    
-    # Ensure correct_option_id is within valid range (assuming 0-indexed)
-    correct_option_id = min(max(0, question["correctAnswer"]), len(question["options"]) - 1)
-    
-    # Get the explanation for this question
-    explanation = question.get("explanation", "Правильный ответ!")
+    # Get the current question data, correct_option_id is already in range
+    question, options, correct_option_id, explanation = questions[current_question]
     
-    # Send the question number
-    await bot.send_message(
-        chat_id=chat_id,
-        text=get_text("question_number", language, current_question + 1, total_questions)
-    )
+    # Send the question number, the total is unknown while questions are being generated
+    if total_questions is None:
+        question_number = get_text("question_number_streaming", language, current_question + 1)
+    else:
+        question_number = get_text("question_number", language, current_question + 1, total_questions)
+    await bot.send_message(chat_id=chat_id, text=question_number)
     
-    # Send the poll
+    # Send the poll, longer questions stay open longer
+    open_period = poll_open_period(question, options)
     sent_poll = await bot.send_poll(
         chat_id=chat_id,
-        question=question["question"],
-        options=question["options"],
+        question=question,
+        options=options,
         is_anonymous=False,
         type="quiz",
         correct_option_id=correct_option_id,
-        explanation=explanation,
-        open_period=15  # 15 seconds time limit
+        explanation=explanation or get_text("default_explanation", language),
+        open_period=open_period
     )
     
-    # Store the poll ID in the active_polls dictionary
-    active_polls[sent_poll.poll.id] = {
-        "chat_id": chat_id,
-        "user_id": data.get("user_id"),
-        "state": state,
-        "correct_option_id": correct_option_id,
-        "bot": bot,
-        "language": language
-    }
-    
     # Update the state with the current poll ID
-    await state.update_data(
-        current_poll_id=sent_poll.poll.id,
-        current_question=current_question
-    )
+    async with quiz_lock(chat_id):
+        await state.update_data(current_poll_id=sent_poll.poll.id)
     
-    # Set a timeout to move to the next question if the user doesn't answer
-    asyncio.create_task(handle_poll_timeout(sent_poll.poll.id, 16))  # 16 seconds (15 + 1 buffer)
+    # Move to the next question if the user doesn't answer in time
+    get_poll_scheduler().add(
+        sent_poll.poll.id,
+        chat_id=chat_id,
+        user_id=data.get("user_id"),
+        language=language,
+        timeout=open_period + POLL_DEADLINE_GRACE
+    )
 
 
-async def handle_poll_timeout(poll_id: str, timeout: int) -> None:
-    """Handle the timeout for a poll"""
-    await asyncio.sleep(timeout)
-    
-    # Check if the poll is still active (user hasn't answered yet)
-    if poll_id in active_polls:
-        poll_data = active_polls.pop(poll_id)
-        chat_id = poll_data.get("chat_id")
-        state = poll_data.get("state")
-        bot = poll_data.get("bot")
-        language = poll_data.get("language", "ru")
-        
+async def handle_poll_timeout(bot, state: FSMContext, poll_id: str, poll: PollRecord) -> None:
+    """Handle the timeout for a poll, called by the poll scheduler"""
+    async with quiz_lock(poll.chat_id):
         # Get the current state data
         data = await state.get_data()
-        current_question = data.get("current_question", 0)
-        quiz_data = data.get("quiz_data", {})
         
-        # Get the current question data
-        question = quiz_data.get("questions", [])[current_question]
-        
-        # Ensure correct_option_id is within valid range (assuming 0-indexed)
-        correct_option_id = min(max(0, question["correctAnswer"]), len(question["options"]) - 1)
-        correct_answer = question["options"][correct_option_id]
-        
-        # Update the state to move to the next question
-        await state.update_data(current_question=current_question + 1)
+        # Ignore polls of a quiz that was restarted or finished in the meantime
+        if data.get("current_poll_id") != poll_id:
+            return
         
-        # Send a message that time is up with the correct answer
-        await bot.send_message(
-            chat_id=chat_id,
-            text=get_text("time_up", language, correct_answer)
-        )
+        current_question = data.get("current_question", 0)
         
-        # Wait a moment before sending the next question
-        await asyncio.sleep(1)
+        # Get the current question data
+        _, options, correct_option_id, _ = data.get("questions", [])[current_question]
+        correct_answer = options[correct_option_id]
+        pacing = data.get("pacing", DEFAULT_PACING)
         
-        # Send the next question
-        await send_next_question(chat_id, state, bot)
+        # Close the poll and move to the next question
+        await state.update_data(current_poll_id=None, current_question=current_question + 1)
+    
+    # Send a message that time is up with the correct answer
+    await bot.send_message(
+        chat_id=poll.chat_id,
+        text=get_text("time_up", poll.language, correct_answer)
+    )
+    
+    # Give the student time to read the correct answer, unless the lesson is rapid
+    pause = pause_before_next(pacing, correct_answer)
+    if pause:
+        await asyncio.sleep(pause)
+    
+    # Send the next question
+    await send_next_question(poll.chat_id, state, bot)
 
 
 async def process_poll_answer(poll_answer: PollAnswer, state: FSMContext) -> None:
     """Process a poll answer"""
-    # Check if this poll is in our active polls
+    # Cancel the deadline if this process scheduled it
     poll_id = poll_answer.poll_id
-    if poll_id not in active_polls:
-        return
-    
-    # Get the poll data
-    poll_data = active_polls.pop(poll_id)
+    get_poll_scheduler().cancel(poll_id)
     
-    # Check if this answer is from the user who started the quiz
-    if poll_answer.user.id != poll_data.get("user_id"):
-        return
-    
-    # Get the state from the poll data
-    user_state = poll_data.get("state")
-    bot = poll_data.get("bot")
-    
-    # Get the current state data
-    data = await user_state.get_data()
-    current_question = data.get("current_question", 0)
-    correct_answers = data.get("correct_answers", 0)
-    chat_id = poll_data.get("chat_id")
+    # In a private chat the poll answer has the same state as the quiz messages
+    async with quiz_lock(poll_answer.user.id):
+        # The quiz state is shared by all processes: check that this poll is still open
+        data = await state.get_data()
+        if data.get("current_poll_id") != poll_id:
+            return
+        
+        # Check if this answer is from the user who started the quiz
+        if poll_answer.user.id != data.get("user_id"):
+            return
+        
+        current_question = data.get("current_question", 0)
+        correct_answers = data.get("correct_answers", 0)
+        chat_id = data.get("chat_id")
+        pacing = data.get("pacing", DEFAULT_PACING)
+        _, _, correct_option_id, explanation = data.get("questions", [])[current_question]
+        
+        # Check if the answer is correct
+        if poll_answer.option_ids and poll_answer.option_ids[0] == correct_option_id:
+            # Increment the correct answers count
+            correct_answers += 1
+        
+        # Close the poll and move to the next question, in one write
+        await state.update_data(
+            current_poll_id=None,
+            correct_answers=correct_answers,
+            current_question=current_question + 1
+        )
     
-    # Check if the answer is correct
-    if poll_answer.option_ids and poll_answer.option_ids[0] == poll_data.get("correct_option_id"):
-        # Increment the correct answers count
-        correct_answers += 1
-        await user_state.update_data(correct_answers=correct_answers)
+    # Telegram shows the explanation on answer: give the student time to read it,
+    # an answer without one or in a rapid lesson goes straight to the next question
+    pause = pause_before_next(pacing, explanation)
+    if pause:
+        await asyncio.sleep(pause)
     
-    # Update the state to move to the next question
-    await user_state.update_data(current_question=current_question + 1)
+    # Send the next question
+    await send_next_question(chat_id, state, poll_answer.bot)
+
+
+async def read_lesson_text(message: Message) -> Optional[str]:
+    """Get the lesson from a text message or a .txt document, None if there is none"""
+    if message.text:
+        return message.text
     
-    # Wait a moment before sending the next question
-    await asyncio.sleep(2)
+    document = message.document
+    if document is None or (document.file_size or 0) > LESSON_FILE_MAX_BYTES:
+        return None
+    if document.mime_type != "text/plain" and not (document.file_name or "").lower().endswith(".txt"):
+        return None
     
-    # Send the next question
-    await send_next_question(chat_id, user_state, bot)
+    data = await message.bot.download(document)
+    text = data.read().decode("utf-8-sig", errors="replace").strip()
+    return text or None
 
 
 async def process_lesson_text(message: Message, state: FSMContext) -> None:
+    lesson_text = await read_lesson_text(message)
+    if lesson_text is None:
+        # Keep waiting for the lesson
+        language = await get_user_language(float(message.from_user.id))
+        await message.answer(get_text("lesson_text_required", language))
+        return
+    
     try:
         user_id = float(message.from_user.id)
         language = await get_user_language(user_id)
         
         # Store the lesson text in Supabase
         lesson_id = await store_lesson_text(
-            text=message.text,
+            text=lesson_text,
             author_id=user_id
         )
+        invalidate_links_keyboards(user_id)
 
         # Generate student link
         bot_username = 'teacherhelpercu_bot'
@@ -309,8 +480,15 @@ async def process_lesson_text(message: Message, state: FSMContext) -> None:
         await message.answer(
             get_text("lesson_saved", language, student_link)
         )
-    except Exception as e:
-        print(e)
+        
+        # Generate the quiz before the first student opens the link
+        await get_job_queue().put(
+            "prefill",
+            {"lesson_id": lesson_id, "languages": sorted({DEFAULT_LANGUAGE, language})},
+            priority=PRIORITY_PREFILL
+        )
+    except Exception:
+        logger.exception("Error in process_lesson_text")
         user_id = float(message.from_user.id)
         language = await get_user_language(user_id)
         await message.answer(get_text("lesson_save_error", language))
@@ -318,6 +496,110 @@ async def process_lesson_text(message: Message, state: FSMContext) -> None:
         await state.clear()
 
 
+async def regenerate_lesson_quiz(message: Message, state: FSMContext) -> None:
+    """Handle /regenerate <lesson_id> to generate a new quiz for a lesson"""
+    user_id = float(message.from_user.id)
+    language = await get_user_language(user_id)
+    
+    args = message.text.split()
+    if len(args) < 2 or not args[1].isdigit():
+        await message.answer(get_text("regenerate_usage", language))
+        return
+    
+    lesson_id = int(args[1])
+    try:
+        # Only the author of the lesson can regenerate its quiz
+        if await get_lesson_author(lesson_id) != user_id:
+            await message.answer(get_text("lesson_not_found", language))
+            return
+        
+        await message.answer(get_text("quiz_regenerating", language, lesson_id))
+        await get_job_queue().put(
+            "regenerate",
+            {"chat_id": message.chat.id, "lesson_id": lesson_id, "language": language},
+            priority=PRIORITY_REGENERATE
+        )
+    except ValueError:
+        await message.answer(get_text("lesson_not_found", language))
+    except Exception:
+        logger.exception("Error in regenerate_lesson_quiz")
+        await message.answer(get_text("general_error", language))
+
+
+async def set_lesson_quiz_pacing(message: Message, state: FSMContext) -> None:
+    """Handle /pacing <lesson_id> [normal|rapid] to show or change the pacing of a lesson quiz"""
+    user_id = float(message.from_user.id)
+    language = await get_user_language(user_id)
+    
+    args = message.text.split()
+    if len(args) < 2 or not args[1].isdigit() or (len(args) > 2 and args[2] not in PACING_MODES):
+        await message.answer(get_text("pacing_usage", language))
+        return
+    
+    lesson_id = int(args[1])
+    try:
+        # Only the author of the lesson can change its pacing
+        if await get_lesson_author(lesson_id) != user_id:
+            await message.answer(get_text("lesson_not_found", language))
+            return
+        
+        if len(args) == 2:
+            pacing = await get_lesson_pacing(lesson_id)
+            await message.answer(get_text("pacing_current", language, lesson_id, get_text(f"pacing_{pacing}", language)))
+            return
+        
+        await set_lesson_pacing(lesson_id, args[2])
+        await message.answer(get_text("pacing_updated", language, lesson_id, get_text(f"pacing_{args[2]}", language)))
+    except ValueError:
+        await message.answer(get_text("lesson_not_found", language))
+    except Exception:
+        logger.exception("Error in set_lesson_quiz_pacing")
+        await message.answer(get_text("general_error", language))
+
+
+async def export_lesson_results(message: Message, state: FSMContext) -> None:
+    """Handle /export <lesson_id|all> [csv|xlsx] to send results as a file"""
+    user_id = float(message.from_user.id)
+    language = await get_user_language(user_id)
+    
+    args = message.text.split()[1:]
+    file_format = args[1].lower() if len(args) > 1 else "csv"
+    if not args or not (args[0].isdigit() or args[0] == "all") or file_format not in FORMATS:
+        await message.answer(get_text("export_usage", language))
+        return
+    
+    path = None
+    try:
+        if args[0] == "all":
+            chunks = iter_teacher_results(user_id)
+            filename = f"results_all.{file_format}"
+        else:
+            # Only the author of the lesson can export its results
+            lesson_id = int(args[0])
+            if await get_lesson_author(lesson_id) != user_id:
+                await message.answer(get_text("lesson_not_found", language))
+                return
+            chunks = iter_lesson_results(lesson_id)
+            filename = f"results_{lesson_id}.{file_format}"
+        
+        await message.answer(get_text("export_preparing", language))
+        path, count = await export_results(chunks, file_format)
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=get_text("export_done", language, count)
+        )
+    except ImportError:
+        await message.answer(get_text("export_xlsx_unavailable", language))
+    except ValueError:
+        await message.answer(get_text("lesson_not_found", language))
+    except Exception:
+        logger.exception("Error in export_lesson_results")
+        await message.answer(get_text("results_error", language))
+    finally:
+        if path is not None:
+            os.remove(path)
+
+
 async def process_student_name(message: Message, state: FSMContext) -> None:
     """Process the student's name and save it to the database"""
     try:
@@ -337,73 +619,76 @@ async def process_student_name(message: Message, state: FSMContext) -> None:
         data = await state.get_data()
         lesson_id = data.get("lesson_id")
         
-        # Get the lesson text
-        lesson_text = await get_lesson_text(lesson_id)
-        
         # Send welcome message
         await message.answer(
             get_text("name_saved", language, student_name)
         )
         
-        # Generate quiz using ChatGPT
-        api_key = os.getenv("API_CHATGPT")
-        api_base = os.getenv("API_BASE")
+        # A worker sends the lesson text and the quiz
+        await enqueue_quiz(message, lesson_id, language)
         
-        if not api_key:
-            await message.answer(get_text("api_key_error", language))
-            return
-
-        client = OpenAI(
-            api_key=api_key,
-            base_url=api_base
-        )
+    except Exception:
+        logger.exception("Error in process_student_name")
+        await message.answer(get_text("name_save_error", "ru"))  # Default to Russian for new users
+        # Only clear state on error
+        await state.clear()
 
-        response = client.beta.chat.completions.parse(
-            model="openai/gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": get_text("quiz_system_prompt", language)
-                },
-                {
-                    "role": "user",
-                    "content": lesson_text
-                }
-            ],
-            temperature=0.4,
-            response_format=Quiz
-        )
 
-        # Get quiz data
-        quiz_data = response.choices[0].message.parsed
-        
-        # Send text of the lesson
-        await message.answer(get_text("lesson_text", language, lesson_text))
-        await message.answer(get_text("quiz_start", language))
-        
-        # Wait a moment before starting the quiz
-        await asyncio.sleep(2)
-        
-        # Store quiz data in state for the poll_answer handler
-        await state.update_data(
-            quiz_data=quiz_data.dict(),
-            current_question=0,
-            total_questions=len(quiz_data.questions),
-            user_id=message.from_user.id,
-            chat_id=message.chat.id,
-            correct_answers=0,
-            lesson_id=lesson_id,
-            language=language
-        )
+async def links_keyboard(teacher_id: float, language: str, cursor: str = "") -> Optional[InlineKeyboardMarkup]:
+    """
+    Get the keyboard of one page of the teacher's links
+    
+    Args:
+        teacher_id: Telegram user ID of the teacher
+        language: Language of the buttons
+        cursor: "" for the first page, "a<id>" for links after and "b<id>" for links before a link ID
+        
+    Returns:
+        Keyboard or None if the teacher has no links
+    """
+    key = (teacher_id, language, cursor)
+    keyboard = _links_keyboards.get(key, _NOT_CACHED)
+    if keyboard is not _NOT_CACHED:
+        return keyboard
+    
+    after_id = int(cursor[1:]) if cursor.startswith("a") else None
+    before_id = int(cursor[1:]) if cursor.startswith("b") else None
+    
+    # One extra link shows whether there is a page further in that direction
+    links = await get_teacher_link_previews(teacher_id, LINKS_PAGE_SIZE + 1, after_id=after_id, before_id=before_id)
+    if before_id is not None:
+        has_prev = len(links) > LINKS_PAGE_SIZE
+        has_next = True
+        links = links[-LINKS_PAGE_SIZE:]
+    else:
+        has_prev = after_id is not None
+        has_next = len(links) > LINKS_PAGE_SIZE
+        links = links[:LINKS_PAGE_SIZE]
+    
+    keyboard = None
+    if links:
+        rows = [
+            [InlineKeyboardButton(text=f"{get_text('link_prefix', language, link['id'])}: {link['preview']}...", callback_data=f"link_{link['id']}")]
+            for link in links
+        ]
         
-        # Send the first question
-        await send_next_question(message.chat.id, state, message.bot)
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton(text=get_text("prev_page", language), callback_data=f"links_b{links[0]['id']}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton(text=get_text("next_page", language), callback_data=f"links_a{links[-1]['id']}"))
+        if navigation:
+            rows.append(navigation)
         
-    except Exception as e:
-        print(e)
-        await message.answer(get_text("name_save_error", "ru"))  # Default to Russian for new users
-        # Only clear state on error
-        await state.clear()
+        keyboard = InlineKeyboardMarkup(inline_keyboard=rows)
+    
+    _links_keyboards.set(key, keyboard)
+    return keyboard
+
+
+def invalidate_links_keyboards(teacher_id: float) -> None:
+    """Drop cached /links keyboards of a teacher"""
+    _links_keyboards.invalidate(lambda key: key[0] == teacher_id)
 
 
 async def show_teacher_links(message: Message, state: FSMContext) -> None:
@@ -411,60 +696,97 @@ async def show_teacher_links(message: Message, state: FSMContext) -> None:
     try:
         teacher_id = float(message.from_user.id)
         language = await get_user_language(teacher_id)
-        links = await get_teacher_links(teacher_id)
+        keyboard = await links_keyboard(teacher_id, language)
         
-        if not links:
+        if keyboard is None:
             await message.answer(get_text("no_links", language))
             return
         
-        # Create inline keyboard with links
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"{get_text('link_prefix', language, link['id'])}: {link['text'][:30]}...", callback_data=f"link_{link['id']}")] 
-            for link in links
-        ])
-        
         await message.answer(get_text("choose_link", language), reply_markup=keyboard)
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Error in show_teacher_links")
         teacher_id = float(message.from_user.id)
         language = await get_user_language(teacher_id)
         await message.answer(get_text("links_error", language))
 
 
+async def show_links_page(callback: CallbackQuery, state: FSMContext) -> None:
+    """Switch the links list to another page"""
+    try:
+        teacher_id = float(callback.from_user.id)
+        language = await get_user_language(teacher_id)
+        keyboard = await links_keyboard(teacher_id, language, callback.data.split("_", 1)[1])
+        
+        if keyboard is None:
+            await callback.message.edit_text(get_text("no_links", language))
+        else:
+            await callback.message.edit_reply_markup(reply_markup=keyboard)
+        await callback.answer()
+    except Exception:
+        logger.exception("Error in show_links_page")
+        teacher_id = float(callback.from_user.id)
+        language = await get_user_language(teacher_id)
+        await callback.answer(get_text("links_error", language))
+
+
 async def show_quiz_results(callback: CallbackQuery, state: FSMContext) -> None:
     """Show quiz results for a specific link"""
     try:
-        # Extract link ID from callback data
-        link_id = int(callback.data.split('_')[1])
+        # Extract link ID and page from callback data: link_<id>[_<page>]
+        parts = callback.data.split('_')
+        link_id = int(parts[1])
+        page = int(parts[2]) if len(parts) > 2 else 0
         user_id = float(callback.from_user.id)
         language = await get_user_language(user_id)
         
-        # Get quiz results for this link
-        results = await get_quiz_results_by_link(link_id)
+        # Summary, histogram and one page of students in one query
+        stats = await get_quiz_stats(link_id, limit=RESULTS_PAGE_SIZE, offset=page * RESULTS_PAGE_SIZE)
+        has_next = (page + 1) * RESULTS_PAGE_SIZE < stats["students"]
         
-        if not results:
+        if not stats["attempts"]:
             await callback.message.answer(get_text("no_results", language, link_id))
             await callback.answer()
             return
         
         # Format results as a message
-        message_text = get_text("results_title", language, link_id) + "\n\n"
-        
-        for i, result in enumerate(results, 1):
-            message_text += (
-                f"{i}. {result['name']}: {result['correct_answers']}/{result['total_questions']} "
-                f"({result['average_score']}%)\n"
-            )
+        lines = [
+            get_text("results_title", language, link_id),
+            "",
+            get_text("results_summary", language, stats["attempts"], stats["students"], f"{stats['mean_score']:g}", f"{stats['median_score']:g}"),
+            "",
+            get_text("results_histogram", language)
+        ]
+        
+        largest = max(bucket["count"] for bucket in stats["histogram"])
+        for bucket in stats["histogram"]:
+            bar = "█" * max(1, round(bucket["count"] / largest * 10))
+            lines.append(f"{bucket['bucket']:>2}-{bucket['bucket'] + 10}%: {bar} {bucket['count']}")
+        lines.append("")
+        
+        for i, row in enumerate(stats["rows"], page * RESULTS_PAGE_SIZE + 1):
+            lines.append(get_text(
+                "results_row", language, i, row["name"], row["best_score"],
+                row["latest_correct"], row["latest_total"], row["latest_score"], row["attempts"]
+            ))
+        
+        message_text = "\n".join(lines)
+        
+        # Add pagination and back buttons
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text=get_text("prev_page", language), callback_data=f"link_{link_id}_{page - 1}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton(text=get_text("next_page", language), callback_data=f"link_{link_id}_{page + 1}"))
         
-        # Add back button
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            *([navigation] if navigation else []),
             [InlineKeyboardButton(text=get_text("back_button", language), callback_data="back_to_links")]
         ])
         
         await callback.message.answer(message_text, reply_markup=keyboard)
         await callback.answer()
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Error in show_quiz_results")
         user_id = float(callback.from_user.id)
         language = await get_user_language(user_id)
         await callback.message.answer(get_text("results_error", language))
@@ -477,30 +799,87 @@ async def back_to_links(callback: CallbackQuery, state: FSMContext) -> None:
         user_id = float(callback.from_user.id)
         language = await get_user_language(user_id)
         
-        # Сначала получаем новое сообщение, затем удаляем старое
-        new_message = await callback.message.answer(get_text("loading_links", language))
-        await callback.message.delete()
-        
-        # Используем новое сообщение для показа списка ссылок
+        # Клавиатура обычно уже в кэше, поэтому сразу отправляем готовый список,
+        # затем удаляем старое сообщение
         teacher_id = float(callback.from_user.id)
-        links = await get_teacher_links(teacher_id)
+        keyboard = await links_keyboard(teacher_id, language)
         
-        if not links:
-            await new_message.edit_text(get_text("no_links", language))
-            await callback.answer()
-            return
-        
-        # Создаем клавиатуру с ссылками
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"{get_text('link_prefix', language, link['id'])}: {link['text'][:30]}...", callback_data=f"link_{link['id']}")] 
-            for link in links
-        ])
-        
-        await new_message.edit_text(get_text("choose_link", language), reply_markup=keyboard)
+        if keyboard is None:
+            await callback.message.answer(get_text("no_links", language))
+        else:
+            await callback.message.answer(get_text("choose_link", language), reply_markup=keyboard)
+        await callback.message.delete()
         await callback.answer()
-    except Exception as e:
-        print(f"Ошибка в back_to_links: {e}")
+    except Exception:
+        logger.exception("Error in back_to_links")
         user_id = float(callback.from_user.id)
         language = await get_user_language(user_id)
         await callback.answer(get_text("general_error", language))
-        
\ No newline at end of file
+        
+
+
+async def quiz_job(queue: JobQueue, job: Job) -> None:
+    """Load the quiz of a lesson and send it to the student"""
+    chat_id = job.payload["chat_id"]
+    user_id = job.payload["user_id"]
+    lesson_id = job.payload["lesson_id"]
+    language = job.payload["language"]
+    
+    try:
+        lesson_text, pacing, stream = await load_quiz(lesson_id, language)
+    except ApiKeyError:
+        await queue.bot.send_message(chat_id=chat_id, text=get_text("api_key_error", language))
+        return
+    except ValueError:
+        await queue.bot.send_message(chat_id=chat_id, text=get_text("lesson_not_found", language))
+        return
+    
+    state = queue.state_for(chat_id, user_id)
+    try:
+        await run_quiz(queue.bot, state, chat_id, user_id, lesson_id, lesson_text, stream, language, pacing)
+    except Exception as e:
+        # The lesson text is already sent and the LLM client has retried the
+        # generation: another attempt would only send the lesson again
+        raise FatalJobError("Quiz generation failed") from e
+
+
+async def regenerate_job(queue: JobQueue, job: Job) -> None:
+    """Generate a new quiz for a lesson and tell the teacher"""
+    chat_id = job.payload["chat_id"]
+    lesson_id = job.payload["lesson_id"]
+    language = job.payload["language"]
+    
+    try:
+        await regenerate_quiz(lesson_id, LANGUAGES.keys())
+    except ApiKeyError:
+        await queue.bot.send_message(chat_id=chat_id, text=get_text("api_key_error", language))
+        return
+    except ValueError:
+        await queue.bot.send_message(chat_id=chat_id, text=get_text("lesson_not_found", language))
+        return
+    except Exception as e:
+        # The LLM client retries on its own, job retries would multiply its attempts
+        raise FatalJobError("Quiz regeneration failed") from e
+    
+    await queue.bot.send_message(chat_id=chat_id, text=get_text("quiz_regenerated", language, lesson_id))
+
+
+async def prefill_job(queue: JobQueue, job: Job) -> None:
+    """Generate the quiz of a freshly saved lesson ahead of the students"""
+    lesson_id = job.payload["lesson_id"]
+    lesson_text = await get_lesson_text(lesson_id)
+    prefill = build_question_bank if QUESTION_BANK_SIZE else prefill_quiz_cache
+    await prefill(lesson_id, lesson_text, job.payload["languages"])
+
+
+async def report_job_failure(queue: JobQueue, job: Job, error: BaseException) -> None:
+    """Tell the user that their job failed after all retries"""
+    await queue.bot.send_message(chat_id=job.payload["chat_id"], text=get_text("general_error", job.payload["language"]))
+
+
+JOB_TYPES = {
+    # A repeated /start of a lesson while its quiz is being sent is dropped
+    "quiz": JobType(quiz_job, report_job_failure, key=lambda payload: (payload["chat_id"], payload["lesson_id"])),
+    "regenerate": JobType(regenerate_job, report_job_failure),
+    "prefill": JobType(prefill_job)
+}
@@ -0,0 +1,47 @@
+from typing import Any, Awaitable, Callable, Dict
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+from app.utils.metrics import HANDLER_ERRORS, HANDLER_SECONDS, counter, histogram
+
+TELEGRAM_REQUEST_SECONDS = histogram("telegram_request_seconds", "Duration of Bot API requests", ["method"])
+TELEGRAM_REQUEST_ERRORS = counter("telegram_request_errors_total", "Bot API requests that failed", ["method"])
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Observe the duration of every handler, labelled with its name"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        with HANDLER_SECONDS.time(handler=name):
+            try:
+                return await handler(event, data)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Observe the duration of every Bot API request, labelled with its method"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        name = method.__api_method__
+        with TELEGRAM_REQUEST_SECONDS.time(method=name):
+            try:
+                return await make_request(bot, method)
+            except Exception:
+                TELEGRAM_REQUEST_ERRORS.inc(method=name)
+                raise
@@ -0,0 +1,174 @@
+import os
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message
+from app.utils.cache import TTLCache
+from app.utils.language import get_text, get_user_language
+from app.utils.metrics import counter
+
+THROTTLED_MESSAGES = counter("throttled_messages_total", "Messages by throttling result", ["result"])
+
+
+class TokenBucket:
+    """Allows rate events per second on average and bursts of up to capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self) -> bool:
+        """Take one token, False if the bucket is empty"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Rate limits for incoming messages
+
+    - Every user has a token bucket for all messages
+    - Handlers flagged quiz_start also use a token bucket per lesson and
+      a global limit of quiz start handlers running at once
+    - A text message identical to one of the same user still being handled is
+      dropped; documents and other messages without text are never coalesced
+
+    Quiz start handlers only queue a job, so the limit covers the profile
+    lookup and the enqueue; generations are bounded by the job workers and
+    the LLM concurrency. A repeated /start of a lesson whose quiz job is
+    still queued or running is dropped by the job queue.
+    """
+
+    def __init__(
+        self,
+        user_rate: float = 1,
+        user_burst: float = 5,
+        lesson_rate: float = 20,
+        lesson_burst: float = 200,
+        max_quiz_starts: int = 100,
+        quiz_start_wait: float = 10
+    ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.lesson_rate = lesson_rate
+        self.lesson_burst = lesson_burst
+        self.quiz_start_wait = quiz_start_wait
+        # Idle buckets are full again after burst / rate seconds and can be dropped
+        self._user_buckets = TTLCache(maxsize=100000, ttl=user_burst / user_rate)
+        self._lesson_buckets = TTLCache(maxsize=10000, ttl=lesson_burst / lesson_rate)
+        self._quiz_starts = asyncio.Semaphore(max_quiz_starts)
+        self._in_flight: Set[Hashable] = set()
+        self.counters = {
+            "allowed": 0,
+            "coalesced": 0,
+            "rejected_user": 0,
+            "rejected_lesson": 0,
+            "rejected_busy": 0
+        }
+
+    def _count(self, result: str) -> None:
+        self.counters[result] += 1
+        THROTTLED_MESSAGES.inc(result=result)
+
+    @staticmethod
+    def _consume(buckets: TTLCache, key: Hashable, rate: float, capacity: float) -> bool:
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rate, capacity)
+        allowed = bucket.consume()
+        buckets.set(key, bucket)
+        return allowed
+
+    @staticmethod
+    async def _lesson_id(data: Dict[str, Any]) -> Optional[int]:
+        # /start <lesson_id> or the lesson of a student who is entering the name
+        command = data.get("command")
+        if command is not None:
+            return int(command.args) if command.args and command.args.isdigit() else None
+        state = data.get("state")
+        if state is not None:
+            return (await state.get_data()).get("lesson_id")
+        return None
+
+    async def _reject(self, event: Message, reason: str) -> None:
+        self._count(reason)
+        language = await get_user_language(float(event.from_user.id))
+        await event.answer(get_text("too_many_requests", language))
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any]
+    ) -> Any:
+        if event.from_user is None:
+            return await handler(event, data)
+
+        # Different .txt lessons have no text either, they must not look alike
+        if event.text is None:
+            return await self._throttle(handler, event, data)
+
+        request = (event.from_user.id, event.text)
+        if request in self._in_flight:
+            self._count("coalesced")
+            return None
+
+        self._in_flight.add(request)
+        try:
+            return await self._throttle(handler, event, data)
+        finally:
+            self._in_flight.discard(request)
+
+    async def _throttle(self, handler: Callable, event: Message, data: Dict[str, Any]) -> Any:
+        # Spam from one user is dropped silently, answering it would be spam too
+        if not self._consume(self._user_buckets, event.from_user.id, self.user_rate, self.user_burst):
+            self._count("rejected_user")
+            return None
+
+        lesson_id = await self._lesson_id(data) if get_flag(data, "quiz_start") else None
+        if lesson_id is None:
+            self._count("allowed")
+            return await handler(event, data)
+
+        if not self._consume(self._lesson_buckets, lesson_id, self.lesson_rate, self.lesson_burst):
+            await self._reject(event, "rejected_lesson")
+            return None
+
+        try:
+            await asyncio.wait_for(self._quiz_starts.acquire(), self.quiz_start_wait)
+        except asyncio.TimeoutError:
+            await self._reject(event, "rejected_busy")
+            return None
+
+        try:
+            self._count("allowed")
+            return await handler(event, data)
+        finally:
+            self._quiz_starts.release()
+
+    def stats(self) -> Dict[str, int]:
+        """Get allowed, coalesced and rejected message counters"""
+        return dict(self.counters)
+
+
+def create_throttling_middleware() -> ThrottlingMiddleware:
+    """Create the throttling middleware from environment variables"""
+    return ThrottlingMiddleware(
+        user_rate=float(os.getenv("THROTTLE_USER_RATE", "1")),
+        user_burst=float(os.getenv("THROTTLE_USER_BURST", "5")),
+        lesson_rate=float(os.getenv("THROTTLE_LESSON_RATE", "20")),
+        lesson_burst=float(os.getenv("THROTTLE_LESSON_BURST", "200")),
+        max_quiz_starts=int(os.getenv("MAX_QUIZ_STARTS", "100")),
+        quiz_start_wait=float(os.getenv("QUIZ_START_WAIT", "10"))
+    )
@@ -1,17 +1,30 @@
-from app.handlers.start import start, process_lesson_text, process_poll_answer, process_student_name, show_teacher_links, show_quiz_results, back_to_links
+from app.handlers.start import start, process_lesson_text, process_poll_answer, process_student_name, show_teacher_links, show_links_page, show_quiz_results, back_to_links, regenerate_lesson_quiz, set_lesson_quiz_pacing, export_lesson_results
 from app.handlers.chatgpt import chatgpt, process_chatgpt
 from app.handlers.language import language_command, language_callback
 from app.states.state import TeacherStates, StudentStates, ChatGptStates
+from app.middlewares.throttling import create_throttling_middleware
+from app.middlewares.metrics import HandlerMetricsMiddleware
 from aiogram.filters import Command
 
 def register_handlers(dp):
-    # Основные обработчики
-    dp.message.register(start, Command("start"))
+    # Ограничение частоты сообщений; счетчики доступны через dp["throttling"].stats()
+    throttling = create_throttling_middleware()
+    dp.message.middleware(throttling)
+    dp["throttling"] = throttling
+    
+    # Длительность каждого обработчика (handler_seconds на /metrics)
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+    dp.poll_answer.middleware(handler_metrics)
+    
+    # Основные обработчики, quiz_start - обработчики, которые запускают квиз
+    dp.message.register(start, Command("start"), flags={"quiz_start": True})
     dp.message.register(process_lesson_text, TeacherStates.waiting_for_lesson_text)
     dp.poll_answer.register(process_poll_answer)
     
     # Обработчик для имени пользователя
-    dp.message.register(process_student_name, StudentStates.waiting_for_name)
+    dp.message.register(process_student_name, StudentStates.waiting_for_name, flags={"quiz_start": True})
     
     # Обработчики для ChatGPT
     # dp.message.register(chatgpt, Command("chatgpt"))
@@ -19,6 +32,10 @@ def register_handlers(dp):
     
     # Обработчики для учителя
     dp.message.register(show_teacher_links, Command("links"))
+    dp.message.register(regenerate_lesson_quiz, Command("regenerate"))
+    dp.message.register(set_lesson_quiz_pacing, Command("pacing"))
+    dp.message.register(export_lesson_results, Command("export"))
+    dp.callback_query.register(show_links_page, lambda c: c.data.startswith("links_"))
     dp.callback_query.register(show_quiz_results, lambda c: c.data.startswith("link_"))
     dp.callback_query.register(back_to_links, lambda c: c.data == "back_to_links")
     
@@ -0,0 +1,49 @@
+import re
+from typing import List
+
+# Границы, по которым режется текст, от самой крупной к самой мелкой
+_PARAGRAPHS = re.compile(r"\n\s*\n")
+_LINES = re.compile(r"\n")
+_SENTENCES = re.compile(r"(?<=[.!?…])\s+")
+_WORDS = re.compile(r"\s+")
+_SEPARATORS = [(_PARAGRAPHS, "\n\n"), (_LINES, "\n"), (_SENTENCES, " "), (_WORDS, " ")]
+
+
+def _split(text: str, max_chars: int, level: int) -> List[str]:
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(_SEPARATORS):
+        # A single word longer than a chunk
+        return [text[start:start + max_chars] for start in range(0, len(text), max_chars)]
+
+    pattern, joiner = _SEPARATORS[level]
+    chunks: List[str] = []
+    for part in pattern.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        # Pack consecutive parts into one chunk while they fit
+        for piece in _split(part, max_chars, level + 1):
+            if chunks and len(chunks[-1]) + len(joiner) + len(piece) <= max_chars:
+                chunks[-1] += joiner + piece
+            else:
+                chunks.append(piece)
+    return chunks
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    Split text into chunks of at most max_chars characters
+
+    Chunks end on paragraph boundaries where possible, then on line breaks,
+    sentences and words; consecutive paragraphs are packed into one chunk
+    while they fit.
+
+    Args:
+        text: Text to split
+        max_chars: Maximum length of a chunk
+
+    Returns:
+        Chunks in order, a single one if the text fits
+    """
+    return _split(text.strip(), max_chars, 0)
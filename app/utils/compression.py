@@ -0,0 +1,69 @@
+import os
+import gzip
+import base64
+import hashlib
+from typing import Tuple
+
+# Сжатие текстов уроков в таблице lesson_bodies: gzip, zstd (pip install zstandard) или none
+LESSON_COMPRESSION = os.getenv("LESSON_COMPRESSION", "gzip")
+# Короткие тексты хранятся как есть: сжатие и base64 их только увеличат
+LESSON_COMPRESS_MIN_BYTES = int(os.getenv("LESSON_COMPRESS_MIN_BYTES", "1024"))
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of a text, the key of its lesson body"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        # mtime=0 keeps the output the same for the same text
+        return gzip.compress(data, mtime=0)
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=19).compress(data)
+    raise ValueError(f"Unknown encoding: {encoding}")
+
+
+def compress_text(text: str, encoding: str = LESSON_COMPRESSION) -> Tuple[str, str]:
+    """
+    Encode a lesson text for storage in a text column
+
+    Args:
+        text: Lesson text
+        encoding: gzip, zstd or none
+
+    Returns:
+        Encoding actually used and the stored value: the text itself for
+        "plain", base64 of the compressed text otherwise
+    """
+    data = text.encode("utf-8")
+    if encoding in ("none", "plain") or len(data) < LESSON_COMPRESS_MIN_BYTES:
+        return "plain", text
+
+    stored = base64.b64encode(_compress(data, encoding)).decode("ascii")
+    if len(stored) >= len(data):
+        return "plain", text
+    return encoding, stored
+
+
+def decompress_text(encoding: str, stored: str) -> str:
+    """
+    Decode a value written by compress_text
+
+    Raises:
+        ImportError: If the text is zstd-compressed and zstandard is not installed
+        ValueError: If the encoding is unknown
+    """
+    if encoding == "plain":
+        return stored
+
+    data = base64.b64decode(stored)
+    if encoding == "gzip":
+        return gzip.decompress(data).decode("utf-8")
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    raise ValueError(f"Unknown encoding: {encoding}")
@@ -1,41 +1,168 @@
-from supabase import create_client
+from typing import TYPE_CHECKING, List, Optional
+import asyncio
+import logging
 import os
 from dotenv import load_dotenv
+from app.utils.cache import TTLCache
+from app.utils.compression import compress_text, content_hash, decompress_text
+from app.utils.metrics import counter, histogram, register_cache, timed
+
+# supabase импортируется в init_db, а не при импорте модуля: это ускоряет старт
+if TYPE_CHECKING:
+    from supabase import AsyncClient
 
 load_dotenv()
 
-supabase = create_client(
-    os.getenv("URL_SUPABASE"),
-    os.getenv("API_SUPABASE")
+logger = logging.getLogger(__name__)
+
+# Every query function below is timed, labelled with its name
+DB_QUERY_SECONDS = histogram("db_query_seconds", "Duration of database.py functions", ["function"])
+DB_ERRORS = counter("db_errors_total", "database.py functions that raised", ["function"])
+
+# Один асинхронный клиент на процесс: запросы не блокируют event loop,
+# а HTTP-соединения к PostgREST переиспользуются между вызовами
+_supabase: Optional["AsyncClient"] = None
+_supabase_lock = asyncio.Lock()
+
+async def init_db() -> "AsyncClient":
+    """
+    Create the shared async Supabase client, called from the startup hook
+    """
+    global _supabase
+    async with _supabase_lock:
+        if _supabase is None:
+            from supabase import acreate_client
+
+            _supabase = await acreate_client(
+                os.getenv("URL_SUPABASE"),
+                os.getenv("API_SUPABASE")
+            )
+    return _supabase
+
+async def get_supabase() -> "AsyncClient":
+    """
+    Get the shared async Supabase client, creating it if init_db has not run
+    """
+    if _supabase is None:
+        return await init_db()
+    return _supabase
+
+async def close_db() -> None:
+    """Close the HTTP connections of the shared Supabase client"""
+    global _supabase
+    if _supabase is not None:
+        await _supabase.postgrest.aclose()
+        _supabase = None
+
+# Профили пользователей (имя и язык) по user_id. Отсутствующий пользователь
+# кэшируется как None ненадолго, чтобы другой процесс успел его сохранить
+_profile_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300"))
 )
+register_cache("user_profiles", _profile_cache)
+_MISSING_PROFILE_TTL = 10
+_NOT_CACHED = object()
 
+# Тексты уроков по ID ссылки. Текст урока не меняется, TTL только освобождает память
+_lesson_cache = TTLCache(
+    maxsize=int(os.getenv("LESSON_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("LESSON_CACHE_TTL", "3600"))
+)
+register_cache("lessons", _lesson_cache)
+
+# Темп квиза по ID ссылки. Учитель может его поменять, поэтому TTL короткий
+_pacing_cache = TTLCache(maxsize=int(os.getenv("LESSON_CACHE_SIZE", "256")), ttl=60)
+register_cache("lesson_pacing", _pacing_cache)
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
 async def store_lesson_text(text: str, author_id: float) -> int:
     """
-    Store lesson text in the links table and return the inserted ID
+    Store a lesson and return the ID of its link
+    
+    The text goes to lesson_bodies keyed by its hash, compressed if it is
+    long; a text saved before is not stored again. The links row only
+    references the body (migrations/add_lesson_bodies_table.sql).
     """
-    data = {
-        "text": text,
-        "author_id": author_id
-    }
-    result = supabase.table("links").insert(data).execute()
-    return result.data[0]["id"]
+    # Long texts take milliseconds to compress, not on the event loop
+    encoding, body = await asyncio.to_thread(compress_text, text)
+    supabase = await get_supabase()
+    result = await supabase.rpc(
+        "store_lesson",
+        {
+            "p_author_id": author_id,
+            "p_hash": content_hash(text),
+            "p_encoding": encoding,
+            "p_body": body,
+            "p_length": len(text),
+            "p_preview": text[:30]
+        }
+    ).execute()
+    lesson_id = result.data
+    _lesson_cache.set(lesson_id, text)
+    return lesson_id
 
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
 async def get_lesson_text(lesson_id: int) -> str:
     """
-    Get lesson text from the links table by ID
+    Get lesson text by the link ID
+    
+    Lessons never change, so texts are cached in the process. Lessons saved
+    before lesson_bodies existed are read from links.text.
     """
-    result = supabase.table("links").select("text").eq("id", lesson_id).execute()
+    text = _lesson_cache.get(lesson_id)
+    if text is not None:
+        return text
+    
+    supabase = await get_supabase()
+    result = await supabase.table("links") \
+        .select("text, lesson_bodies(encoding, body)") \
+        .eq("id", lesson_id) \
+        .execute()
     if not result.data:
         raise ValueError("Lesson not found")
-    return result.data[0]["text"]
+    
+    row = result.data[0]
+    body = row.get("lesson_bodies")
+    text = decompress_text(body["encoding"], body["body"]) if body else row["text"]
+    _lesson_cache.set(lesson_id, text)
+    return text
 
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def get_user_profile(user_id: float) -> Optional[dict]:
+    """
+    Get name and language of a user in one query
+    
+    Args:
+        user_id: Telegram user ID
+        
+    Returns:
+        Dict with name and language or None if user not found
+    """
+    profile = _profile_cache.get(user_id, _NOT_CACHED)
+    if profile is not _NOT_CACHED:
+        return profile
+    
+    supabase = await get_supabase()
+    result = await supabase.table("users").select("name, language").eq("user_id", user_id).execute()
+    profile = result.data[0] if result.data else None
+    _profile_cache.set(user_id, profile, ttl=None if profile else _MISSING_PROFILE_TTL)
+    return profile
+
+def invalidate_user_profile(user_id: float) -> None:
+    """
+    Drop a cached user profile after the users row has changed
+    """
+    _profile_cache.pop(user_id)
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
 async def check_user_exists(user_id: float) -> bool:
     """
     Check if a user exists in the users table
     """
-    result = supabase.table("users").select("id").eq("user_id", user_id).execute()
-    return len(result.data) > 0
+    return await get_user_profile(user_id) is not None
 
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
 async def save_user(user_id: float, name: str, language: str = "ru") -> int:
     """
     Save a new user to the users table
@@ -45,19 +172,22 @@ async def save_user(user_id: float, name: str, language: str = "ru") -> int:
         "name": name,
         "language": language
     }
-    result = supabase.table("users").insert(data).execute()
+    supabase = await get_supabase()
+    result = await supabase.table("users").insert(data).execute()
+    invalidate_user_profile(user_id)
     return result.data[0]["id"] 
 
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
 async def get_user_name(user_id: float) -> str:
     """
     Get user name from the users table by ID
     """
-    result = supabase.table("users").select("name").eq("user_id", user_id).execute()
-    return result.data[0]["name"] if result.data else None
+    profile = await get_user_profile(user_id)
+    return profile["name"] if profile else None
 
-async def store_quiz_result(user_id: float, link_id: int, correct_answers: int, total_questions: int) -> int:
+def quiz_result_row(user_id: float, link_id: int, correct_answers: int, total_questions: int) -> dict:
     """
-    Store quiz result in the quiz_results table
+    Build a quiz_results row
     
     Args:
         user_id: Telegram user ID
@@ -66,21 +196,51 @@ async def store_quiz_result(user_id: float, link_id: int, correct_answers: int,
         total_questions: Total number of questions
         
     Returns:
-        ID of the inserted record
+        Row data with the average score (0-100)
     """
-    # Calculate average score (0-100)
     average_score = int((correct_answers / total_questions) * 100) if total_questions > 0 else 0
     
-    data = {
+    return {
         "student_id": user_id,
         "link_id": link_id,
         "correct_answers": correct_answers,
         "total_questions": total_questions,
         "average_score": average_score
     }
-    result = supabase.table("quiz_results").insert(data).execute()
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def store_quiz_result(user_id: float, link_id: int, correct_answers: int, total_questions: int) -> int:
+    """
+    Store quiz result in the quiz_results table
+    
+    Args:
+        user_id: Telegram user ID
+        link_id: ID of the lesson link
+        correct_answers: Number of correct answers
+        total_questions: Total number of questions
+        
+    Returns:
+        ID of the inserted record
+    """
+    data = quiz_result_row(user_id, link_id, correct_answers, total_questions)
+    supabase = await get_supabase()
+    result = await supabase.table("quiz_results").insert(data).execute()
     return result.data[0]["id"] if result.data else None
 
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def store_quiz_results(rows: List[dict]) -> None:
+    """
+    Store many quiz results in the quiz_results table with one request
+    
+    Args:
+        rows: Rows built by quiz_result_row
+    """
+    supabase = await get_supabase()
+    from postgrest.types import ReturnMethod
+
+    await supabase.table("quiz_results").insert(rows, returning=ReturnMethod.minimal).execute()
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
 async def get_teacher_links(teacher_id: float):
     """
     Get all links created by a teacher
@@ -89,41 +249,110 @@ async def get_teacher_links(teacher_id: float):
         teacher_id: Telegram user ID of the teacher
         
     Returns:
-        List of links with their IDs and text
+        List of links with their IDs and text previews
     """
-    result = supabase.table("links").select("id, text").eq("author_id", teacher_id).execute()
+    supabase = await get_supabase()
+    result = await supabase.table("link_previews").select("id, preview").eq("author_id", teacher_id).execute()
     return result.data if result.data else []
 
-async def get_quiz_results_by_link(link_id: int):
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def get_teacher_link_previews(
+    teacher_id: float,
+    limit: int,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None
+) -> List[dict]:
+    """
+    Get one page of links created by a teacher, ordered by ID
+    
+    Args:
+        teacher_id: Telegram user ID of the teacher
+        limit: Maximum number of links
+        after_id: Return links with a greater ID
+        before_id: Return the last links with a smaller ID
+        
+    Returns:
+        List of links with their IDs and the first 30 characters of the text
+    """
+    # Текст урока обрезается в базе (view link_previews), целиком он не передается
+    supabase = await get_supabase()
+    query = supabase.table("link_previews").select("id, preview").eq("author_id", teacher_id)
+    if before_id is not None:
+        query = query.lt("id", before_id).order("id", desc=True)
+    else:
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        query = query.order("id")
+    result = await query.limit(limit).execute()
+    
+    links = result.data or []
+    return links[::-1] if before_id is not None else links
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def get_quiz_results_by_link(
+    link_id: int,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    after_id: Optional[int] = None
+):
     """
-    Get all quiz results for a specific link
+    Get quiz results for a specific link, ordered by ID
     
     Args:
         link_id: ID of the lesson link
+        limit: Maximum number of results, all results if None
+        offset: Number of results to skip
+        after_id: Return results with a greater ID (keyset pagination)
         
     Returns:
         List of quiz results with student names and scores
     """
-    result = supabase.table("quiz_results").select("*").eq("link_id", link_id).execute()
+    # Имена учеников подтягиваются тем же запросом через внешний ключ
+    supabase = await get_supabase()
+    query = (
+        supabase.table("quiz_results")
+        .select("*, users!quiz_results_student_id_fkey!inner(name)")
+        .eq("link_id", link_id)
+        .order("id")
+    )
+    if after_id is not None:
+        query = query.gt("id", after_id)
+    if limit is not None:
+        query = query.range(offset, offset + limit - 1)
+    elif offset:
+        query = query.offset(offset)
+    result = await query.execute()
     
-    # Если есть результаты, получаем имена пользователей
-    if result.data:
-        # Создаем список для хранения результатов с именами
-        results_with_names = []
-        
-        for quiz_result in result.data:
-            # Получаем имя пользователя
-            user_result = supabase.table("users").select("name").eq("user_id", quiz_result["student_id"]).execute()
-            
-            if user_result.data:
-                # Добавляем имя к результату
-                quiz_result["name"] = user_result.data[0]["name"]
-                results_with_names.append(quiz_result)
-        
-        return results_with_names
+    results_with_names = []
+    for quiz_result in result.data or []:
+        quiz_result["name"] = quiz_result.pop("users")["name"]
+        results_with_names.append(quiz_result)
+    
+    return results_with_names
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def get_quiz_stats(link_id: int, limit: int, offset: int = 0) -> dict:
+    """
+    Get statistics of a lesson computed in the database
     
-    return []
+    Args:
+        link_id: ID of the lesson link
+        limit: Maximum number of students
+        offset: Number of students to skip
+        
+    Returns:
+        Dict with attempts, students, mean_score, median_score, histogram
+        (bucket and count) and rows: one page of students with name, attempts,
+        best_score, latest_correct, latest_total and latest_score
+    """
+    supabase = await get_supabase()
+    result = await supabase.rpc(
+        "lesson_quiz_stats",
+        {"p_link_id": link_id, "p_limit": limit, "p_offset": offset}
+    ).execute()
+    return result.data
 
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
 async def get_user_language(user_id: float) -> str:
     """
     Get user language from the users table by ID
@@ -134,9 +363,10 @@ async def get_user_language(user_id: float) -> str:
     Returns:
         Language code (e.g., "ru", "en") or None if user not found
     """
-    result = supabase.table("users").select("language").eq("user_id", user_id).execute()
-    return result.data[0]["language"] if result.data and "language" in result.data[0] else None
+    profile = await get_user_profile(user_id)
+    return profile.get("language") if profile else None
 
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
 async def set_user_language(user_id: float, language: str) -> bool:
     """
     Set user language in the users table
@@ -154,11 +384,137 @@ async def set_user_language(user_id: float, language: str) -> bool:
         
         if user_exists:
             # Update existing user
-            result = supabase.table("users").update({"language": language}).eq("user_id", user_id).execute()
+            supabase = await get_supabase()
+            result = await supabase.table("users").update({"language": language}).eq("user_id", user_id).execute()
+            invalidate_user_profile(user_id)
             return True
         else:
             # User doesn't exist, can't update language
             return False
-    except Exception as e:
-        print(f"Error setting user language: {e}")
-        return False
\ No newline at end of file
+    except Exception:
+        logger.exception("Error setting user language", extra={"user_id": user_id})
+        return False
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def get_lesson_author(lesson_id: int) -> Optional[float]:
+    """
+    Get the author ID of a lesson from the links table
+    """
+    supabase = await get_supabase()
+    result = await supabase.table("links").select("author_id").eq("id", lesson_id).execute()
+    if not result.data:
+        raise ValueError("Lesson not found")
+    return result.data[0]["author_id"]
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def get_lesson_pacing(lesson_id: int) -> str:
+    """
+    Get the quiz pacing of a lesson, "normal" or "rapid"
+    
+    Raises:
+        ValueError: If the lesson does not exist
+    """
+    pacing = _pacing_cache.get(lesson_id)
+    if pacing is not None:
+        return pacing
+    
+    supabase = await get_supabase()
+    result = await supabase.table("links").select("pacing").eq("id", lesson_id).execute()
+    if not result.data:
+        raise ValueError("Lesson not found")
+    pacing = result.data[0]["pacing"]
+    _pacing_cache.set(lesson_id, pacing)
+    return pacing
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def set_lesson_pacing(lesson_id: int, pacing: str) -> None:
+    """
+    Set the quiz pacing of a lesson (migrations/add_link_pacing_column.sql)
+    """
+    supabase = await get_supabase()
+    await supabase.table("links").update({"pacing": pacing}).eq("id", lesson_id).execute()
+    _pacing_cache.set(lesson_id, pacing)
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def get_cached_quiz(cache_key: str) -> Optional[dict]:
+    """
+    Get a generated quiz from the quiz_cache table
+    
+    Args:
+        cache_key: Key built from lesson ID, language, text hash and prompt version
+        
+    Returns:
+        Quiz data or None if it is not cached
+    """
+    supabase = await get_supabase()
+    result = await supabase.table("quiz_cache").select("quiz").eq("cache_key", cache_key).execute()
+    return result.data[0]["quiz"] if result.data else None
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def store_cached_quiz(cache_key: str, link_id: int, language: str, quiz: dict) -> None:
+    """
+    Store a generated quiz in the quiz_cache table
+    
+    Args:
+        cache_key: Key built from lesson ID, language, text hash and prompt version
+        link_id: ID of the lesson link
+        language: Language code of the quiz
+        quiz: Quiz data
+    """
+    data = {
+        "cache_key": cache_key,
+        "link_id": link_id,
+        "language": language,
+        "quiz": quiz
+    }
+    supabase = await get_supabase()
+    await supabase.table("quiz_cache").upsert(data).execute()
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def get_question_bank(link_id: int, language: str, prompt_version: int) -> List[dict]:
+    """
+    Get the pool of generated questions of a lesson
+    
+    Args:
+        link_id: ID of the lesson link
+        language: Language code of the questions
+        prompt_version: Version of the prompt the questions were generated with
+        
+    Returns:
+        List of questions, empty if the pool has not been generated yet
+    """
+    supabase = await get_supabase()
+    result = await supabase.table("question_bank") \
+        .select("question") \
+        .eq("link_id", link_id) \
+        .eq("language", language) \
+        .eq("prompt_version", prompt_version) \
+        .execute()
+    return [row["question"] for row in result.data or []]
+
+@timed(DB_QUERY_SECONDS, DB_ERRORS)
+async def replace_question_bank(link_id: int, language: str, prompt_version: int, questions: List[dict]) -> None:
+    """
+    Replace the pool of generated questions of a lesson
+    
+    Args:
+        link_id: ID of the lesson link
+        language: Language code of the questions
+        prompt_version: Version of the prompt the questions were generated with
+        questions: Validated questions
+    """
+    rows = [
+        {
+            "link_id": link_id,
+            "language": language,
+            "prompt_version": prompt_version,
+            "question": question
+        }
+        for question in questions
+    ]
+    supabase = await get_supabase()
+    await supabase.table("question_bank").delete().eq("link_id", link_id).eq("language", language).execute()
+    if rows:
+        from postgrest.types import ReturnMethod
+
+        await supabase.table("question_bank").insert(rows, returning=ReturnMethod.minimal).execute()
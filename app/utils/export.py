@@ -0,0 +1,125 @@
+import os
+import csv
+import asyncio
+import tempfile
+from typing import AsyncIterator, List, Tuple
+from app.utils.database import get_quiz_results_by_link, get_teacher_link_previews
+
+# Rows fetched per request, only one chunk is kept in memory at a time
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+COLUMNS = ["lesson_id", "student", "correct_answers", "total_questions", "average_score", "completed_at"]
+
+FORMATS = ("csv", "xlsx")
+
+
+async def iter_lesson_results(link_id: int, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[List[dict]]:
+    """
+    Read the results of a lesson in chunks, paginated by result ID
+
+    Yields:
+        Lists of at most chunk_size results
+    """
+    after_id = None
+    while True:
+        results = await get_quiz_results_by_link(link_id, limit=chunk_size, after_id=after_id)
+        if results:
+            yield results
+        if len(results) < chunk_size:
+            return
+        after_id = results[-1]["id"]
+
+
+async def iter_teacher_results(teacher_id: float, chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[List[dict]]:
+    """
+    Read the results of every lesson of a teacher in chunks
+
+    Yields:
+        Lists of at most chunk_size results
+    """
+    after_link_id = None
+    while True:
+        links = await get_teacher_link_previews(teacher_id, chunk_size, after_id=after_link_id)
+        for link in links:
+            async for results in iter_lesson_results(link["id"], chunk_size):
+                yield results
+        if len(links) < chunk_size:
+            return
+        after_link_id = links[-1]["id"]
+
+
+def _row(result: dict) -> list:
+    return [
+        result["link_id"],
+        result["name"],
+        result["correct_answers"],
+        result["total_questions"],
+        result["average_score"],
+        result["completed_at"]
+    ]
+
+
+async def write_csv(path: str, chunks: AsyncIterator[List[dict]]) -> int:
+    """
+    Write results to a CSV file chunk by chunk
+
+    Returns:
+        Number of written results
+    """
+    count = 0
+    # utf-8-sig so that Excel opens Cyrillic names correctly
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        async for results in chunks:
+            await asyncio.to_thread(writer.writerows, [_row(result) for result in results])
+            count += len(results)
+    return count
+
+
+async def write_xlsx(path: str, chunks: AsyncIterator[List[dict]]) -> int:
+    """
+    Write results to an XLSX file chunk by chunk
+
+    Needs the optional openpyxl package. The write-only workbook keeps
+    rows in a temporary file instead of memory.
+
+    Returns:
+        Number of written results
+    """
+    from openpyxl import Workbook
+
+    count = 0
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("results")
+    sheet.append(COLUMNS)
+    async for results in chunks:
+        for result in results:
+            sheet.append(_row(result))
+        count += len(results)
+    await asyncio.to_thread(workbook.save, path)
+    return count
+
+
+async def export_results(chunks: AsyncIterator[List[dict]], file_format: str = "csv") -> Tuple[str, int]:
+    """
+    Export results to a temporary file
+
+    Args:
+        chunks: Chunks of results from iter_lesson_results or iter_teacher_results
+        file_format: "csv" or "xlsx"
+
+    Returns:
+        Path of the file, to be removed by the caller, and the number of results
+
+    Raises:
+        ImportError: If XLSX is requested and openpyxl is not installed
+    """
+    write = write_xlsx if file_format == "xlsx" else write_csv
+    fd, path = tempfile.mkstemp(suffix=f".{file_format}", prefix="quiz_results_")
+    os.close(fd)
+    try:
+        return path, await write(path, chunks)
+    except BaseException:
+        os.remove(path)
+        raise
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, NamedTuple, Optional, Set, Tuple
+from aiogram import Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from app.utils.storage import compact_dumps, worker_path
+from app.utils.metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+JOBS_QUEUED = gauge("job_queue_depth", "Jobs waiting for a worker")
+JOBS_RUNNING = gauge("jobs_running", "Jobs being run by a worker")
+JOB_WAIT_SECONDS = histogram("job_wait_seconds", "Time from enqueueing a job to its start", ["kind"])
+JOB_SECONDS = histogram("job_seconds", "Duration of jobs", ["kind"])
+JOB_RESULTS = counter("jobs_total", "Finished job attempts", ["kind", "status"])
+
+
+class Job(NamedTuple):
+    """A unit of background work, everything in it is JSON serializable"""
+    id: int
+    kind: str
+    priority: int
+    payload: Dict[str, Any]
+    attempts: int
+    created_at: float
+
+
+class FatalJobError(Exception):
+    """Raised by a job that failed in a way another attempt cannot fix"""
+
+
+class JobType(NamedTuple):
+    """
+    How to run a kind of job and what to do once it has failed for good
+
+    A job whose key, computed from its payload, is the same as the key of a
+    job still queued or running is not added.
+    """
+    run: Callable[["JobQueue", Job], Awaitable[None]]
+    on_failure: Optional[Callable[["JobQueue", Job, BaseException], Awaitable[None]]] = None
+    key: Optional[Callable[[Dict[str, Any]], Hashable]] = None
+
+
+class JobQueue:
+    """
+    Prioritized background jobs served by a pool of worker tasks
+
+    Jobs with a lower priority number run first, jobs of the same priority in
+    the order they were added. A job that raises is retried with backoff up to
+    max_attempts times, unless it raises FatalJobError. With a path, every job
+    is also kept in a local SQLite table until it is done, so jobs queued or
+    running at a restart run again.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        storage: BaseStorage,
+        types: Dict[str, JobType],
+        workers: int = 16,
+        max_attempts: int = 3,
+        retry_delay: float = 2,
+        path: Optional[str] = None
+    ):
+        self.bot = bot
+        self.storage = storage
+        self.types = types
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.path = path
+        self._queue: "asyncio.PriorityQueue[Tuple[int, int]]" = asyncio.PriorityQueue()
+        # Jobs waiting for a worker or a retry, by ID
+        self._jobs: Dict[int, Job] = {}
+        # Keys of jobs queued, running or waiting for a retry
+        self._keys: Set[Hashable] = set()
+        self._ids = itertools.count(1)
+        self._idle = 0
+        self._running = 0
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Set[asyncio.Task] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def state_for(self, chat_id: int, user_id: int) -> FSMContext:
+        """Get the FSM context of a chat, for jobs that talk to a user"""
+        key = StorageKey(bot_id=self.bot.id, chat_id=chat_id, user_id=user_id)
+        return FSMContext(storage=self.storage, key=key)
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    @property
+    def running(self) -> int:
+        """Number of jobs being run"""
+        return self._running
+
+    async def _db(self, func: Callable, *args) -> Any:
+        if self._connection is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> List[Job]:
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, kind TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "payload TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL)"
+        )
+        rows = self._connection.execute(
+            "SELECT id, kind, priority, payload, attempts, created_at FROM jobs ORDER BY id"
+        ).fetchall()
+        return [
+            Job(job_id, kind, priority, json.loads(payload), attempts, created_at)
+            for job_id, kind, priority, payload, attempts, created_at in rows
+        ]
+
+    def _insert(self, job: Job) -> int:
+        cursor = self._connection.execute(
+            "INSERT INTO jobs (kind, priority, payload, attempts, created_at) VALUES (?, ?, ?, ?, ?)",
+            (job.kind, job.priority, compact_dumps(job.payload), job.attempts, job.created_at)
+        )
+        return cursor.lastrowid
+
+    def _set_attempts(self, job_id: int, attempts: int) -> None:
+        self._connection.execute("UPDATE jobs SET attempts = ? WHERE id = ?", (attempts, job_id))
+
+    def _delete(self, job_id: int) -> None:
+        self._connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _key(self, job: Job) -> Optional[Hashable]:
+        key = self.types[job.kind].key
+        return (job.kind, key(job.payload)) if key is not None else None
+
+    def _enqueue(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        self._queue.put_nowait((job.priority, job.id))
+
+    async def put(self, kind: str, payload: Dict[str, Any], priority: int = 0) -> Optional[int]:
+        """
+        Add a job
+
+        Args:
+            kind: Name of a registered job type
+            payload: JSON serializable arguments of the job
+            priority: Lower runs first
+
+        Returns:
+            Position of the job in the queue, 0 if a worker is free to run it,
+            None if the same job is already queued or running
+        """
+        if kind not in self.types:
+            raise ValueError(f"Unknown job type: {kind}")
+
+        job = Job(next(self._ids), kind, priority, payload, 0, time.time())
+        key = self._key(job)
+        if key is not None:
+            if key in self._keys:
+                return None
+            # Taken before the insert, so a concurrent put of the same job is refused
+            self._keys.add(key)
+
+        try:
+            job_id = await self._db(self._insert, job)
+        except BaseException:
+            self._keys.discard(key)
+            raise
+        if job_id is not None:
+            job = job._replace(id=job_id)
+
+        ahead = sum(1 for queued in self._jobs.values() if queued.priority <= priority)
+        self._enqueue(job)
+        return max(0, ahead + 1 - self._idle)
+
+    async def _work(self) -> None:
+        while True:
+            self._idle += 1
+            try:
+                _, job_id = await self._queue.get()
+            finally:
+                self._idle -= 1
+
+            job = self._jobs.pop(job_id)
+            self._running += 1
+            try:
+                await self._run(job)
+            finally:
+                self._running -= 1
+
+    async def _run(self, job: Job) -> None:
+        job_type = self.types[job.kind]
+        job = job._replace(attempts=job.attempts + 1)
+        if job.attempts == 1:
+            JOB_WAIT_SECONDS.observe(max(0.0, time.time() - job.created_at), kind=job.kind)
+
+        try:
+            with JOB_SECONDS.time(kind=job.kind):
+                await job_type.run(self, job)
+        except asyncio.CancelledError:
+            # Stopped: the job stays in the table and runs after the restart
+            raise
+        except Exception as e:
+            if job.attempts < self.max_attempts and not isinstance(e, FatalJobError):
+                JOB_RESULTS.inc(kind=job.kind, status="retried")
+                logger.warning(
+                    "Job failed, retrying",
+                    extra={"job_id": job.id, "kind": job.kind, "attempts": job.attempts, "error": repr(e)}
+                )
+                await self._db(self._set_attempts, job.id, job.attempts)
+                self._retry(job)
+                return
+
+            JOB_RESULTS.inc(kind=job.kind, status="failed")
+            logger.exception("Job failed", extra={"job_id": job.id, "kind": job.kind, "attempts": job.attempts})
+            await self._done(job)
+            if job_type.on_failure is not None:
+                try:
+                    await job_type.on_failure(self, job, e)
+                except Exception:
+                    logger.exception("Error in job failure handler", extra={"job_id": job.id, "kind": job.kind})
+            return
+
+        JOB_RESULTS.inc(kind=job.kind, status="done")
+        await self._done(job)
+
+    async def _done(self, job: Job) -> None:
+        self._keys.discard(self._key(job))
+        await self._db(self._delete, job.id)
+
+    def _retry(self, job: Job) -> None:
+        # Exponential backoff with jitter, the job keeps its place among its priority
+        delay = self.retry_delay * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5)
+
+        async def requeue() -> None:
+            await asyncio.sleep(delay)
+            self._enqueue(job)
+
+        self._jobs[job.id] = job
+        task = asyncio.create_task(requeue())
+        self._retries.add(task)
+        task.add_done_callback(self._retries.discard)
+
+    async def start(self) -> None:
+        """Load the jobs left from the last run, if any, and start the workers"""
+        if self.path:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-sqlite")
+            loop = asyncio.get_running_loop()
+            jobs = await loop.run_in_executor(self._executor, self._open)
+            for job in jobs:
+                key = self._key(job)
+                if key is not None:
+                    self._keys.add(key)
+                self._enqueue(job)
+            if jobs:
+                self._ids = itertools.count(max(job.id for job in jobs) + 1)
+                logger.info("Restored jobs", extra={"count": len(jobs)})
+
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Stop the workers; unfinished jobs stay in the table for the next start"""
+        for task in self._tasks + list(self._retries):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retries, return_exceptions=True)
+        self._tasks = []
+
+        if self._connection is not None:
+            await self._db(self._connection.close)
+            self._connection = None
+            self._executor.shutdown(wait=False)
+
+
+_queue: Optional[JobQueue] = None
+
+
+def init_job_queue(bot: Bot, storage: BaseStorage, types: Dict[str, JobType]) -> JobQueue:
+    """Create the shared job queue"""
+    global _queue
+    # Файл SQLite на процесс, у каждого webhook воркера свой; пустой путь - только в памяти
+    path = os.getenv("JOBS_SQLITE_PATH")
+    _queue = JobQueue(
+        bot,
+        storage,
+        types,
+        workers=int(os.getenv("JOB_WORKERS", "16")),
+        max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+        path=worker_path(path) if path else None
+    )
+    JOBS_QUEUED.set_function(lambda: _queue.depth)
+    JOBS_RUNNING.set_function(lambda: _queue.running)
+    return _queue
+
+
+def get_job_queue() -> JobQueue:
+    """Get the shared job queue"""
+    if _queue is None:
+        raise RuntimeError("Job queue is not initialized")
+    return _queue
@@ -1,4 +1,6 @@
-from typing import Dict, Any, Optional
+import string
+import logging
+from typing import Dict, Any, Callable, FrozenSet, Optional, Tuple
 from aiogram.types import Message, User
 from aiogram.fsm.context import FSMContext
 
@@ -40,6 +42,10 @@ TRANSLATIONS = {
         "ru": "❌ Произошла ошибка. Пожалуйста, попробуйте позже.",
         "en": "❌ An error occurred. Please try again later."
     },
+    "lesson_text_required": {
+        "ru": "❌ Отправьте текст урока сообщением или файлом .txt размером до 512 КБ.",
+        "en": "❌ Please send the lesson text as a message or as a .txt file of up to 512 KB."
+    },
     "lesson_save_error": {
         "ru": "❌ Произошла ошибка при сохранении текста урока. Пожалуйста, попробуйте позже.",
         "en": "❌ An error occurred while saving the lesson text. Please try again later."
@@ -57,23 +63,40 @@ TRANSLATIONS = {
         "en": "❌ An error occurred while retrieving the results. Please try again later."
     },
     
+    "too_many_requests": {
+        "ru": "⏳ Слишком много запросов. Пожалуйста, попробуйте через несколько секунд.",
+        "en": "⏳ Too many requests. Please try again in a few seconds."
+    },
+    
     # Quiz messages
     "lesson_text": {
         "ru": "📚 Текст урока:\n{}",
         "en": "📚 Lesson text:\n{}"
     },
+    "lesson_text_page": {
+        "ru": "📚 Текст урока ({}/{}):\n{}",
+        "en": "📚 Lesson text ({}/{}):\n{}"
+    },
     "quiz_start": {
-        "ru": "⏱️ На каждый вопрос у вас будет 15 секунд. Готовы? Начинаем!",
-        "en": "⏱️ You'll have 15 seconds for each question. Ready? Let's start!"
+        "ru": "⏱️ Время на вопрос зависит от его длины и показано в опросе. Готовы? Начинаем!",
+        "en": "⏱️ The time for each question depends on its length and is shown in the poll. Ready? Let's start!"
     },
     "question_number": {
         "ru": "❓ Вопрос {} из {}:",
         "en": "❓ Question {} of {}:"
     },
+    "question_number_streaming": {
+        "ru": "❓ Вопрос {}:",
+        "en": "❓ Question {}:"
+    },
     "time_up": {
         "ru": "⏱️ Время вышло! Правильный ответ: {}\n\nПереходим к следующему вопросу...",
         "en": "⏱️ Time's up! Correct answer: {}\n\nMoving to the next question..."
     },
+    "default_explanation": {
+        "ru": "Правильный ответ!",
+        "en": "Correct answer!"
+    },
     "quiz_completed": {
         "ru": "🎉 Квиз завершен! Ваш результат: {}/{} ({}%)",
         "en": "🎉 Quiz completed! Your result: {}/{} ({}%)"
@@ -104,14 +127,87 @@ TRANSLATIONS = {
         "ru": "📊 Результаты по ссылке #{}:",
         "en": "📊 Results for link #{}:"
     },
+    "results_summary": {
+        "ru": "Попыток: {} · Учеников: {}\nСредний балл: {}% · Медиана: {}%",
+        "en": "Attempts: {} · Students: {}\nMean score: {}% · Median: {}%"
+    },
+    "results_histogram": {
+        "ru": "Распределение баллов:",
+        "en": "Score distribution:"
+    },
+    "results_row": {
+        "ru": "{}. {}: лучший {}%, последний {}/{} ({}%), попыток: {}",
+        "en": "{}. {}: best {}%, latest {}/{} ({}%), attempts: {}"
+    },
     "back_button": {
         "ru": "◀️ Назад к списку",
         "en": "◀️ Back to list"
     },
+    "prev_page": {
+        "ru": "⬅️ Назад",
+        "en": "⬅️ Previous"
+    },
+    "next_page": {
+        "ru": "Далее ➡️",
+        "en": "Next ➡️"
+    },
     "loading_links": {
         "ru": "Загрузка списка ссылок...",
         "en": "Loading links list..."
     },
+    "regenerate_usage": {
+        "ru": "Использование: /regenerate <номер урока>",
+        "en": "Usage: /regenerate <lesson number>"
+    },
+    "quiz_regenerating": {
+        "ru": "🔄 Генерирую новый квиз для урока #{}...",
+        "en": "🔄 Generating a new quiz for lesson #{}..."
+    },
+    "quiz_regenerated": {
+        "ru": "✅ Квиз для урока #{} обновлен.",
+        "en": "✅ The quiz for lesson #{} has been updated."
+    },
+    "pacing_usage": {
+        "ru": "Использование: /pacing <номер урока> [normal|rapid]\nnormal - пауза, чтобы прочитать пояснение, rapid - следующий вопрос сразу",
+        "en": "Usage: /pacing <lesson number> [normal|rapid]\nnormal - a pause to read the explanation, rapid - the next question at once"
+    },
+    "pacing_current": {
+        "ru": "Темп квиза урока #{}: {}",
+        "en": "Quiz pacing of lesson #{}: {}"
+    },
+    "pacing_updated": {
+        "ru": "✅ Темп квиза урока #{}: {}",
+        "en": "✅ Quiz pacing of lesson #{} is now {}"
+    },
+    "pacing_normal": {
+        "ru": "обычный",
+        "en": "normal"
+    },
+    "pacing_rapid": {
+        "ru": "быстрый",
+        "en": "rapid"
+    },
+    "quiz_queued": {
+        "ru": "⏳ Готовим квиз, ваше место в очереди: {}. Вопросы придут автоматически.",
+        "en": "⏳ Preparing your quiz, you are number {} in the queue. The questions will arrive automatically."
+    },
+    
+    "export_usage": {
+        "ru": "Использование: /export <номер урока> или /export all, добавьте xlsx для файла Excel",
+        "en": "Usage: /export <lesson number> or /export all, add xlsx for an Excel file"
+    },
+    "export_preparing": {
+        "ru": "⏳ Готовлю файл с результатами...",
+        "en": "⏳ Preparing the results file..."
+    },
+    "export_done": {
+        "ru": "📄 Результатов в файле: {}",
+        "en": "📄 Results in the file: {}"
+    },
+    "export_xlsx_unavailable": {
+        "ru": "❌ Экспорт в XLSX недоступен, используйте CSV.",
+        "en": "❌ XLSX export is not available, please use CSV."
+    },
     
     # Student messages
     "name_saved": {
@@ -131,11 +227,95 @@ TRANSLATIONS = {
     
     # System prompts
     "quiz_system_prompt": {
-        "ru": "Ты - помощник для учителя. Твоя задача сделать квиз на русском языке 3 вопроса и 4 варианта ответа по данному тексту. Для каждого вопроса добавь объяснение правильного ответа. Время ответа на каждый вопрос: 15 секунд. Правильный ответ только один. ВАЖНО: индекс правильного ответа должен начинаться с 0 (нумерация с нуля).",
-        "en": "You are a teacher's assistant. Your task is to create a quiz in English with 3 questions and 4 answer options based on the given text. For each question, add an explanation of the correct answer. Time to answer each question: 15 seconds. There is only one correct answer. IMPORTANT: the index of the correct answer should start from 0 (zero-based numbering)."
+        "ru": "Ты - помощник для учителя. Твоя задача сделать квиз на русском языке 3 вопроса и 4 варианта ответа по данному тексту. Для каждого вопроса добавь объяснение правильного ответа. Правильный ответ только один. ВАЖНО: индекс правильного ответа должен начинаться с 0 (нумерация с нуля).",
+        "en": "You are a teacher's assistant. Your task is to create a quiz in English with 3 questions and 4 answer options based on the given text. For each question, add an explanation of the correct answer. There is only one correct answer. IMPORTANT: the index of the correct answer should start from 0 (zero-based numbering)."
+    },
+    "question_bank_system_prompt": {
+        "ru": "Ты - помощник для учителя. Твоя задача составить {} разных вопросов на русском языке по данному тексту, к каждому 4 варианта ответа. Вопросы не должны повторяться и должны охватывать весь текст. Для каждого вопроса добавь объяснение правильного ответа. Правильный ответ только один, варианты ответа не повторяются. ВАЖНО: индекс правильного ответа должен начинаться с 0 (нумерация с нуля).",
+        "en": "You are a teacher's assistant. Your task is to write {} different questions in English based on the given text, each with 4 answer options. The questions must not repeat and should cover the whole text. For each question, add an explanation of the correct answer. There is only one correct answer and the options do not repeat. IMPORTANT: the index of the correct answer should start from 0 (zero-based numbering)."
     }
 }
 
+# При импорте шаблоны только проверяются: get_text делает один поиск в словаре и
+# вызывает связанный str.format шаблона. Разбор "{}" в C быстрее, чем склейка
+# заранее разобранных кусков в Python (см. benchmarks/translations.py)
+Renderer = Callable[..., str]
+
+_formatter = string.Formatter()
+
+logger = logging.getLogger(__name__)
+
+
+def _constant(text: str) -> Renderer:
+    def render(*args, **kwargs) -> str:
+        return text
+    return render
+
+
+def _compile(template: str) -> Tuple[Renderer, Tuple[int, FrozenSet[str]]]:
+    """
+    Parse a template into a renderer and its placeholder signature
+
+    The template is parsed here only to check its placeholders. Texts
+    without placeholders become constants; the others render with their
+    bound str.format, which parses the template again on every call.
+
+    Returns:
+        Renderer and (number of positional placeholders, names of keyword placeholders)
+    """
+    positional = 0
+    indexes = set()
+    names = set()
+    for _, field, _, _ in _formatter.parse(template):
+        if field is None:
+            continue
+        name = field.split(".", 1)[0].split("[", 1)[0]
+        if name == "":
+            positional += 1
+        elif name.isdigit():
+            indexes.add(int(name))
+        else:
+            names.add(name)
+
+    positional = max(positional, max(indexes, default=-1) + 1)
+    if positional == 0 and not names:
+        # Only literal text, with escaped braces already resolved
+        return _constant(template.format()), (0, frozenset())
+    return template.format, (positional, frozenset(names))
+
+
+def _compile_catalog(translations: Dict[str, Dict[str, str]]) -> Dict[Tuple[str, str], Renderer]:
+    """
+    Compile all translations and check that every key has every language
+    with the same placeholders
+
+    Raises:
+        ValueError: If a translation is missing or its placeholders differ
+    """
+    catalog = {}
+    errors = []
+    for key, texts in translations.items():
+        missing = set(LANGUAGES) - set(texts)
+        if missing:
+            errors.append(f"{key}: missing {', '.join(sorted(missing))}")
+
+        signatures = {}
+        for language, template in texts.items():
+            try:
+                catalog[(key, language)], signatures[language] = _compile(template)
+            except ValueError as e:
+                errors.append(f"{key}/{language}: {e}")
+
+        if len(set(signatures.values())) > 1:
+            errors.append(f"{key}: placeholders differ between languages {signatures}")
+
+    if errors:
+        raise ValueError("Invalid translations:\n" + "\n".join(errors))
+    return catalog
+
+
+CATALOG = _compile_catalog(TRANSLATIONS)
+
 async def get_user_language(user_id: float) -> str:
     """Get user language from database or return default"""
     from app.utils.database import get_user_language as db_get_user_language
@@ -156,30 +336,29 @@ async def set_user_language(user_id: float, language: str) -> bool:
     except:
         return False
 
-def get_text(key: str, language: str = DEFAULT_LANGUAGE, **kwargs) -> str:
-    """Get translated text by key and language"""
-    if key not in TRANSLATIONS:
-        return f"Missing translation: {key}"
-    
-    if language not in TRANSLATIONS[key]:
-        language = DEFAULT_LANGUAGE
-    
-    text = TRANSLATIONS[key][language]
+def get_text(key: str, language: str = DEFAULT_LANGUAGE, *args, **kwargs) -> str:
+    """
+    Get translated text by key and language
     
-    # Format text with kwargs if provided
-    if kwargs:
-        try:
-            return text.format(**kwargs)
-        except:
-            try:
-                # Try positional formatting if keyword formatting fails
-                return text.format(*kwargs.values())
-            except:
-                return text
+    Args:
+        key: Translation key
+        language: Language code, DEFAULT_LANGUAGE is used if it has no translation
+        *args, **kwargs: Values of the placeholders
+        
+    Returns:
+        Formatted text
+    """
+    render = CATALOG.get((key, language)) or CATALOG.get((key, DEFAULT_LANGUAGE))
+    if render is None:
+        return f"Missing translation: {key}"
     
-    return text
+    try:
+        return render(*args, **kwargs)
+    except (IndexError, KeyError) as e:
+        logger.warning("Wrong arguments for translation", extra={"key": key, "error": repr(e)})
+        return TRANSLATIONS[key].get(language, TRANSLATIONS[key][DEFAULT_LANGUAGE])
 
-async def get_user_text(key: str, user_id: float, **kwargs) -> str:
+async def get_user_text(key: str, user_id: float, *args, **kwargs) -> str:
     """Get translated text for a specific user"""
     language = await get_user_language(user_id)
-    return get_text(key, language, **kwargs) 
\ No newline at end of file
+    return get_text(key, language, *args, **kwargs)
@@ -0,0 +1,275 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import importlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Type, TypeVar
+from pydantic import BaseModel
+from app.utils.metrics import counter, gauge, histogram
+from app.utils.llm_cache import MODES, LLMResponseCache, request_key
+
+logger = logging.getLogger(__name__)
+
+LLM_REQUEST_SECONDS = histogram("llm_request_seconds", "Duration of LLM requests, retries included", ["method"])
+LLM_FIRST_SNAPSHOT_SECONDS = histogram("llm_first_snapshot_seconds", "Time from a streamed LLM request to its first parsed snapshot")
+LLM_RETRIES = counter("llm_retries_total", "LLM requests retried after an error", ["method"])
+LLM_ERRORS = counter("llm_errors_total", "LLM requests that failed", ["method"])
+LLM_IN_FLIGHT = gauge("llm_requests_in_flight", "LLM requests holding a concurrency slot")
+
+DEFAULT_MODEL = "openai/gpt-4o-mini"
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class ApiKeyError(Exception):
+    """Raised when the LLM API key is not configured"""
+
+
+class LLMClient:
+    """
+    Shared AsyncOpenAI client with a concurrency limit, timeouts and retries
+
+    The openai SDK takes most of a second to import, so it is imported when
+    the first client is created, not when this module is. With cache_mode
+    record or replay, responses are also recorded to or served from the
+    SQLite file at cache_path (see LLMResponseCache).
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        max_concurrency: int = 8,
+        timeout: float = 60,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8,
+        cache_mode: str = "passthrough",
+        cache_path: str = "llm_cache.sqlite3"
+    ):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.cache = LLMResponseCache(cache_path, cache_mode) if cache_mode != "passthrough" else None
+
+        import httpx
+        import openai
+
+        # Errors worth another attempt: network problems, rate limits and 5xx
+        self.retryable_errors = (
+            openai.APIConnectionError,
+            openai.APITimeoutError,
+            openai.RateLimitError,
+            openai.InternalServerError
+        )
+
+        # Keep-alive connections are reused by all generations
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=0,  # Retries are done here, with jitter and outside the semaphore
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency
+                )
+            )
+        )
+
+    async def parse(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Type[T],
+        model: str = DEFAULT_MODEL,
+        temperature: float = 0.4
+    ) -> T:
+        """
+        Run a structured completion and return the parsed model
+
+        Args:
+            messages: Chat messages of the request
+            response_format: Pydantic model of the response
+            model: Model name
+            temperature: Sampling temperature
+
+        Returns:
+            Parsed response
+
+        Raises:
+            LLMCacheMiss: In replay mode, if the request was never recorded
+        """
+        key = n = None
+        if self.cache is not None:
+            key = request_key(model, messages, temperature, response_format)
+            n, cached = await self.cache.get(key)
+            if cached is not None:
+                return response_format.model_validate(cached)
+
+        with LLM_REQUEST_SECONDS.time(method="parse"):
+            for attempt in range(self.max_retries + 1):
+                try:
+                    async with self._semaphore:
+                        LLM_IN_FLIGHT.inc()
+                        try:
+                            response = await self.client.beta.chat.completions.parse(
+                                model=model,
+                                messages=messages,
+                                temperature=temperature,
+                                response_format=response_format
+                            )
+                        finally:
+                            LLM_IN_FLIGHT.dec()
+                    parsed = response.choices[0].message.parsed
+                    if key is not None:
+                        await self.cache.put(key, n, parsed.model_dump(mode="json"))
+                    return parsed
+                except self.retryable_errors as e:
+                    if attempt == self.max_retries:
+                        LLM_ERRORS.inc(method="parse")
+                        raise
+                    LLM_RETRIES.inc(method="parse")
+                    logger.warning("LLM request failed, retrying", extra={"error": repr(e), "attempt": attempt + 1})
+                    await asyncio.sleep(self._backoff(attempt))
+                except Exception:
+                    LLM_ERRORS.inc(method="parse")
+                    raise
+
+    async def stream(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Type[BaseModel],
+        model: str = DEFAULT_MODEL,
+        temperature: float = 0.4
+    ) -> AsyncIterator[Any]:
+        """
+        Run a structured completion and yield partial parsed snapshots
+
+        Every snapshot is the response parsed so far as plain JSON data; the
+        last one is complete. A request is retried only if it failed before
+        anything was yielded. Only the complete snapshot is recorded, so a
+        replayed stream yields it at once.
+        """
+        key = n = None
+        if self.cache is not None:
+            key = request_key(model, messages, temperature, response_format)
+            n, cached = await self.cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+
+        snapshot = None
+        request_started = time.perf_counter()
+        with LLM_REQUEST_SECONDS.time(method="stream"):
+            for attempt in range(self.max_retries + 1):
+                started = False
+                try:
+                    async with self._semaphore:
+                        LLM_IN_FLIGHT.inc()
+                        try:
+                            async with self.client.beta.chat.completions.stream(
+                                model=model,
+                                messages=messages,
+                                temperature=temperature,
+                                response_format=response_format
+                            ) as stream:
+                                async for event in stream:
+                                    if event.type == "content.delta" and event.parsed is not None:
+                                        if not started:
+                                            LLM_FIRST_SNAPSHOT_SECONDS.observe(time.perf_counter() - request_started)
+                                        started = True
+                                        snapshot = event.parsed
+                                        yield snapshot
+                        finally:
+                            LLM_IN_FLIGHT.dec()
+                    if key is not None and snapshot is not None:
+                        await self.cache.put(key, n, snapshot)
+                    return
+                except self.retryable_errors as e:
+                    if started or attempt == self.max_retries:
+                        LLM_ERRORS.inc(method="stream")
+                        raise
+                    LLM_RETRIES.inc(method="stream")
+                    logger.warning("LLM stream failed, retrying", extra={"error": repr(e), "attempt": attempt + 1})
+                    await asyncio.sleep(self._backoff(attempt))
+                except Exception:
+                    LLM_ERRORS.inc(method="stream")
+                    raise
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def close(self) -> None:
+        await self.client.close()
+        if self.cache is not None:
+            await self.cache.close()
+
+
+_llm: Optional[LLMClient] = None
+_llm_settings: Optional[Dict[str, Any]] = None
+
+
+def init_llm() -> bool:
+    """
+    Read the LLM settings from environment variables
+
+    The client itself is created by the first get_llm call.
+
+    Returns:
+        Whether quiz generation is enabled
+    """
+    global _llm_settings
+    api_key = os.getenv("API_CHATGPT")
+    cache_mode = os.getenv("LLM_CACHE_MODE", "passthrough")
+    if cache_mode not in MODES:
+        raise ValueError(f"LLM_CACHE_MODE must be one of {', '.join(MODES)}, got {cache_mode}")
+
+    # Replay mode never calls the API, so it needs no key
+    if cache_mode == "replay":
+        api_key = api_key or "replay"
+
+    if not api_key:
+        logger.warning("API_CHATGPT is not set, quiz generation is disabled")
+        _llm_settings = None
+        return False
+
+    _llm_settings = {
+        "api_key": api_key,
+        "base_url": os.getenv("API_BASE"),
+        "max_concurrency": int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        "timeout": float(os.getenv("LLM_TIMEOUT", "60")),
+        "max_retries": int(os.getenv("LLM_MAX_RETRIES", "3")),
+        "cache_mode": cache_mode,
+        "cache_path": os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+    }
+    if cache_mode != "passthrough":
+        logger.info("LLM response cache enabled", extra={"mode": cache_mode, "path": _llm_settings["cache_path"]})
+    return True
+
+
+async def warm_up_llm() -> None:
+    """Import the openai SDK in a thread, so the first get_llm does not block the event loop"""
+    if _llm_settings is not None:
+        await asyncio.to_thread(importlib.import_module, "openai")
+
+
+def get_llm() -> LLMClient:
+    """Get the shared LLM client, creating it on first use"""
+    global _llm
+    if _llm is None:
+        if _llm_settings is None:
+            raise ApiKeyError("API_CHATGPT is not set")
+        _llm = LLMClient(**_llm_settings)
+    return _llm
+
+
+async def close_llm() -> None:
+    """Close the shared LLM client and its connections"""
+    global _llm, _llm_settings
+    _llm_settings = None
+    if _llm is not None:
+        await _llm.close()
+        _llm = None
@@ -0,0 +1,118 @@
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Type
+from pydantic import BaseModel
+from app.utils.metrics import counter
+
+LLM_CACHE_REQUESTS = counter("llm_cache_requests_total", "LLM requests answered from the response cache or not", ["result"])
+
+MODES = ("passthrough", "record", "replay")
+
+
+class LLMCacheMiss(Exception):
+    """Raised in replay mode for a request that was never recorded"""
+
+
+def request_key(model: str, messages: List[Dict[str, str]], temperature: float, response_format: Type[BaseModel]) -> str:
+    """Hash of everything that determines an LLM response"""
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "schema": response_format.model_json_schema()
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    LLM responses recorded in a local SQLite file
+
+    The same request can be sent several times on purpose, e.g. parallel
+    batches of a question bank, so every key keeps a list of responses:
+    the n-th identical request of a process gets the n-th recorded one.
+
+    - record: answer from the file, call the LLM and append on a miss
+    - replay: answer from the file only, a miss raises LLMCacheMiss; once
+      the recorded responses of a key are used up they are reused in turn
+    """
+
+    def __init__(self, path: str, mode: str = "record"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        self.mode = mode
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # Reads of a large recording go through the page cache, not read() calls
+        self._connection.execute("PRAGMA mmap_size=268435456")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT NOT NULL, n INTEGER NOT NULL, response TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (key, n))"
+        )
+        # Responses loaded from the file and calls made so far, by key
+        self._responses: Dict[str, List[Any]] = {}
+        self._calls: Dict[str, int] = defaultdict(int)
+
+    async def _run(self, func, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _load(self, key: str) -> List[Any]:
+        rows = self._connection.execute("SELECT response FROM responses WHERE key = ? ORDER BY n", (key,)).fetchall()
+        return [json.loads(response) for response, in rows]
+
+    def _insert(self, key: str, n: int, response: str) -> None:
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses (key, n, response, created_at) VALUES (?, ?, ?, ?)",
+            (key, n, response, time.time())
+        )
+
+    async def get(self, key: str) -> Tuple[int, Optional[Any]]:
+        """
+        Look up the response to the next request with this key
+
+        Returns:
+            Number of the request among identical ones and the recorded
+            response, None if there is none
+
+        Raises:
+            LLMCacheMiss: In replay mode, if the request was never recorded
+        """
+        responses = self._responses.get(key)
+        if responses is None:
+            responses = self._responses[key] = await self._run(self._load, key)
+
+        n = self._calls[key]
+        self._calls[key] += 1
+        if n < len(responses):
+            LLM_CACHE_REQUESTS.inc(result="hit")
+            return n, responses[n]
+
+        if self.mode == "replay":
+            if not responses:
+                LLM_CACHE_REQUESTS.inc(result="miss")
+                raise LLMCacheMiss(f"No recorded LLM response for {key}")
+            LLM_CACHE_REQUESTS.inc(result="hit")
+            return n, responses[n % len(responses)]
+
+        LLM_CACHE_REQUESTS.inc(result="miss")
+        return n, None
+
+    async def put(self, key: str, n: int, response: Any) -> None:
+        """Record the response to the n-th request with this key"""
+        responses = self._responses.setdefault(key, [])
+        if n == len(responses):
+            responses.append(response)
+        await self._run(self._insert, key, n, json.dumps(response, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self) -> None:
+        await self._run(self._connection.close)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,259 @@
+import os
+import time
+import bisect
+import functools
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from aiohttp import web
+
+# Seconds, from a cache hit to a slow LLM generation
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    """Base of the metrics in the Prometheus text format"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # Unlabelled metrics are exported as 0 before the first update
+        self._values: Dict[Labels, float] = {} if self.labelnames else {(): 0}
+        self._function: Optional[Callable[[], Any]] = None
+
+    def _key(self, labels: Dict[str, Any]) -> Labels:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def set_function(self, function: Callable[[], Any]) -> None:
+        """
+        Read the value at scrape time instead of keeping it
+
+        The function returns a number or, for labelled metrics, a dict of
+        label value tuples to numbers.
+        """
+        self._function = function
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        if self._function is None:
+            values = self._values
+        else:
+            values = self._function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        for labels, value in list(values.items()):
+            yield self.name, labels, value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: counts per bucket (the last one is +Inf), sum
+        self._series: Dict[Labels, List] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, **labels: Any) -> "_Timer":
+        """Context manager observing the time spent inside it"""
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        for labels, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (_format_value(bound),), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            labelnames = self.labelnames + ("le",) if name.endswith("_bucket") else self.labelnames
+            lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+def _format_labels(names: Sequence[str], values: Labels) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY: Dict[str, Metric] = {}
+
+
+def _register(metric: Metric) -> Any:
+    # Asking for an existing name returns the registered metric
+    return REGISTRY.setdefault(metric.name, metric)
+
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    """Create or get a counter"""
+    return _register(Counter(name, help, labelnames))
+
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    """Create or get a gauge"""
+    return _register(Gauge(name, help, labelnames))
+
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Create or get a histogram"""
+    return _register(Histogram(name, help, labelnames, buckets))
+
+
+def timed(metric: Histogram, errors: Optional[Counter] = None, **labels: Any) -> Callable:
+    """
+    Decorator observing the duration of an async function
+
+    The function name is used as the "function" label unless given.
+    Exceptions are counted in errors, if given, and re-raised.
+    """
+    def decorator(fn: Callable) -> Callable:
+        fn_labels = {"function": fn.__name__, **labels} if "function" in metric.labelnames else labels
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with metric.time(**fn_labels):
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    if errors is not None:
+                        errors.inc(**fn_labels)
+                    raise
+        return wrapper
+    return decorator
+
+
+# Handlers from app/routes.py and the poll timeout handler
+HANDLER_SECONDS = histogram("handler_seconds", "Duration of update handlers", ["handler"])
+HANDLER_ERRORS = counter("handler_errors_total", "Update handlers that raised", ["handler"])
+
+
+# Hits and misses of every TTLCache registered with register_cache
+_caches: Dict[str, Any] = {}
+
+CACHE_HITS = counter("cache_hits_total", "Cache lookups that found a value", ["cache"])
+CACHE_MISSES = counter("cache_misses_total", "Cache lookups that found nothing", ["cache"])
+CACHE_SIZE = gauge("cache_entries", "Entries in the cache", ["cache"])
+CACHE_HITS.set_function(lambda: {(name,): cache.hits for name, cache in _caches.items()})
+CACHE_MISSES.set_function(lambda: {(name,): cache.misses for name, cache in _caches.items()})
+CACHE_SIZE.set_function(lambda: {(name,): len(cache) for name, cache in _caches.items()})
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """Export hit, miss and size counters of a TTLCache"""
+    _caches[name] = cache
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY.values():
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start_metrics_server() -> Optional[web.AppRunner]:
+    """
+    Serve /metrics on METRICS_HOST:METRICS_PORT, if METRICS_PORT is set
+
+    Returns:
+        Runner of the server or None
+    """
+    global _runner
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    # Webhook workers share the port, each scrape is served by one of them
+    site = web.TCPSite(runner, os.getenv("METRICS_HOST", "127.0.0.1"), int(port), reuse_port=True)
+    await site.start()
+    _runner = runner
+    return runner
+
+
+async def stop_metrics_server() -> None:
+    """Stop the /metrics server"""
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
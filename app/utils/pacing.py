@@ -0,0 +1,44 @@
+import os
+from typing import List
+
+# Темп квиза урока: normal - пауза, чтобы прочитать пояснение, rapid - следующий вопрос сразу
+PACING_MODES = ("normal", "rapid")
+DEFAULT_PACING = "normal"
+
+# Время на вопрос: база плюс время на чтение вопроса и вариантов ответа
+POLL_BASE_SECONDS = float(os.getenv("POLL_BASE_SECONDS", "10"))
+# Скорость чтения в символах в секунду, для времени на вопрос и пауз
+READING_CHARS_PER_SECOND = float(os.getenv("READING_CHARS_PER_SECOND", "15"))
+# Максимальная пауза перед следующим вопросом в темпе normal
+QUIZ_MAX_PAUSE = float(os.getenv("QUIZ_MAX_PAUSE", "2"))
+
+# Telegram accepts open_period from 5 to 600 seconds
+POLL_MIN_SECONDS = 5
+POLL_MAX_SECONDS = 600
+# The deadline is a bit after the poll closes, so a last-second answer still counts
+POLL_DEADLINE_GRACE = 1
+
+
+def poll_open_period(question: str, options: List[str]) -> int:
+    """Seconds a quiz poll stays open, longer for longer questions"""
+    chars = len(question) + sum(len(option) for option in options)
+    seconds = round(POLL_BASE_SECONDS + chars / READING_CHARS_PER_SECOND)
+    return max(POLL_MIN_SECONDS, min(POLL_MAX_SECONDS, seconds))
+
+
+def pause_before_next(pacing: str, text: str) -> float:
+    """
+    Seconds to wait before the next question
+
+    Args:
+        pacing: Pacing of the lesson
+        text: What the student reads meanwhile: the explanation after an
+            answer or the correct answer after a timeout
+
+    Returns:
+        Reading time of the text, at most QUIZ_MAX_PAUSE; no pause in the
+        rapid pacing or if there is nothing to read
+    """
+    if pacing == "rapid" or not text:
+        return 0
+    return min(QUIZ_MAX_PAUSE, len(text) / READING_CHARS_PER_SECOND)
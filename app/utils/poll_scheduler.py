@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+from aiogram import Bot
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from app.utils.metrics import HANDLER_ERRORS, HANDLER_SECONDS, gauge
+from app.utils.storage import worker_path
+
+logger = logging.getLogger(__name__)
+
+POLLS_PENDING = gauge("polls_pending", "Quiz polls waiting for an answer or their deadline")
+
+
+class PollRecord(NamedTuple):
+    """Everything needed to close a quiz poll, without live objects"""
+    chat_id: int
+    user_id: int
+    language: str
+    deadline: float
+
+
+TimeoutHandler = Callable[[Bot, FSMContext, str, PollRecord], Awaitable[None]]
+
+
+class PollScheduler:
+    """
+    Deadlines of all open quiz polls in one heap, served by one task
+
+    Answered polls are removed from the records right away and their heap
+    entries are skipped lazily when they reach the top.
+    """
+
+    def __init__(self, bot: Bot, storage: BaseStorage, on_timeout: TimeoutHandler, snapshot_path: Optional[str] = None):
+        self.bot = bot
+        self.storage = storage
+        self.on_timeout = on_timeout
+        self.snapshot_path = snapshot_path
+        self._polls: Dict[str, PollRecord] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def add(self, poll_id: str, chat_id: int, user_id: int, language: str, timeout: float) -> None:
+        """Schedule the deadline of a poll"""
+        deadline = time.time() + timeout
+        self._polls[poll_id] = PollRecord(chat_id, user_id, language, deadline)
+        heapq.heappush(self._heap, (deadline, poll_id))
+
+        # Only an earlier deadline changes how long the loop sleeps
+        if self._heap[0][1] == poll_id:
+            self._wakeup.set()
+
+        # Drop skipped entries once they outnumber the open polls
+        if len(self._heap) > 2 * len(self._polls) + 64:
+            self._heap = [(record.deadline, poll_id) for poll_id, record in self._polls.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, poll_id: str) -> Optional[PollRecord]:
+        """Remove a poll before its deadline and return its record"""
+        return self._polls.pop(poll_id, None)
+
+    def state_for(self, record: PollRecord) -> FSMContext:
+        """Get the FSM context of the quiz the poll belongs to"""
+        key = StorageKey(bot_id=self.bot.id, chat_id=record.chat_id, user_id=record.user_id)
+        return FSMContext(storage=self.storage, key=key)
+
+    @property
+    def pending(self) -> int:
+        """Number of polls waiting for an answer"""
+        return len(self._polls)
+
+    async def _run(self) -> None:
+        while True:
+            # Skip entries of answered or rescheduled polls
+            while self._heap:
+                deadline, poll_id = self._heap[0]
+                record = self._polls.get(poll_id)
+                if record is not None and record.deadline == deadline:
+                    break
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, poll_id = heapq.heappop(self._heap)
+            record = self._polls.pop(poll_id)
+
+            # Handlers send messages, so they must not hold up other deadlines
+            task = asyncio.create_task(self._expire(poll_id, record))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _expire(self, poll_id: str, record: PollRecord) -> None:
+        name = self.on_timeout.__name__
+        with HANDLER_SECONDS.time(handler=name):
+            try:
+                await self.on_timeout(self.bot, self.state_for(record), poll_id, record)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                logger.exception("Error handling poll timeout", extra={"poll_id": poll_id, "chat_id": record.chat_id})
+
+    def start(self) -> None:
+        """Restore the snapshot, if any, and start serving deadlines"""
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as f:
+                for poll_id, record in json.load(f).items():
+                    record = PollRecord(*record)
+                    self._polls[poll_id] = record
+                    self._heap.append((record.deadline, poll_id))
+            heapq.heapify(self._heap)
+            os.remove(self.snapshot_path)
+
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop serving deadlines and save open polls to the snapshot"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+        if self.snapshot_path and self._polls:
+            with open(self.snapshot_path, "w") as f:
+                json.dump(self._polls, f)
+
+
+_scheduler: Optional[PollScheduler] = None
+
+
+def init_poll_scheduler(bot: Bot, storage: BaseStorage, on_timeout: TimeoutHandler) -> PollScheduler:
+    """Create the shared poll scheduler"""
+    global _scheduler
+    # Снимок имеет смысл только с постоянным FSM хранилищем (FSM_STORAGE=redis/sqlite),
+    # у каждого webhook воркера свой файл
+    snapshot_path = os.getenv("POLL_SNAPSHOT_PATH")
+    _scheduler = PollScheduler(bot, storage, on_timeout, worker_path(snapshot_path) if snapshot_path else None)
+    POLLS_PENDING.set_function(lambda: _scheduler.pending)
+    return _scheduler
+
+
+def get_poll_scheduler() -> PollScheduler:
+    """Get the shared poll scheduler"""
+    if _scheduler is None:
+        raise RuntimeError("Poll scheduler is not initialized")
+    return _scheduler
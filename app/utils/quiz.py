@@ -0,0 +1,528 @@
+import os
+import random
+import asyncio
+import logging
+import itertools
+from pydantic import BaseModel, ValidationError
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+from app.utils.cache import TTLCache
+from app.utils.chunking import split_text
+from app.utils.compression import content_hash
+from app.utils.database import get_lesson_text, get_cached_quiz, store_cached_quiz, get_question_bank, replace_question_bank
+from app.utils.language import get_text
+from app.utils.llm import ApiKeyError, get_llm
+from app.utils.metrics import counter, gauge, register_cache
+
+logger = logging.getLogger(__name__)
+
+# Увеличьте при изменении промпта или модели, чтобы старые квизы не попадали в кэш
+PROMPT_VERSION = 2
+QUIZ_MODEL = "openai/gpt-4o-mini"
+
+# Хранить сгенерированные квизы в таблице quiz_cache (migrations/add_quiz_cache_table.sql)
+QUIZ_CACHE_DB = os.getenv("QUIZ_CACHE_DB", "0") == "1"
+
+# Банк вопросов (migrations/add_question_bank_table.sql): при сохранении урока
+# генерируется QUESTION_BANK_SIZE вопросов, каждый ученик получает QUIZ_QUESTIONS
+# из них в случайном порядке. 0 - отдельный квиз на урок, как раньше
+QUESTION_BANK_SIZE = int(os.getenv("QUESTION_BANK_SIZE", "0"))
+QUIZ_QUESTIONS = int(os.getenv("QUIZ_QUESTIONS", "3"))
+# Вопросов в одном запросе к LLM, запросы банка идут параллельно
+QUESTION_BANK_BATCH = 10
+
+# Длинные уроки делятся на части по QUIZ_CHUNK_CHARS символов по границам абзацев:
+# вопросы к частям генерируются параллельно, затем объединяются в один квиз
+QUIZ_CHUNK_CHARS = int(os.getenv("QUIZ_CHUNK_CHARS", "6000"))
+
+
+class Question(BaseModel):
+    question: str
+    options: List[str]
+    correctAnswer: int
+    explanation: str  # Add explanation field to the model
+
+class Quiz(BaseModel):
+    questions: List[Question]
+
+
+# Quizzes keyed by (lesson text hash, language, prompt version): lessons with
+# the same text share one quiz
+quiz_cache = TTLCache(
+    maxsize=int(os.getenv("QUIZ_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("QUIZ_CACHE_TTL", "86400"))
+)
+
+register_cache("quiz", quiz_cache)
+
+# Question banks keyed by (lesson_id, language); an empty bank is cached
+# briefly so students of a lesson being generated do not query the table
+question_banks = TTLCache(
+    maxsize=int(os.getenv("QUIZ_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("QUIZ_CACHE_TTL", "86400"))
+)
+EMPTY_BANK_TTL = 10
+
+register_cache("question_bank", question_banks)
+
+# Counters for the layers behind the in-process cache
+quiz_cache_stats = {
+    "db_hits": 0,
+    "generations": 0
+}
+counter("quiz_cache_db_hits_total", "Quizzes found in the quiz_cache table").set_function(lambda: quiz_cache_stats["db_hits"])
+counter("quiz_generations_total", "Quizzes generated by the LLM").set_function(lambda: quiz_cache_stats["generations"])
+QUESTIONS_REJECTED = counter("question_bank_rejected_total", "Generated bank or chunk questions that were invalid or repeated")
+
+
+# Generations running in the background, referenced so they are not garbage collected
+_generation_tasks: Set[asyncio.Task] = set()
+
+# Generations in progress by cache key, joined by every student of the lesson
+_streams: Dict[tuple, "QuizStream"] = {}
+gauge("quiz_generations_in_progress", "Quiz generations being streamed").set_function(lambda: len(_streams))
+
+
+class QuizStream:
+    """
+    Questions of a quiz as they are generated
+
+    Any number of consumers can iterate over the stream; each one gets every
+    question from the start and waits for the ones not generated yet.
+    """
+
+    def __init__(self, questions: Optional[List[Dict]] = None, done: bool = False):
+        self.questions: List[Dict] = list(questions or [])
+        self.done = done
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+
+    async def put(self, question: Dict) -> None:
+        async with self._changed:
+            self.questions.append(question)
+            self._changed.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None) -> None:
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    async def __aiter__(self) -> AsyncIterator[Dict]:
+        index = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self.questions) or self.done)
+
+            if index < len(self.questions):
+                yield self.questions[index]
+                index += 1
+            elif self.error is not None:
+                raise self.error
+            else:
+                return
+
+
+def pack_question(question: Dict) -> list:
+    """
+    Convert a question to a compact row for the FSM state
+
+    The row is [question, options, correct_option_id, explanation], with
+    correct_option_id clamped to the range of options. A missing explanation
+    stays empty, so the quiz does not pause after the answer.
+    """
+    return [
+        question["question"],
+        question["options"],
+        min(max(0, question["correctAnswer"]), len(question["options"]) - 1),
+        question.get("explanation") or ""
+    ]
+
+
+def quiz_cache_key(language: str, lesson_text: str) -> tuple:
+    """Build the cache key for a lesson quiz"""
+    return (content_hash(lesson_text), language, PROMPT_VERSION)
+
+
+def quiz_messages(lesson_text: str, language: str) -> List[Dict[str, str]]:
+    """Build the LLM messages for a lesson quiz"""
+    return [
+        {
+            "role": "system",
+            "content": get_text("quiz_system_prompt", language)
+        },
+        {
+            "role": "user",
+            "content": lesson_text
+        }
+    ]
+
+
+async def generate_quiz(lesson_text: str, language: str) -> Quiz:
+    """Generate a quiz for the lesson text with the LLM"""
+    chunks = split_text(lesson_text, QUIZ_CHUNK_CHARS)
+    if len(chunks) > 1:
+        quiz_cache_stats["generations"] += 1
+        return Quiz(questions=[question async for question in stream_chunked_questions(chunks, language)])
+
+    quiz = await get_llm().parse(
+        model=QUIZ_MODEL,
+        messages=quiz_messages(lesson_text, language),
+        temperature=0.4,
+        response_format=Quiz
+    )
+
+    quiz_cache_stats["generations"] += 1
+    return quiz
+
+
+async def stream_quiz_questions(lesson_text: str, language: str) -> AsyncIterator[Dict]:
+    """Generate a quiz with the LLM and yield every question as soon as it is complete"""
+    llm = get_llm()
+    quiz_cache_stats["generations"] += 1
+
+    chunks = split_text(lesson_text, QUIZ_CHUNK_CHARS)
+    if len(chunks) > 1:
+        async for question in stream_chunked_questions(chunks, language):
+            yield question
+        return
+
+    emitted = 0
+    snapshot = {}
+
+    async for snapshot in llm.stream(
+        model=QUIZ_MODEL,
+        messages=quiz_messages(lesson_text, language),
+        temperature=0.4,
+        response_format=Quiz
+    ):
+        # A question is complete once the next one has started
+        questions = snapshot.get("questions") or []
+        while emitted < len(questions) - 1:
+            question = validate_question(questions[emitted])
+            emitted += 1
+            if question is not None:
+                yield question
+
+    # The last snapshot is the whole response
+    for question in (snapshot.get("questions") or [])[emitted:]:
+        question = validate_question(question)
+        if question is not None:
+            yield question
+
+
+def validate_question(question: Dict) -> Optional[Dict]:
+    """Check a streamed question against the Question model, None if it is malformed"""
+    try:
+        return Question.model_validate(question).model_dump()
+    except ValidationError as e:
+        logger.warning("Skipping malformed question", extra={"error": str(e)})
+        return None
+
+
+async def generate_questions(text: str, language: str, count: int, temperature: float = 0.8) -> List[Question]:
+    """Ask the LLM for count questions about the text"""
+    quiz = await get_llm().parse(
+        model=QUIZ_MODEL,
+        messages=[
+            {"role": "system", "content": get_text("question_bank_system_prompt", language, count)},
+            {"role": "user", "content": text}
+        ],
+        # Requests run in parallel, a higher temperature keeps them apart
+        temperature=temperature,
+        response_format=Quiz
+    )
+    return quiz.questions
+
+
+def is_valid_question(question: Dict) -> bool:
+    """Check that a generated question can be sent as a quiz poll"""
+    options = question["options"]
+    return (
+        bool(question["question"].strip())
+        and 2 <= len(options) <= 10
+        and all(option.strip() for option in options)
+        and len({option.strip().casefold() for option in options}) == len(options)
+        and 0 <= question["correctAnswer"] < len(options)
+    )
+
+
+def accept_question(question: Dict, seen: Set[str]) -> bool:
+    """Check a generated question and remember it, so that repeats are dropped"""
+    text = question["question"].strip().casefold()
+    if text in seen or not is_valid_question(question):
+        QUESTIONS_REJECTED.inc()
+        return False
+    seen.add(text)
+    return True
+
+
+async def stream_chunked_questions(chunks: List[str], language: str, count: int = QUIZ_QUESTIONS) -> AsyncIterator[Dict]:
+    """
+    Generate a quiz for a long lesson from candidate questions of its chunks
+
+    Up to count chunks, spread over the lesson, get their candidates in
+    parallel. The first valid question of every chunk is yielded as soon as
+    the chunk is done, the remaining candidates then fill up the quiz.
+    """
+    step = max(1, len(chunks) / count)
+    selected = [chunks[int((i + 0.5) * step)] for i in range(min(count, len(chunks)))]
+    # One spare candidate per chunk replaces a dropped one
+    per_chunk = -(-count // len(selected)) + 1
+
+    tasks = [asyncio.create_task(generate_questions(chunk, language, per_chunk)) for chunk in selected]
+    seen: Set[str] = set()
+    spare: List[List[Dict]] = []
+    emitted = 0
+    error: Optional[BaseException] = None
+    try:
+        for done in asyncio.as_completed(tasks):
+            try:
+                candidates = [question.model_dump() for question in await done]
+            except Exception as e:
+                logger.warning("Chunk generation failed", extra={"error": repr(e)})
+                error = e
+                continue
+
+            candidates = [question for question in candidates if accept_question(question, seen)]
+            if candidates and emitted < count:
+                yield candidates.pop(0)
+                emitted += 1
+            spare.append(candidates)
+
+        for question in itertools.chain.from_iterable(itertools.zip_longest(*spare)):
+            if emitted == count:
+                break
+            if question is not None:
+                yield question
+                emitted += 1
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if emitted == 0 and error is not None:
+        raise error
+
+
+async def _get_cached(key: tuple) -> Optional[Dict]:
+    """Look up a quiz in the in-process cache, then in the quiz_cache table"""
+    quiz_data = quiz_cache.get(key)
+    if quiz_data is not None or not QUIZ_CACHE_DB:
+        return quiz_data
+
+    try:
+        quiz_data = await get_cached_quiz(":".join(str(part) for part in key))
+    except Exception:
+        logger.exception("Error reading quiz cache")
+        return None
+
+    if quiz_data is not None:
+        quiz_cache_stats["db_hits"] += 1
+        quiz_cache.set(key, quiz_data)
+    return quiz_data
+
+
+async def _store_cached(key: tuple, lesson_id: int, language: str, quiz_data: Dict) -> None:
+    """Store a generated quiz in the caches"""
+    quiz_cache.set(key, quiz_data)
+
+    if QUIZ_CACHE_DB:
+        try:
+            await store_cached_quiz(":".join(str(part) for part in key), lesson_id, language, quiz_data)
+        except Exception:
+            logger.exception("Error storing quiz cache")
+
+
+async def get_quiz(lesson_id: int, language: str, lesson_text: str, refresh: bool = False) -> Dict:
+    """
+    Get the quiz for a lesson, generating it only on a cache miss
+
+    Args:
+        lesson_id: ID of the lesson link
+        language: Language code of the quiz
+        lesson_text: Text of the lesson
+        refresh: Skip the caches and generate a new quiz
+
+    Returns:
+        Quiz data as a dict
+    """
+    key = quiz_cache_key(language, lesson_text)
+
+    if not refresh:
+        quiz_data = await _get_cached(key)
+        if quiz_data is not None:
+            return quiz_data
+
+    quiz_data = (await generate_quiz(lesson_text, language)).model_dump()
+    await _store_cached(key, lesson_id, language, quiz_data)
+    return quiz_data
+
+
+async def get_quiz_stream(lesson_id: int, language: str, lesson_text: str) -> QuizStream:
+    """
+    Get the quiz for a lesson as a stream of questions
+
+    A cached quiz is returned as a finished stream. Otherwise the quiz is
+    generated in the background and every question is available as soon as
+    the LLM has written it; the complete quiz is then cached.
+    """
+    key = quiz_cache_key(language, lesson_text)
+    quiz_data = await _get_cached(key)
+    if quiz_data is not None:
+        return QuizStream(quiz_data["questions"], done=True)
+
+    # Join the generation that is already running for this quiz
+    stream = _streams.get(key)
+    if stream is not None:
+        return stream
+
+    # Fail here, not in the background, if the LLM is not configured
+    get_llm()
+    stream = _streams[key] = QuizStream()
+
+    async def generate() -> None:
+        complete = False
+        try:
+            async for question in stream_quiz_questions(lesson_text, language):
+                await stream.put(question)
+            complete = True
+        except Exception as e:
+            await stream.finish(e)
+            return
+        finally:
+            # Cache the quiz before leaving the registry, so that nobody
+            # starts a new generation in between
+            if complete and stream.questions:
+                quiz_cache.set(key, {"questions": stream.questions})
+            _streams.pop(key, None)
+
+        await stream.finish()
+        if stream.questions:
+            await _store_cached(key, lesson_id, language, {"questions": stream.questions})
+
+    task = asyncio.create_task(generate())
+    _generation_tasks.add(task)
+    task.add_done_callback(_generation_tasks.discard)
+    return stream
+
+
+async def prefill_quiz_cache(lesson_id: int, lesson_text: str, languages: Iterable[str]) -> None:
+    """Generate quizzes for a freshly saved lesson ahead of the students"""
+    for language in languages:
+        try:
+            # Students who open the link meanwhile join this generation
+            stream = await get_quiz_stream(lesson_id, language, lesson_text)
+            async for _ in stream:
+                pass
+        except Exception:
+            logger.exception("Error prefilling quiz cache", extra={"lesson_id": lesson_id, "language": language})
+
+
+async def generate_question_bank(lesson_text: str, language: str, size: int = QUESTION_BANK_SIZE) -> List[Dict]:
+    """
+    Generate a pool of validated questions for the lesson text
+
+    The pool is requested in parallel batches of QUESTION_BANK_BATCH questions.
+    A long lesson gets one batch from each of as many chunks, spread over the
+    lesson, so the number of requests does not grow with its length. Invalid
+    and repeated questions are dropped, so the pool may be smaller than size.
+    """
+    chunks = split_text(lesson_text, QUIZ_CHUNK_CHARS)
+    wanted = -(-size // QUESTION_BANK_BATCH)
+    step = max(1, len(chunks) / wanted)
+    selected = [chunks[int((i + 0.5) * step)] for i in range(min(wanted, len(chunks)))]
+    per_chunk = -(-size // len(selected))
+    requests = [
+        (chunk, min(QUESTION_BANK_BATCH, per_chunk - start))
+        for chunk in selected
+        for start in range(0, per_chunk, QUESTION_BANK_BATCH)
+    ]
+    quiz_cache_stats["generations"] += len(requests)
+
+    batches = await asyncio.gather(*(generate_questions(text, language, count) for text, count in requests))
+
+    # Take questions of all chunks in turn, so a truncated pool still covers the lesson
+    questions = []
+    seen: Set[str] = set()
+    for question in itertools.chain.from_iterable(itertools.zip_longest(*batches)):
+        if question is None:
+            continue
+        question = question.model_dump()
+        if accept_question(question, seen):
+            questions.append(question)
+    return questions[:size]
+
+
+async def refresh_question_bank(lesson_id: int, language: str, lesson_text: str) -> List[Dict]:
+    """Generate the question bank of a lesson and replace the stored one"""
+    questions = await generate_question_bank(lesson_text, language)
+    await replace_question_bank(lesson_id, language, PROMPT_VERSION, questions)
+    question_banks.set((lesson_id, language), questions, ttl=None if questions else EMPTY_BANK_TTL)
+    logger.info(
+        "Question bank generated",
+        extra={"lesson_id": lesson_id, "language": language, "questions": len(questions)}
+    )
+    return questions
+
+
+async def build_question_bank(lesson_id: int, lesson_text: str, languages: Iterable[str]) -> None:
+    """Generate question banks for a freshly saved lesson ahead of the students"""
+    for language in languages:
+        try:
+            await refresh_question_bank(lesson_id, language, lesson_text)
+        except Exception:
+            logger.exception("Error generating question bank", extra={"lesson_id": lesson_id, "language": language})
+
+
+async def get_bank(lesson_id: int, language: str) -> List[Dict]:
+    """
+    Get the question bank of a lesson from the cache or the question_bank table
+
+    Returns:
+        List of questions, empty if the bank has not been generated
+    """
+    key = (lesson_id, language)
+    questions = question_banks.get(key)
+    if questions is not None:
+        return questions
+
+    questions = await get_question_bank(lesson_id, language, PROMPT_VERSION)
+    question_banks.set(key, questions, ttl=None if questions else EMPTY_BANK_TTL)
+    return questions
+
+
+def sample_quiz(bank: List[Dict], count: int = QUIZ_QUESTIONS, rng: random.Random = random) -> List[Dict]:
+    """
+    Pick questions of the bank for one student
+
+    The options of every question are shuffled and correctAnswer points
+    to the same option at its new position.
+    """
+    questions = []
+    for question in rng.sample(bank, min(count, len(bank))):
+        order = list(range(len(question["options"])))
+        rng.shuffle(order)
+        questions.append({
+            **question,
+            "options": [question["options"][i] for i in order],
+            "correctAnswer": order.index(question["correctAnswer"])
+        })
+    return questions
+
+
+async def regenerate_quiz(lesson_id: int, languages: Iterable[str], lesson_text: Optional[str] = None) -> None:
+    """Drop cached quizzes of a lesson and generate new ones"""
+    if lesson_text is None:
+        lesson_text = await get_lesson_text(lesson_id)
+
+    # Lessons with the same text get the new quiz too
+    text_hash = content_hash(lesson_text)
+    quiz_cache.invalidate(lambda key: key[0] == text_hash)
+
+    if QUESTION_BANK_SIZE:
+        question_banks.invalidate(lambda key: key[0] == lesson_id)
+        for language in languages:
+            await refresh_question_bank(lesson_id, language, lesson_text)
+        return
+
+    for language in languages:
+        await get_quiz(lesson_id, language, lesson_text, refresh=True)
@@ -0,0 +1,149 @@
+import os
+import json
+import random
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional
+from app.utils.metrics import counter, gauge
+from app.utils.storage import worker_path
+
+logger = logging.getLogger(__name__)
+
+RESULTS_PENDING = gauge("quiz_results_pending", "Quiz results waiting for the next bulk insert")
+RESULTS_SPILLED = counter("quiz_results_spilled_total", "Quiz results saved to the spill file after failed inserts")
+
+
+class ResultWriter:
+    """
+    Write-behind buffer for quiz_results rows
+
+    Rows are inserted in bulk when the buffer reaches batch_size or every
+    flush_interval seconds. A batch that still fails after retries is
+    appended to a JSON lines spill file and inserted again on the next start.
+    """
+
+    def __init__(
+        self,
+        insert_rows: Callable[[List[dict]], Awaitable[None]],
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_retries: int = 3,
+        spill_path: Optional[str] = None
+    ):
+        self.insert_rows = insert_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.spill_path = spill_path
+        self._rows: List[dict] = []
+        self._full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, row: dict) -> None:
+        """Queue a row for the next bulk insert"""
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self._full.set()
+
+    @property
+    def pending(self) -> int:
+        """Number of rows waiting to be inserted"""
+        return len(self._rows)
+
+    async def flush(self) -> None:
+        """Insert all queued rows"""
+        async with self._flush_lock:
+            while self._rows:
+                batch = self._rows[:self.batch_size]
+                del self._rows[:self.batch_size]
+                await self._insert(batch)
+
+    async def _insert(self, batch: List[dict]) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.insert_rows(batch)
+                return
+            except Exception:
+                logger.exception("Error storing quiz results", extra={"rows": len(batch), "attempt": attempt + 1})
+                if attempt < self.max_retries:
+                    await asyncio.sleep(random.uniform(0, min(10, 0.5 * 2 ** attempt)))
+
+        self._spill(batch)
+
+    def _spill(self, batch: List[dict]) -> None:
+        if not self.spill_path:
+            logger.error("Lost quiz results: RESULTS_SPILL_PATH is not set", extra={"rows": len(batch)})
+            return
+
+        with open(self.spill_path, "a") as f:
+            for row in batch:
+                f.write(json.dumps(row) + "\n")
+        RESULTS_SPILLED.inc(len(batch))
+        logger.warning("Saved quiz results to the spill file", extra={"rows": len(batch), "path": self.spill_path})
+
+    def _load_spill(self) -> None:
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+
+        # Rows are read back into the buffer; if they fail again they are spilled again
+        with open(self.spill_path, "r") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        os.remove(self.spill_path)
+
+        self._rows[:0] = rows
+        logger.info("Loaded quiz results from the spill file", extra={"rows": len(rows), "path": self.spill_path})
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Load spilled rows and start flushing in the background"""
+        self._load_spill()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flush and insert what is left"""
+        if self._task is not None:
+            # Never cancel a batch in the middle of its insert
+            async with self._flush_lock:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+
+        await self.flush()
+
+
+_writer: Optional[ResultWriter] = None
+
+
+def init_result_writer(insert_rows: Callable[[List[dict]], Awaitable[None]]) -> ResultWriter:
+    """Create the shared quiz results writer"""
+    global _writer
+    # Каждый webhook воркер дописывает и повторяет только свой файл
+    spill_path = os.getenv("RESULTS_SPILL_PATH", "quiz_results.spill.jsonl")
+    _writer = ResultWriter(
+        insert_rows,
+        batch_size=int(os.getenv("RESULTS_BATCH_SIZE", "100")),
+        flush_interval=float(os.getenv("RESULTS_FLUSH_INTERVAL", "1")),
+        max_retries=int(os.getenv("RESULTS_MAX_RETRIES", "3")),
+        spill_path=worker_path(spill_path) if spill_path else None
+    )
+    RESULTS_PENDING.set_function(lambda: _writer.pending)
+    return _writer
+
+
+def get_result_writer() -> ResultWriter:
+    """Get the shared quiz results writer"""
+    if _writer is None:
+        raise RuntimeError("Result writer is not initialized")
+    return _writer
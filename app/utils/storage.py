@@ -0,0 +1,133 @@
+import os
+import json
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+# Compact JSON for FSM data: no spaces, non-ASCII text kept as is
+compact_dumps = partial(json.dumps, separators=(",", ":"), ensure_ascii=False)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage in a local SQLite database
+
+    All queries run in one dedicated thread, so the event loop is never blocked
+    and every update_data is a single read-modify-write transaction.
+    """
+
+    def __init__(self, path: str, key_builder: Optional[KeyBuilder] = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+        )
+
+    async def _run(self, func, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _set_state(self, key: str, state: Optional[str]) -> None:
+        self._connection.execute(
+            "INSERT INTO fsm (key, state) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (key, state)
+        )
+
+    def _get_column(self, key: str, column: str) -> Optional[str]:
+        row = self._connection.execute(f"SELECT {column} FROM fsm WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_data(self, key: str, data: Dict[str, Any]) -> None:
+        self._connection.execute(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (key, compact_dumps(data))
+        )
+
+    def _update_data(self, key: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            current = self._get_column(key, "data")
+            current = json.loads(current) if current else {}
+            current.update(data)
+            self._set_data(key, current)
+        return current
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._run(self._set_state, self.key_builder.build(key), state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._run(self._get_column, self.key_builder.build(key), "state")
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(self._set_data, self.key_builder.build(key), data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = await self._run(self._get_column, self.key_builder.build(key), "data")
+        return json.loads(data) if data else {}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._run(self._update_data, self.key_builder.build(key), data)
+
+    async def close(self) -> None:
+        await self._run(self._connection.close)
+        self._executor.shutdown(wait=False)
+
+
+def worker_path(path: str) -> str:
+    """
+    Path of a local file owned by this process
+
+    Webhook workers (WEBHOOK_WORKERS > 1) share the environment, so each one
+    gets its own file: jobs.sqlite3 becomes jobs.worker-1.sqlite3 in worker 1.
+    A worker keeps its number across restarts and finds its file again.
+    """
+    worker = os.getenv("WEBHOOK_WORKER")
+    if not worker:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker-{worker}{ext}"
+
+
+def create_storage() -> BaseStorage:
+    """
+    Create the FSM storage selected by the FSM_STORAGE environment variable
+
+    - memory: state is kept in the process and lost on restart (default)
+    - redis: REDIS_URL, shared by all bot processes
+    - sqlite: FSM_SQLITE_PATH, survives restarts of a single process
+    """
+    backend = os.getenv("FSM_STORAGE", "memory")
+    # Незавершенные квизы старше суток не нужны
+    ttl = int(os.getenv("FSM_STATE_TTL", "86400"))
+
+    if backend == "memory":
+        return MemoryStorage()
+
+    if backend == "redis":
+        # redis (в requirements.txt) импортируется только в этом режиме, чтобы не замедлять старт остальных
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        return RedisStorage.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            state_ttl=ttl,
+            data_ttl=ttl,
+            json_dumps=compact_dumps
+        )
+
+    if backend == "sqlite":
+        return SQLiteStorage(os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3"))
+
+    raise ValueError(f"Unknown FSM_STORAGE: {backend}")
@@ -0,0 +1,116 @@
+import os
+import signal
+import logging
+import secrets
+import asyncio
+import multiprocessing
+from typing import Callable, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from app.routes import register_handlers
+from app.utils.log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str, secret: str) -> web.Application:
+    """Build the aiohttp application that feeds webhook updates to the dispatcher"""
+    app = web.Application()
+
+    # Dispatcher shutdown (draining quizzes) must run before the bot session is closed,
+    # so it is registered first
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    return app
+
+
+def _serve(create_dispatcher: Callable[[], Dispatcher], create_bot: Callable[[], Bot], host: str, port: int, path: str, secret: str, worker: Optional[int] = None) -> None:
+    """Run one webhook worker until SIGINT/SIGTERM"""
+    if worker is not None:
+        # Local files of the worker (jobs, poll snapshot, spill file) get its number
+        os.environ["WEBHOOK_WORKER"] = str(worker)
+    setup_logging()
+    app = create_webhook_app(create_dispatcher(), create_bot(), path, secret)
+    web.run_app(
+        app,
+        host=host,
+        port=port,
+        reuse_port=worker is not None,
+        shutdown_timeout=float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30")),
+        print=None
+    )
+
+
+async def _set_webhook(create_bot: Callable[[], Bot], url: str, secret: str) -> None:
+    # Only the update types the registered handlers need
+    dp = Dispatcher()
+    register_handlers(dp)
+
+    bot = create_bot()
+    try:
+        await bot.set_webhook(
+            url=url,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+        )
+    finally:
+        await bot.session.close()
+
+
+def run_webhook(create_dispatcher: Callable[[], Dispatcher], create_bot: Callable[[], Bot]) -> None:
+    """
+    Run the bot in webhook mode
+
+    Environment variables:
+        WEBHOOK_URL: Public base URL Telegram sends updates to
+        WEBHOOK_PATH: Path of the webhook endpoint (default /webhook)
+        WEBHOOK_SECRET: Secret token checked on every update, random if not set
+        WEBHOOK_HOST, WEBHOOK_PORT: Interface and port to listen on
+        WEBHOOK_WORKERS: Number of worker processes sharing the port
+    """
+    base_url = os.getenv("WEBHOOK_URL")
+    if not base_url:
+        raise RuntimeError("WEBHOOK_URL is required in webhook mode")
+
+    path = os.getenv("WEBHOOK_PATH", "/webhook")
+    secret = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    host = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    port = int(os.getenv("WEBHOOK_PORT", "8080"))
+    workers = int(os.getenv("WEBHOOK_WORKERS", "1"))
+
+    if workers > 1 and os.getenv("FSM_STORAGE", "memory") != "redis":
+        logger.warning("WEBHOOK_WORKERS > 1 needs FSM_STORAGE=redis, otherwise quiz state is not shared")
+
+    logger.info("Starting bot in webhook mode", extra={"workers": workers})
+    asyncio.run(_set_webhook(create_bot, base_url.rstrip("/") + path, secret))
+
+    if workers == 1:
+        _serve(create_dispatcher, create_bot, host, port, path, secret)
+        return
+
+    # Workers bind the same port with SO_REUSEPORT and the kernel spreads
+    # Telegram connections between them
+    processes = [
+        multiprocessing.Process(
+            target=_serve,
+            args=(create_dispatcher, create_bot, host, port, path, secret, i),
+            name=f"webhook-worker-{i}"
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame) -> None:
+        # Workers drain their quizzes on SIGTERM
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for process in processes:
+        process.join()
@@ -0,0 +1,65 @@
+"""
+Peak memory of the results export with synthetic rows
+
+    python -m benchmarks.export_memory --rows 100000
+"""
+import os
+import time
+import asyncio
+import argparse
+import tracemalloc
+from typing import AsyncIterator, List
+from app.utils.export import EXPORT_CHUNK_SIZE, export_results
+
+
+def fake_result(i: int) -> dict:
+    """A row as returned by get_quiz_results_by_link"""
+    return {
+        "id": i + 1,
+        "link_id": i % 20 + 1,
+        "student_id": float(100000 + i % 5000),
+        "correct_answers": i % 4,
+        "total_questions": 3,
+        "average_score": int(i % 4 / 3 * 100),
+        "completed_at": "2025-03-01T12:00:00.000000+00:00",
+        "name": f"Ученик {i % 5000}"
+    }
+
+
+async def chunked(rows: int, chunk_size: int) -> AsyncIterator[List[dict]]:
+    for start in range(0, rows, chunk_size):
+        await asyncio.sleep(0)
+        yield [fake_result(i) for i in range(start, min(start + chunk_size, rows))]
+
+
+async def measure(rows: int, chunk_size: int, file_format: str) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    path, count = await export_results(chunked(rows, chunk_size), file_format)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    size = os.path.getsize(path)
+    os.remove(path)
+    print(
+        f"{file_format} chunk={chunk_size}: {count} rows in {elapsed:.2f}s, "
+        f"file {size / 1024 / 1024:.1f} MiB, peak memory {peak / 1024 / 1024:.1f} MiB"
+    )
+
+
+async def run(rows: int, chunk_size: int, xlsx: bool) -> None:
+    # Reading everything in one chunk shows the memory the export saves
+    await measure(rows, rows, "csv")
+    await measure(rows, chunk_size, "csv")
+    if xlsx:
+        await measure(rows, chunk_size, "xlsx")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    parser.add_argument("--xlsx", action="store_true", help="Also measure XLSX, needs openpyxl")
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.chunk_size, args.xlsx))
@@ -0,0 +1,268 @@
+"""Local stand-ins for external services used by the benchmarks"""
+import json
+import time
+import asyncio
+import itertools
+from typing import Callable, Dict, List, Tuple
+from aiohttp import web
+
+# Token of the fake bot, aiogram only checks its format
+BOT_TOKEN = "123456:FAKE-TOKEN"
+
+
+def fake_quiz(questions: int = 3) -> dict:
+    """Build a quiz in the format of app.utils.quiz.Quiz"""
+    return {
+        "questions": [
+            {
+                "question": f"Вопрос {i + 1}?",
+                "options": ["A", "B", "C", "D"],
+                "correctAnswer": i % 4,
+                "explanation": "Так сказано в тексте урока."
+            }
+            for i in range(questions)
+        ]
+    }
+
+
+async def start_mock_llm(latency: float = 0.5, questions: int = 3, host: str = "127.0.0.1", port: int = 0) -> Tuple[web.AppRunner, str]:
+    """
+    Start a mock OpenAI-compatible server
+
+    Args:
+        latency: Seconds to wait before answering every completion
+        questions: Number of questions in every generated quiz
+        host: Interface to listen on
+        port: Port to listen on, 0 picks a free one
+
+    Returns:
+        Runner to clean up and the base URL for the OpenAI client
+    """
+    app = web.Application()
+    app["stats"] = {"requests": 0}
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        app["stats"]["requests"] += 1
+        content = json.dumps(fake_quiz(questions), ensure_ascii=False)
+        completion_id = f"chatcmpl-{app['stats']['requests']}"
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            })
+
+        # Stream the same content in even pieces spread over the latency
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        pieces = [content[i:i + 16] for i in range(0, len(content), 16)]
+
+        for i, piece in enumerate(pieces + [None]):
+            await asyncio.sleep(latency / (len(pieces) + 1))
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "mock",
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece} if piece is not None else {},
+                    "finish_reason": None if piece is not None else "stop"
+                }]
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app.router.add_post("/v1/chat/completions", chat_completions)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}/v1"
+
+
+def _equal(value, text: str) -> bool:
+    """Compare a column value with a value from a query string"""
+    if str(value) == text:
+        return True
+    # 1000 and 1000.0 are the same user ID
+    try:
+        return float(value) == float(text)
+    except (TypeError, ValueError):
+        return False
+
+
+def _matches(row: dict, filters: Dict[str, str]) -> bool:
+    """Apply the eq. and in.() filters of a query string to a row, other filters are ignored"""
+    for column, condition in filters.items():
+        operator, _, value = condition.partition(".")
+        if operator == "eq":
+            values = [value]
+        elif operator == "in":
+            values = value.strip("()").split(",")
+        else:
+            continue
+        if not any(_equal(row.get(column), text) for text in values):
+            return False
+    return True
+
+
+async def start_mock_postgrest(tables: Dict[str, List[dict]] = None, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0) -> Tuple[web.AppRunner, str]:
+    """
+    Start a mock PostgREST server for the Supabase client
+
+    Selects answer with the rows of the table that match the eq. and in.()
+    filters, any other request with an empty result. Concurrent requests are
+    counted in app["stats"] to check that they overlap.
+
+    Args:
+        tables: Rows by table name
+        latency: Seconds to wait before answering every request
+        host: Interface to listen on
+        port: Port to listen on, 0 picks a free one
+
+    Returns:
+        Runner to clean up and the URL for URL_SUPABASE
+    """
+    app = web.Application()
+    app["tables"] = tables or {}
+    app["stats"] = {"requests": 0, "in_flight": 0, "max_in_flight": 0}
+
+    async def handle(request: web.Request) -> web.Response:
+        stats = app["stats"]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            stats["in_flight"] -= 1
+
+        if request.method != "GET":
+            return web.json_response([], status=201 if request.method == "POST" else 200)
+
+        filters = {key: value for key, value in request.query.items() if key not in ("select", "order", "limit", "offset")}
+        rows = [row for row in app["tables"].get(request.match_info["table"], []) if _matches(row, filters)]
+        return web.json_response(rows, headers={"Content-Range": f"0-{max(len(rows) - 1, 0)}/{len(rows)}"})
+
+    app.router.add_route("*", "/rest/v1/{table}", handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}"
+
+
+# Any key in the format of a JWT passes the checks of the Supabase client
+SUPABASE_KEY = "fake.supabase.key"
+
+
+class FakeTelegram:
+    """
+    Minimal Bot API server that accepts every call and records it
+
+    Listeners are called with (method, params) for every request, e.g. to
+    measure when a reply to a given chat was sent.
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, int] = {}
+        self.listeners: List[Callable[[str, dict], None]] = []
+        self._ids = itertools.count(1)
+
+    def _message(self, params: dict) -> dict:
+        message = {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": int(BOT_TOKEN.split(":")[0]), "is_bot": True, "first_name": "Bot", "username": "fake_bot"}
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return self._message(params)
+        if method == "sendPoll":
+            message = self._message(params)
+            message["poll"] = {
+                "id": str(next(self._ids)),
+                "question": params["question"],
+                "options": [{"text": option, "voter_count": 0} for option in json.loads(params["options"])],
+                "total_voter_count": 0,
+                "is_closed": False,
+                "is_anonymous": False,
+                "type": "quiz",
+                "allows_multiple_answers": False
+            }
+            return message
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        result = self._result(method, params)
+        for listener in self.listeners:
+            listener(method, params if not isinstance(result, dict) else {**params, "result": result})
+
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[web.AppRunner, str]:
+        """Start the server and return the runner and its base URL"""
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+
+        port = runner.addresses[0][1]
+        return runner, f"http://{host}:{port}"
+
+
+def message_update(update_id: int, user_id: int, text: str) -> dict:
+    """Build a private message update, commands get a bot_command entity"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+        "text": text
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def poll_answer_update(update_id: int, user_id: int, poll_id: str, option: int) -> dict:
+    """Build a poll answer update"""
+    return {
+        "update_id": update_id,
+        "poll_answer": {
+            "poll_id": poll_id,
+            "user": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "option_ids": [option]
+        }
+    }
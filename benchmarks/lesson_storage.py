@@ -0,0 +1,137 @@
+"""
+Storage size and fetch latency of lesson texts: links.text vs lesson_bodies
+
+    python -m benchmarks.lesson_storage --lessons 500 --paragraphs 40
+    python -m benchmarks.lesson_storage --supabase --lessons 200
+
+The corpus is made of long synthetic lessons, --duplicates of them pasted
+again by another teacher. Without --supabase only the encodings are compared
+offline. With --supabase, lessons are also stored both ways in the instance
+from URL_SUPABASE and API_SUPABASE (yahz.sql and migrations/*.sql applied) and
+fetched one by one with an empty lesson cache.
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+from typing import Callable, List
+from app.utils.compression import compress_text, content_hash, decompress_text
+
+BENCH_AUTHOR_ID = -2.0
+
+
+def make_corpus(lessons: int, paragraphs: int, duplicates: float, seed: int = 1) -> List[str]:
+    """Long lessons from a fixed vocabulary, some of them repeated"""
+    rng = random.Random(seed)
+    syllables = ["ра", "то", "ми", "ка", "ло", "не", "ст", "вор", "ан", "ие", "ция", "про", "за", "ет"]
+    vocabulary = ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(600)]
+
+    def sentence() -> str:
+        words = rng.choices(vocabulary, k=rng.randint(6, 16))
+        return " ".join(words).capitalize() + "."
+
+    texts: List[str] = []
+    for i in range(lessons):
+        if texts and rng.random() < duplicates:
+            texts.append(rng.choice(texts))
+            continue
+        body = "\n\n".join(" ".join(sentence() for _ in range(rng.randint(3, 6))) for _ in range(paragraphs))
+        texts.append(f"Урок {i}\n\n{body}")
+    return texts
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else float("nan")
+
+
+def measure_encoding(texts: List[str], encoding: str) -> None:
+    raw = sum(len(text.encode("utf-8")) for text in texts)
+
+    start = time.perf_counter()
+    bodies = {}
+    for text in texts:
+        text_hash = content_hash(text)
+        if text_hash not in bodies:
+            bodies[text_hash] = compress_text(text, encoding)
+    encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for stored_encoding, stored in bodies.values():
+        decompress_text(stored_encoding, stored)
+    decode = time.perf_counter() - start
+
+    stored_size = sum(len(stored.encode("utf-8")) for _, stored in bodies.values())
+    print(
+        f"{encoding:6} {len(bodies):5} bodies {stored_size / 1024 / 1024:8.2f} MiB "
+        f"({stored_size / raw:5.1%} of links.text), "
+        f"encode {encode / len(texts) * 1000:.2f} ms, decode {decode / len(bodies) * 1000:.2f} ms per lesson"
+    )
+
+
+async def fetch_latency(lesson_ids: List[int], fetch: Callable) -> List[float]:
+    latencies = []
+    for lesson_id in lesson_ids:
+        start = time.perf_counter()
+        await fetch(lesson_id)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def run_supabase(texts: List[str]) -> None:
+    from app.utils import database
+    from app.utils.database import get_supabase, store_lesson_text
+
+    supabase = await get_supabase()
+    old_ids = []
+    new_ids = []
+    try:
+        for text in texts:
+            result = await supabase.table("links").insert({"text": text, "author_id": BENCH_AUTHOR_ID}).execute()
+            old_ids.append(result.data[0]["id"])
+            new_ids.append(await store_lesson_text(text, BENCH_AUTHOR_ID))
+
+        async def fetch_text(lesson_id: int) -> str:
+            result = await supabase.table("links").select("text").eq("id", lesson_id).execute()
+            return result.data[0]["text"]
+
+        async def fetch_body(lesson_id: int) -> str:
+            database._lesson_cache.clear()
+            return await database.get_lesson_text(lesson_id)
+
+        for name, ids, fetch in (("links.text", old_ids, fetch_text), ("lesson_bodies", new_ids, fetch_body)):
+            latencies = await fetch_latency(ids, fetch)
+            print(f"fetch {name:14} p50 {percentile(latencies, 0.5) * 1000:6.1f} ms, p99 {percentile(latencies, 0.99) * 1000:6.1f} ms")
+    finally:
+        await supabase.table("links").delete().eq("author_id", BENCH_AUTHOR_ID).execute()
+        hashes = list({content_hash(text) for text in texts})
+        for start in range(0, len(hashes), 100):
+            await supabase.table("lesson_bodies").delete().in_("hash", hashes[start:start + 100]).execute()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lessons", type=int, default=500)
+    parser.add_argument("--paragraphs", type=int, default=40, help="Paragraphs per lesson, 3-6 sentences each")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="Share of lessons pasted again")
+    parser.add_argument("--supabase", action="store_true", help="Also measure fetch latency from Supabase")
+    args = parser.parse_args()
+
+    texts = make_corpus(args.lessons, args.paragraphs, args.duplicates)
+    raw = sum(len(text.encode("utf-8")) for text in texts)
+    print(f"{len(texts)} lessons, {raw / len(texts) / 1024:.1f} KiB on average, links.text {raw / 1024 / 1024:.2f} MiB")
+
+    encodings = ["none", "gzip"]
+    try:
+        import zstandard  # noqa: F401
+        encodings.append("zstd")
+    except ImportError:
+        print("zstandard is not installed, skipping zstd")
+    for encoding in encodings:
+        measure_encoding(texts, encoding)
+
+    if args.supabase:
+        if not os.getenv("URL_SUPABASE") or not os.getenv("API_SUPABASE"):
+            parser.error("--supabase needs URL_SUPABASE and API_SUPABASE")
+        asyncio.run(run_supabase(texts))
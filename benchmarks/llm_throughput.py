@@ -0,0 +1,54 @@
+"""
+Throughput of quiz generation with N concurrent students
+
+    python -m benchmarks.llm_throughput --students 100 --latency 0.5 --concurrency 8
+"""
+import time
+import argparse
+import asyncio
+from app.utils.llm import LLMClient
+from app.utils.quiz import Quiz
+from benchmarks.fakes import start_mock_llm
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(students: int, latency: float, concurrency: int) -> None:
+    runner, base_url = await start_mock_llm(latency=latency)
+    llm = LLMClient(api_key="mock", base_url=base_url, max_concurrency=concurrency)
+    latencies = []
+
+    async def student(i: int) -> None:
+        started = time.perf_counter()
+        await llm.parse(
+            messages=[{"role": "user", "content": f"Текст урока {i}"}],
+            response_format=Quiz
+        )
+        latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(student(i) for i in range(students)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await llm.close()
+        await runner.cleanup()
+
+    print(f"students:    {students}")
+    print(f"concurrency: {concurrency}")
+    print(f"elapsed:     {elapsed:.2f} s")
+    print(f"throughput:  {students / elapsed:.1f} quizzes/s")
+    print(f"p50:         {percentile(latencies, 0.5) * 1000:.0f} ms")
+    print(f"p99:         {percentile(latencies, 0.99) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.5, help="Mock LLM latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(run(args.students, args.latency, args.concurrency))
@@ -0,0 +1,59 @@
+"""
+Memory and task count of the poll scheduler with many concurrent quizzes
+
+    python -m benchmarks.poll_scheduler_load --quizzes 10000 --timeout 2
+"""
+import random
+import asyncio
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+from aiogram.fsm.storage.memory import MemoryStorage
+from app.utils.poll_scheduler import PollScheduler
+
+
+async def run(quizzes: int, questions: int, timeout: float, answer_rate: float) -> None:
+    expired = 0
+
+    async def on_timeout(bot, state, poll_id, record) -> None:
+        nonlocal expired
+        expired += 1
+
+    scheduler = PollScheduler(SimpleNamespace(id=1), MemoryStorage(), on_timeout)
+    scheduler.start()
+    tracemalloc.start()
+
+    for question in range(questions):
+        # Every quiz opens a poll, some students answer before the deadline
+        for quiz in range(quizzes):
+            scheduler.add(f"{question}:{quiz}", quiz, quiz, "ru", timeout)
+
+        for quiz in range(quizzes):
+            if random.random() < answer_rate:
+                scheduler.cancel(f"{question}:{quiz}")
+
+        current, peak = tracemalloc.get_traced_memory()
+        print(
+            f"question {question + 1}: pending={scheduler.pending} "
+            f"heap={len(scheduler._heap)} tasks={len(asyncio.all_tasks())} "
+            f"memory={current / 1024 / 1024:.1f} MiB peak={peak / 1024 / 1024:.1f} MiB"
+        )
+        await asyncio.sleep(timeout / 2)
+
+    await asyncio.sleep(timeout)
+    current, peak = tracemalloc.get_traced_memory()
+    print(
+        f"done: expired={expired} pending={scheduler.pending} tasks={len(asyncio.all_tasks())} "
+        f"memory={current / 1024 / 1024:.1f} MiB peak={peak / 1024 / 1024:.1f} MiB"
+    )
+    await scheduler.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quizzes", type=int, default=10000)
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=2, help="Poll deadline in seconds")
+    parser.add_argument("--answer-rate", type=float, default=0.7)
+    args = parser.parse_args()
+    asyncio.run(run(args.quizzes, args.questions, args.timeout, args.answer_rate))
@@ -0,0 +1,77 @@
+"""
+Quiz results write throughput: one insert per result vs the write-behind queue
+
+Needs a Supabase instance with yahz.sql applied, e.g. a local one started
+with `supabase start`, in URL_SUPABASE and API_SUPABASE:
+
+    python -m benchmarks.result_writes --results 2000 --concurrency 50
+"""
+import time
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from app.utils.database import (
+    get_supabase, quiz_result_row, store_quiz_result, store_quiz_results, store_lesson_text
+)
+from app.utils.result_writer import ResultWriter
+
+BENCH_AUTHOR_ID = -1.0
+BENCH_STUDENT_BASE = -1000000.0
+
+
+async def single_inserts(link_id: int, students: list, results: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def finish_quiz(i: int) -> None:
+        async with semaphore:
+            await store_quiz_result(students[i % len(students)], link_id, i % 5, 5)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(finish_quiz(i) for i in range(results)))
+    return time.perf_counter() - start
+
+
+async def batched_inserts(link_id: int, students: list, results: int, batch_size: int) -> float:
+    writer = ResultWriter(store_quiz_results, batch_size=batch_size, flush_interval=0.05)
+    writer.start()
+
+    start = time.perf_counter()
+    for i in range(results):
+        writer.add(quiz_result_row(students[i % len(students)], link_id, i % 5, 5))
+        # Students finish over time, not all in the same tick
+        if i % batch_size == 0:
+            await asyncio.sleep(0)
+    await writer.stop()
+    return time.perf_counter() - start
+
+
+async def run(results: int, concurrency: int, batch_size: int, students: int) -> None:
+    supabase = await get_supabase()
+    link_id = await store_lesson_text("Benchmark lesson", BENCH_AUTHOR_ID)
+    student_ids = [BENCH_STUDENT_BASE - i for i in range(students)]
+    await supabase.table("users").upsert(
+        [{"user_id": user_id, "name": f"Student {i}"} for i, user_id in enumerate(student_ids)],
+        on_conflict="user_id"
+    ).execute()
+
+    try:
+        elapsed = await single_inserts(link_id, student_ids, results, concurrency)
+        print(f"single inserts (concurrency {concurrency}): {elapsed:.2f}s, {results / elapsed:.0f} rows/sec")
+
+        elapsed = await batched_inserts(link_id, student_ids, results, batch_size)
+        print(f"write-behind (batch {batch_size}): {elapsed:.2f}s, {results / elapsed:.0f} rows/sec")
+    finally:
+        await supabase.table("quiz_results").delete().eq("link_id", link_id).execute()
+        await supabase.table("links").delete().eq("id", link_id).execute()
+        await supabase.table("users").delete().in_("user_id", student_ids).execute()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50, help="Parallel single-row inserts")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--students", type=int, default=100)
+    args = parser.parse_args()
+    load_dotenv()
+    asyncio.run(run(args.results, args.concurrency, args.batch_size, args.students))
@@ -0,0 +1,98 @@
+"""
+Import time of main.py, measured with python -X importtime
+
+    python -m benchmarks.startup --runs 5 --budget 1500
+
+Reports the fastest of --runs cold interpreter starts and the heaviest
+top-level packages. Exits with 1 if the import takes longer than --budget
+milliseconds or if one of the --lazy packages is imported by main.py, so it
+can gate a deploy. The SDKs in --lazy are imported by the startup hooks
+(init_db, warm_up_llm) instead.
+
+The import time of aiogram alone varies a lot between machines. With
+--preload, the packages main.py cannot do without are imported first and
+only the time main.py adds on top of them is measured:
+
+    python -m benchmarks.startup --preload --budget 500
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+from typing import Dict, Sequence, Tuple
+
+LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| *(\S+)")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# SDKs main.py must not import
+LAZY_PACKAGES = ("openai", "supabase", "openpyxl")
+# Packages every start needs, imported before main.py with --preload
+FRAMEWORK_PACKAGES = ("aiogram", "aiohttp", "pydantic", "dotenv")
+# Milliseconds main.py may add to the framework, enforced by tests/test_startup.py
+PRELOADED_BUDGET_MS = 500
+
+
+def measure(module: str, preload: Sequence[str] = ()) -> Tuple[int, Dict[str, int]]:
+    """
+    Import the module in a new interpreter, after the preload packages
+
+    Returns:
+        Cumulative import time of the module and of every imported top-level
+        package, in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "".join(f"import {name}; " for name in preload) + f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    packages: Dict[str, int] = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match is None:
+            continue
+        cumulative, name = int(match.group(1)), match.group(2)
+        if name == module:
+            total = cumulative
+        top = name.split(".")[0]
+        if top != module:
+            packages[top] = max(packages.get(top, 0), cumulative)
+    return total, packages
+
+
+def run(args: argparse.Namespace) -> int:
+    preload = FRAMEWORK_PACKAGES if args.preload else ()
+    runs = [measure(args.module, preload) for _ in range(args.runs)]
+    total, packages = min(runs, key=lambda run: run[0])
+
+    print(f"import {args.module}: {total / 1000:.0f} ms (fastest of {args.runs}, slowest {max(run[0] for run in runs) / 1000:.0f} ms)")
+    print("heaviest packages:")
+    for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:24} {cumulative / 1000:8.0f} ms")
+
+    failed = False
+    imported = [name for name in args.lazy.split(",") if name and name in packages]
+    if imported:
+        print(f"\nFAIL: imported at startup: {', '.join(imported)}")
+        failed = True
+    if args.budget is not None and total / 1000 > args.budget:
+        print(f"\nFAIL: import takes more than {args.budget} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Number of packages to list")
+    parser.add_argument("--budget", type=float, help="Fail if the import takes more milliseconds")
+    parser.add_argument("--preload", action="store_true", help=f"Import {', '.join(FRAMEWORK_PACKAGES)} first and measure the rest")
+    parser.add_argument("--lazy", default=",".join(LAZY_PACKAGES), help="Packages main.py must not import")
+    args = parser.parse_args()
+    sys.exit(run(args))
@@ -0,0 +1,48 @@
+"""
+Messages rendered per second by get_text
+
+    python -m benchmarks.translations --renders 1000000
+"""
+import time
+import argparse
+from app.utils.language import DEFAULT_LANGUAGE, TRANSLATIONS, get_text
+
+# The messages sent for every question of every quiz
+HOT_PATH = [
+    ("question_number", (1, 3)),
+    ("question_number_streaming", (2,)),
+    ("time_up", ("Paris",)),
+    ("quiz_completed", (2, 3, 66)),
+    ("quiz_start", ()),
+    ("prev_page", ()),
+]
+
+
+def lookup_and_format(key: str, language: str, *args) -> str:
+    """Nested dict lookup and str.format on every call, for comparison"""
+    if key not in TRANSLATIONS:
+        return f"Missing translation: {key}"
+    if language not in TRANSLATIONS[key]:
+        language = DEFAULT_LANGUAGE
+    text = TRANSLATIONS[key][language]
+    return text.format(*args) if args else text
+
+
+def measure(render, renders: int) -> float:
+    calls = [(key, language, args) for key, args in HOT_PATH for language in ("ru", "en")]
+    rounds = renders // len(calls)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for key, language, args in calls:
+            render(key, language, *args)
+    return rounds * len(calls) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--renders", type=int, default=1000000)
+    args = parser.parse_args()
+
+    print(f"lookup + format: {measure(lookup_and_format, args.renders):,.0f} messages/sec")
+    print(f"get_text:        {measure(get_text, args.renders):,.0f} messages/sec")
@@ -0,0 +1,114 @@
+"""
+Updates/sec and handler latency of the webhook mode
+
+Posts synthetic /language updates to the webhook app, which answers through
+a fake Bot API server. The handler looks the language of the student up
+through the Supabase client in a mock PostgREST server. Handler latency is
+the time from the POST to the bot's sendMessage for that chat.
+
+    python -m benchmarks.webhook_load --updates 2000 --concurrency 100
+"""
+import os
+import time
+import asyncio
+import argparse
+from aiohttp import ClientSession, web
+from benchmarks.fakes import BOT_TOKEN, SUPABASE_KEY, FakeTelegram, start_mock_postgrest
+
+SECRET = "benchmark-secret"
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def command_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Student"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        }
+    }
+
+
+async def run(updates: int, concurrency: int, db_latency: float) -> None:
+    telegram = FakeTelegram()
+    telegram_runner, telegram_url = await telegram.start()
+    students = [{"user_id": 1000 + i, "name": f"Student {i}", "language": "en"} for i in range(updates)]
+    postgrest_runner, postgrest_url = await start_mock_postgrest({"users": students}, latency=db_latency)
+
+    os.environ.update(API_TELEGRAM=BOT_TOKEN, TELEGRAM_API_URL=telegram_url, FSM_STORAGE="memory")
+    from main import create_bot, create_dispatcher
+    from app.webhook import create_webhook_app
+    from app.utils import database
+    from supabase import acreate_client
+
+    # The startup hook keeps this client instead of connecting to URL_SUPABASE
+    database._supabase = await acreate_client(postgrest_url, SUPABASE_KEY)
+
+    app = create_webhook_app(create_dispatcher(), create_bot(), "/webhook", SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/webhook"
+
+    posted = {}
+    latencies = []
+    done = asyncio.Event()
+
+    def on_call(method: str, params: dict) -> None:
+        chat_id = int(params.get("chat_id", 0))
+        if method == "sendMessage" and chat_id in posted:
+            latencies.append(time.perf_counter() - posted.pop(chat_id))
+            if len(latencies) == updates:
+                done.set()
+
+    telegram.listeners.append(on_call)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with ClientSession() as session:
+        # Updates with a wrong secret must be rejected
+        async with session.post(url, json=command_update(0, 1, "/language")) as response:
+            assert response.status == 401, response.status
+
+        async def post(i: int) -> None:
+            async with semaphore:
+                chat_id = 1000 + i
+                posted[chat_id] = time.perf_counter()
+                async with session.post(
+                    url,
+                    json=command_update(i + 1, chat_id, "/language"),
+                    headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}
+                ) as response:
+                    response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(updates)))
+        accepted = time.perf_counter() - started
+        await asyncio.wait_for(done.wait(), 60)
+        handled = time.perf_counter() - started
+
+    await runner.cleanup()
+    await telegram_runner.cleanup()
+    await postgrest_runner.cleanup()
+
+    print(f"updates:     {updates}")
+    print(f"accepted:    {updates / accepted:.0f} updates/s")
+    print(f"handled:     {updates / handled:.0f} updates/s")
+    print(f"p50 latency: {percentile(latencies, 0.5) * 1000:.1f} ms")
+    print(f"p99 latency: {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="Seconds the mock PostgREST takes per query")
+    args = parser.parse_args()
+    asyncio.run(run(args.updates, args.concurrency, args.db_latency))
@@ -1,28 +1,107 @@
 import asyncio
+import logging
 import os
 from dotenv import load_dotenv
 
-from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, PollAnswer
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
 from app.routes import register_handlers
+from app.handlers.start import JOB_TYPES, handle_poll_timeout
+from app.middlewares.inflight import InFlightMiddleware
+from app.middlewares.metrics import RequestMetricsMiddleware
+from app.utils.llm import init_llm, close_llm, warm_up_llm
+from app.utils.database import init_db, close_db, store_quiz_results
+from app.utils.poll_scheduler import init_poll_scheduler, get_poll_scheduler
+from app.utils.result_writer import init_result_writer, get_result_writer
+from app.utils.job_queue import init_job_queue, get_job_queue
+from app.utils.storage import create_storage
+from app.utils.log import setup_logging
+from app.utils.metrics import start_metrics_server, stop_metrics_server
 
+logger = logging.getLogger(__name__)
+
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher) -> None:
+    # Clients are created here, not when their modules are imported
+    await init_db()
+
+    # One shared LLM client for all quiz generations; the openai SDK is
+    # imported in the background while the bot already serves updates
+    if init_llm():
+        dispatcher["llm_warm_up"] = asyncio.create_task(warm_up_llm())
+
+    # One task serves the deadlines of all open quiz polls
+    init_poll_scheduler(bot, dispatcher.storage, handle_poll_timeout).start()
+
+    # Quiz results are inserted in batches in the background
+    init_result_writer(store_quiz_results).start()
+
+    # Quiz generations run in a pool of workers, not in the update handlers
+    await init_job_queue(bot, dispatcher.storage, JOB_TYPES).start()
+
+    # /metrics on METRICS_PORT, if set
+    await start_metrics_server()
+
+
+async def on_shutdown(dispatcher: Dispatcher, in_flight: InFlightMiddleware) -> None:
+    # Let running handlers finish the current quiz step before closing clients
+    drain_timeout = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+    if not await in_flight.drain(drain_timeout):
+        logger.warning("Shutdown: updates still in flight", extra={"count": in_flight.count, "timeout": drain_timeout})
+
+    await get_job_queue().stop()
+    await get_poll_scheduler().stop()
+    await get_result_writer().stop()
+    await close_llm()
+    await close_db()
+    await stop_metrics_server()
+    await dispatcher.storage.close()
 
-async def main() -> None:
-    print("Starting bot...")
-    load_dotenv()
-    bot_token = os.getenv("API_TELEGRAM")
 
-    dp = Dispatcher()
-    bot = Bot(token=bot_token)
+def create_dispatcher() -> Dispatcher:
+    # FSM storage is chosen by FSM_STORAGE: memory, redis or sqlite
+    dp = Dispatcher(storage=create_storage())
+
+    in_flight = InFlightMiddleware()
+    dp.update.outer_middleware(in_flight)
+    dp["in_flight"] = in_flight
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
 
     # Register all handlers from routes.py
     register_handlers(dp)
+    return dp
+
+
+def create_bot() -> Bot:
+    # TELEGRAM_API_URL points the bot to a local Bot API server
+    api_url = os.getenv("TELEGRAM_API_URL")
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url)) if api_url else AiohttpSession()
+
+    # Bot API latency shows up as telegram_request_seconds
+    session.middleware(RequestMetricsMiddleware())
+    return Bot(token=os.getenv("API_TELEGRAM"), session=session)
+
 
+async def main() -> None:
+    logger.info("Starting bot...")
+    dp = create_dispatcher()
+    bot = create_bot()
+
+    # Long polling does not work while a webhook is set
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    load_dotenv()
+    setup_logging()
+
+    if os.getenv("RUN_MODE", "polling") == "webhook":
+        from app.webhook import run_webhook
+
+        run_webhook(create_dispatcher, create_bot)
+    else:
+        asyncio.run(main())
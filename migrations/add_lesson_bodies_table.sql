@@ -0,0 +1,51 @@
+-- Lesson texts stored once per content: links only reference the body by its
+-- SHA-256, so a lesson pasted again adds no text. Long bodies are compressed
+-- by the bot (app/utils/compression.py), body is then base64 of the bytes
+create table if not exists public.lesson_bodies (
+  hash text not null,
+  encoding text not null default 'plain',
+  body text not null,
+  length integer not null,
+  created_at timestamp with time zone not null default now(),
+  constraint lesson_bodies_pkey primary key (hash),
+  constraint lesson_bodies_encoding_check check (encoding in ('plain', 'gzip', 'zstd'))
+) TABLESPACE pg_default;
+
+alter table public.links add column if not exists body_hash text null references public.lesson_bodies (hash);
+alter table public.links add column if not exists preview text null;
+
+-- Lessons saved before this migration keep their text in links.text
+create or replace view public.link_previews as
+select
+  id,
+  author_id,
+  coalesce(preview, left(text, 30)) as preview
+from public.links;
+
+-- Save a lesson in one round trip: the body is inserted only if it is new
+-- Called through PostgREST: supabase.rpc("store_lesson", {...})
+create or replace function public.store_lesson(
+  p_author_id double precision,
+  p_hash text,
+  p_encoding text,
+  p_body text,
+  p_length integer,
+  p_preview text
+)
+returns bigint
+language plpgsql
+as $$
+declare
+  v_id bigint;
+begin
+  insert into public.lesson_bodies (hash, encoding, body, length)
+  values (p_hash, p_encoding, p_body, p_length)
+  on conflict (hash) do nothing;
+
+  insert into public.links (author_id, body_hash, preview)
+  values (p_author_id, p_hash, p_preview)
+  returning id into v_id;
+
+  return v_id;
+end;
+$$;
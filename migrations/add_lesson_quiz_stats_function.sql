@@ -0,0 +1,57 @@
+-- Statistics of one lesson computed in Postgres: summary, score histogram and
+-- one page of students with their best and latest attempt.
+-- Called through PostgREST: supabase.rpc("lesson_quiz_stats", {...})
+create index IF not exists idx_quiz_results_link_id_student_id on public.quiz_results using btree (link_id, student_id, id) TABLESPACE pg_default;
+
+create or replace function public.lesson_quiz_stats(
+  p_link_id bigint,
+  p_limit integer default 40,
+  p_offset integer default 0
+)
+returns jsonb
+language sql
+stable
+as $$
+  with results as (
+    select id, student_id, correct_answers, total_questions, coalesce(average_score, 0) as average_score
+    from public.quiz_results
+    where link_id = p_link_id
+  ),
+  per_student as (
+    select
+      student_id,
+      count(*) as attempts,
+      max(average_score) as best_score,
+      (array_agg(correct_answers order by id desc))[1] as latest_correct,
+      (array_agg(total_questions order by id desc))[1] as latest_total,
+      (array_agg(average_score order by id desc))[1] as latest_score
+    from results
+    group by student_id
+  ),
+  page as (
+    select p.*, u.name
+    from per_student p
+    join public.users u on u.user_id = p.student_id
+    order by p.best_score desc, u.name, p.student_id
+    limit p_limit offset p_offset
+  )
+  select jsonb_build_object(
+    'attempts', (select count(*) from results),
+    'students', (select count(*) from per_student),
+    'mean_score', (select round(avg(average_score), 1) from results),
+    'median_score', (select percentile_cont(0.5) within group (order by average_score) from results),
+    -- Buckets of 10 points, 100% goes to the 90-100 bucket
+    'histogram', (
+      select coalesce(jsonb_agg(jsonb_build_object('bucket', bucket, 'count', n) order by bucket), '[]'::jsonb)
+      from (
+        select least(average_score / 10, 9) * 10 as bucket, count(*) as n
+        from results
+        group by 1
+      ) h
+    ),
+    'rows', (
+      select coalesce(jsonb_agg(to_jsonb(page) order by page.best_score desc, page.name, page.student_id), '[]'::jsonb)
+      from page
+    )
+  );
+$$;
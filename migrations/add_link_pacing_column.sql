@@ -0,0 +1,5 @@
+-- Pacing of a lesson quiz: normal pauses to let students read the explanation, rapid sends the next poll at once
+alter table public.links add column if not exists pacing text not null default 'normal';
+
+alter table public.links drop constraint if exists links_pacing_check;
+alter table public.links add constraint links_pacing_check check (pacing in ('normal', 'rapid'));
@@ -0,0 +1,14 @@
+-- Lesson list of a teacher without the full lesson texts. New lessons keep
+-- their preview in links.preview (see add_lesson_bodies_table.sql), lessons
+-- saved before that in links.text. Same definition there, so the migrations
+-- can be applied in any order
+alter table public.links add column if not exists preview text null;
+
+create or replace view public.link_previews as
+select
+  id,
+  author_id,
+  coalesce(preview, left(text, 30)) as preview
+from public.links;
+
+create index IF not exists idx_links_author_id on public.links using btree (author_id, id) TABLESPACE pg_default;
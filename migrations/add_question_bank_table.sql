@@ -0,0 +1,13 @@
+-- Pools of generated questions; every student gets a random sample of them
+create table if not exists public.question_bank (
+  id bigint generated by default as identity not null,
+  link_id bigint not null,
+  language text not null,
+  prompt_version integer not null,
+  question jsonb not null,
+  created_at timestamp with time zone not null default now(),
+  constraint question_bank_pkey primary key (id),
+  constraint question_bank_link_id_fkey foreign KEY (link_id) references links (id) on delete cascade
+) TABLESPACE pg_default;
+
+create index IF not exists idx_question_bank_link_language on public.question_bank using btree (link_id, language, prompt_version) TABLESPACE pg_default;
@@ -0,0 +1,12 @@
+-- Generated quizzes shared by all students of a lesson
+create table if not exists public.quiz_cache (
+  cache_key text not null,
+  link_id bigint not null,
+  language text not null,
+  quiz jsonb not null,
+  created_at timestamp with time zone not null default now(),
+  constraint quiz_cache_pkey primary key (cache_key),
+  constraint quiz_cache_link_id_fkey foreign KEY (link_id) references links (id) on delete cascade
+) TABLESPACE pg_default;
+
+create index IF not exists idx_quiz_cache_link_id on public.quiz_cache using btree (link_id) TABLESPACE pg_default;
@@ -0,0 +1,76 @@
+import time
+import asyncio
+from types import SimpleNamespace
+from typing import List
+from app.utils import database
+from benchmarks.fakes import SUPABASE_KEY, start_mock_postgrest
+
+
+class StubQuery:
+    """PostgREST query builder that answers every query with the same rows"""
+
+    def __init__(self, client: "StubSupabase", table: str):
+        self.client = client
+        self.table = table
+
+    def __getattr__(self, name):
+        # select, eq, order, range and the other filters just build the query
+        return lambda *args, **kwargs: self
+
+    async def execute(self):
+        self.client.queries += 1
+        return SimpleNamespace(data=[dict(row) for row in self.client.rows], count=len(self.client.rows))
+
+
+class StubSupabase:
+    def __init__(self, rows: List[dict]):
+        self.rows = rows
+        self.queries = 0
+
+    def table(self, name: str) -> StubQuery:
+        return StubQuery(self, name)
+
+
+def quiz_results(count: int) -> List[dict]:
+    return [
+        {"id": i, "link_id": 1, "student_id": 1000 + i, "correct_answers": 2, "users": {"name": f"Ученик {i}"}}
+        for i in range(count)
+    ]
+
+
+def test_quiz_results_take_one_query_whatever_the_number_of_rows(monkeypatch):
+    for count in (1, 200):
+        client = StubSupabase(quiz_results(count))
+        monkeypatch.setattr(database, "_supabase", client)
+        results = asyncio.run(database.get_quiz_results_by_link(1))
+        assert len(results) == count
+        assert results[-1]["name"] == f"Ученик {count - 1}"
+        assert client.queries == 1
+
+
+def test_concurrent_handlers_do_not_wait_for_each_other(monkeypatch):
+    handlers = 20
+    latency = 0.2
+    monkeypatch.setattr(database, "_supabase", None)
+
+    async def scenario() -> float:
+        runner, url = await start_mock_postgrest({"links": [{"id": 1, "author_id": 1.0}]}, latency=latency)
+        monkeypatch.setenv("URL_SUPABASE", url)
+        monkeypatch.setenv("API_SUPABASE", SUPABASE_KEY)
+        try:
+            # The real AsyncClient, as created by the startup hook
+            await database.init_db()
+            started = time.perf_counter()
+            authors = await asyncio.gather(*(database.get_lesson_author(1) for _ in range(handlers)))
+            elapsed = time.perf_counter() - started
+            assert authors == [1.0] * handlers
+            assert runner.app["stats"]["requests"] == handlers
+            assert runner.app["stats"]["max_in_flight"] == handlers
+            return elapsed
+        finally:
+            await database.close_db()
+            await runner.cleanup()
+
+    elapsed = asyncio.run(scenario())
+    # One after another the queries would take handlers * latency = 4 s
+    assert elapsed < handlers * latency / 4
@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from aiogram.fsm.storage.memory import MemoryStorage
+from app.handlers import start
+from app.utils.job_queue import JobQueue, init_job_queue
+from app.utils.poll_scheduler import init_poll_scheduler
+from app.utils.quiz import QuizStream
+from tests.test_quiz_restart import FakeBot
+
+
+def test_failed_generation_sends_the_lesson_once(monkeypatch):
+    async def load_quiz(lesson_id, language):
+        stream = QuizStream()
+        await stream.finish(RuntimeError("LLM is down"))
+        return "Текст урока", "normal", stream
+
+    monkeypatch.setattr(start, "load_quiz", load_quiz)
+
+    async def scenario():
+        bot = FakeBot()
+        storage = MemoryStorage()
+        init_poll_scheduler(bot, storage, start.handle_poll_timeout)
+        queue = JobQueue(bot, storage, start.JOB_TYPES, workers=1, max_attempts=3, retry_delay=0)
+        await queue.start()
+        await queue.put("quiz", {"chat_id": 10, "user_id": 10, "lesson_id": 1, "language": "ru"})
+        while queue.depth or queue.running or queue._retries:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return bot.messages
+
+    messages = asyncio.run(scenario())
+    assert sum("Текст урока" in message for message in messages) == 1
+    assert messages[-1] == start.get_text("general_error", "ru")
+
+
+def test_repeated_quiz_start_is_queued_once():
+    async def scenario():
+        bot = FakeBot()
+        queue = JobQueue(bot, MemoryStorage(), start.JOB_TYPES, workers=0)
+        payload = {"chat_id": 10, "user_id": 10, "lesson_id": 1, "language": "ru"}
+        first = await queue.put("quiz", payload)
+        repeated = await queue.put("quiz", dict(payload))
+        other_lesson = await queue.put("quiz", {**payload, "lesson_id": 2})
+        return first, repeated, other_lesson, queue.depth
+
+    first, repeated, other_lesson, depth = asyncio.run(scenario())
+    assert first == 1
+    assert repeated is None
+    assert other_lesson == 2
+    assert depth == 2
+
+
+def test_failed_insert_does_not_block_the_job():
+    async def scenario():
+        queue = JobQueue(FakeBot(), MemoryStorage(), start.JOB_TYPES, workers=0)
+        payload = {"chat_id": 10, "user_id": 10, "lesson_id": 1, "language": "ru"}
+
+        async def full_disk(func, *args):
+            raise OSError("disk full")
+
+        queue._db = full_disk
+        with pytest.raises(OSError):
+            await queue.put("quiz", payload)
+        del queue._db
+        return await queue.put("quiz", payload)
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_webhook_workers_keep_separate_job_files(monkeypatch, tmp_path):
+    monkeypatch.setenv("JOBS_SQLITE_PATH", str(tmp_path / "jobs.sqlite3"))
+    paths = set()
+    for worker in ("0", "1"):
+        monkeypatch.setenv("WEBHOOK_WORKER", worker)
+        paths.add(init_job_queue(FakeBot(), MemoryStorage(), start.JOB_TYPES).path)
+    assert paths == {str(tmp_path / "jobs.worker-0.sqlite3"), str(tmp_path / "jobs.worker-1.sqlite3")}
@@ -0,0 +1,24 @@
+from app.utils.pacing import POLL_MAX_SECONDS, POLL_MIN_SECONDS, pause_before_next, poll_open_period
+from app.utils.quiz import pack_question
+
+
+def question(explanation: str) -> dict:
+    return {"question": "Сколько будет 2 + 2?", "options": ["3", "4"], "correctAnswer": 1, "explanation": explanation}
+
+
+def test_answer_without_explanation_goes_straight_on():
+    _, _, _, explanation = pack_question(question(""))
+    assert pause_before_next("normal", explanation) == 0
+
+
+def test_explanation_is_read_before_the_next_question_unless_rapid():
+    _, _, _, explanation = pack_question(question("Два и два дают четыре."))
+    assert 0 < pause_before_next("normal", explanation) <= 2
+    assert pause_before_next("rapid", explanation) == 0
+
+
+def test_open_period_grows_with_the_question_within_telegram_limits():
+    short = poll_open_period("2 + 2?", ["3", "4"])
+    long = poll_open_period("Почему " * 40, ["Потому что " * 5] * 4)
+    assert POLL_MIN_SECONDS <= short < long <= POLL_MAX_SECONDS
+    assert poll_open_period("x" * 100000, []) == POLL_MAX_SECONDS
@@ -0,0 +1,27 @@
+import asyncio
+from typing import List
+from app.utils import quiz
+from app.utils.quiz import Question, QUESTION_BANK_BATCH, generate_question_bank
+
+
+def test_long_lesson_bank_takes_as_many_requests_as_a_short_one(monkeypatch):
+    requests: List[tuple] = []
+
+    async def generate_questions(text, language, count, temperature=0.8):
+        requests.append((text, count))
+        return [
+            Question(question=f"{text[:12]} {i}?", options=["A", "B", "C", "D"], correctAnswer=0, explanation="")
+            for i in range(count)
+        ]
+
+    monkeypatch.setattr(quiz, "generate_questions", generate_questions)
+    monkeypatch.setattr(quiz, "QUIZ_CHUNK_CHARS", 100)
+    # 85 chunks of one paragraph each
+    lesson = "\n\n".join(f"Абзац {i:02d}. " + "текст " * 12 for i in range(85))
+
+    questions = asyncio.run(generate_question_bank(lesson, "ru", 24))
+
+    assert len(questions) == 24
+    assert len(requests) == -(-24 // QUESTION_BANK_BATCH)
+    # Spread over the lesson, not taken from its start
+    assert [text[:8] for text, _ in requests] == ["Абзац 14", "Абзац 42", "Абзац 70"]
@@ -0,0 +1,105 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import PollAnswer, User
+from app.handlers.start import ACTIVE_QUIZZES, handle_poll_timeout, process_poll_answer, run_quiz
+from app.utils.poll_scheduler import PollRecord, get_poll_scheduler, init_poll_scheduler
+from app.utils.quiz import QuizStream
+
+CHAT_ID = 10
+
+
+class FakeBot:
+    id = 1
+
+    def __init__(self):
+        self.messages = []
+        self.polls = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append(text)
+
+    async def send_poll(self, chat_id, question, **kwargs):
+        poll_id = f"poll-{len(self.polls) + 1}"
+        self.polls.append(poll_id)
+        return SimpleNamespace(poll=SimpleNamespace(id=poll_id))
+
+
+def question(number: int) -> dict:
+    return {"question": f"Вопрос {number}?", "options": ["A", "B"], "correctAnswer": 0, "explanation": ""}
+
+
+def test_restart_closes_the_poll_of_the_replaced_quiz():
+    async def scenario():
+        bot = FakeBot()
+        storage = MemoryStorage()
+        state = FSMContext(storage=storage, key=StorageKey(bot_id=bot.id, chat_id=CHAT_ID, user_id=CHAT_ID))
+        init_poll_scheduler(bot, storage, handle_poll_timeout)
+
+        # The first quiz is waiting for an answer to its first poll
+        await run_quiz(bot, state, CHAT_ID, CHAT_ID, 1, "Урок", QuizStream([question(1), question(2)], done=True), "ru")
+        assert (await state.get_data())["current_poll_id"] == "poll-1"
+
+        # The student restarts it, the new quiz is still being generated
+        stream = QuizStream()
+        restart = asyncio.create_task(run_quiz(bot, state, CHAT_ID, CHAT_ID, 1, "Урок", stream, "ru"))
+        async def quiz_replaced():
+            while (await state.get_data()).get("questions"):
+                await asyncio.sleep(0)
+        await asyncio.wait_for(quiz_replaced(), 1)
+        assert (await state.get_data()).get("current_poll_id") is None
+        assert get_poll_scheduler().cancel("poll-1") is None
+
+        # A late answer and the deadline of the old poll are ignored
+        user = User(id=CHAT_ID, is_bot=False, first_name="Student")
+        await process_poll_answer(PollAnswer(poll_id="poll-1", user=user, option_ids=[0]), state)
+        await handle_poll_timeout(bot, state, "poll-1", PollRecord(CHAT_ID, CHAT_ID, "ru", 0))
+        data = await state.get_data()
+        assert data["questions"] == []
+        assert data["current_question"] == 0
+        assert data["correct_answers"] == 0
+
+        # The new quiz starts from its own first question
+        await stream.put(question(3))
+        await stream.finish()
+        await restart
+        data = await state.get_data()
+        assert data["current_poll_id"] == "poll-2"
+        assert data["current_question"] == 0
+        assert data["correct_answers"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_generation_leaves_a_newer_quiz_alone():
+    async def scenario():
+        bot = FakeBot()
+        storage = MemoryStorage()
+        state = FSMContext(storage=storage, key=StorageKey(bot_id=bot.id, chat_id=CHAT_ID, user_id=CHAT_ID))
+        init_poll_scheduler(bot, storage, handle_poll_timeout)
+        active = ACTIVE_QUIZZES._values[()]
+
+        # The student restarts the quiz before the first generation fails
+        first, second = QuizStream(), QuizStream()
+        first_run = asyncio.create_task(run_quiz(bot, state, CHAT_ID, CHAT_ID, 1, "Урок", first, "ru"))
+        await asyncio.sleep(0.01)
+        second_run = asyncio.create_task(run_quiz(bot, state, CHAT_ID, CHAT_ID, 1, "Урок", second, "ru"))
+        await asyncio.sleep(0.01)
+        quiz_id = (await state.get_data())["quiz_id"]
+
+        await first.finish(RuntimeError("LLM failed"))
+        await asyncio.wait_for(first_run, 1)
+        assert (await state.get_data())["quiz_id"] == quiz_id
+        assert ACTIVE_QUIZZES._values[()] == active + 1
+
+        # The failure of the newer quiz ends it and is reported
+        await second.finish(RuntimeError("LLM failed"))
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(second_run, 1)
+        assert await state.get_data() == {}
+        assert ACTIVE_QUIZZES._values[()] == active
+
+    asyncio.run(scenario())
@@ -0,0 +1,27 @@
+import asyncio
+from app.utils import quiz
+
+
+def question(number: int) -> dict:
+    return {"question": f"Вопрос {number}?", "options": ["A", "B"], "correctAnswer": 0, "explanation": ""}
+
+
+class FakeLLM:
+    def __init__(self, snapshots):
+        self.snapshots = snapshots
+
+    async def stream(self, **kwargs):
+        for snapshot in self.snapshots:
+            yield snapshot
+
+
+def test_malformed_question_is_skipped_mid_stream(monkeypatch):
+    malformed = {"question": "Вопрос без вариантов?", "correctAnswer": 0, "explanation": ""}
+    final = [question(1), malformed, question(3)]
+    snapshots = [{"questions": final[:i]} for i in range(1, 4)]
+    monkeypatch.setattr(quiz, "get_llm", lambda: FakeLLM(snapshots))
+
+    async def scenario():
+        return [question async for question in quiz.stream_quiz_questions("Урок", "ru")]
+
+    assert asyncio.run(scenario()) == [question(1), question(3)]
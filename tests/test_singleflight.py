@@ -0,0 +1,40 @@
+import asyncio
+from app.handlers import start
+from app.utils import llm
+from app.utils.quiz import quiz_cache
+from benchmarks.fakes import start_mock_llm
+
+STUDENTS = 50
+
+
+def test_students_of_one_lesson_share_one_generation(monkeypatch):
+    async def get_lesson_text(lesson_id):
+        return "Урок о круговороте воды в природе."
+
+    async def get_lesson_pacing(lesson_id):
+        return "normal"
+
+    monkeypatch.setattr(start, "get_lesson_text", get_lesson_text)
+    monkeypatch.setattr(start, "get_lesson_pacing", get_lesson_pacing)
+
+    async def student() -> int:
+        _, _, stream = await start.load_quiz(1, "ru")
+        return len([question async for question in stream])
+
+    async def scenario():
+        runner, url = await start_mock_llm(latency=0.2)
+        monkeypatch.setenv("API_CHATGPT", "mock")
+        monkeypatch.setenv("API_BASE", url)
+        monkeypatch.delenv("LLM_CACHE_MODE", raising=False)
+        llm.init_llm()
+        try:
+            questions = await asyncio.gather(*(student() for _ in range(STUDENTS)))
+        finally:
+            await llm.close_llm()
+            await runner.cleanup()
+            quiz_cache.clear()
+        return questions, runner.app["stats"]
+
+    questions, stats = asyncio.run(scenario())
+    assert questions == [3] * STUDENTS
+    assert stats["requests"] == 1
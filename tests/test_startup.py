@@ -0,0 +1,8 @@
+from benchmarks.startup import FRAMEWORK_PACKAGES, LAZY_PACKAGES, PRELOADED_BUDGET_MS, measure
+
+
+def test_main_imports_fast_and_without_the_lazy_sdks():
+    # The fastest of a few cold starts, a single one is noisy
+    total, packages = min((measure("main", FRAMEWORK_PACKAGES) for _ in range(3)), key=lambda run: run[0])
+    assert [name for name in LAZY_PACKAGES if name in packages] == []
+    assert total / 1000 < PRELOADED_BUDGET_MS
@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from app.utils.storage import SQLiteStorage, create_storage, worker_path
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+async def round_trip(storage) -> None:
+    await storage.set_state(KEY, "QuizStates:waiting_for_answer")
+    await storage.set_data(KEY, {"quiz_id": "a1", "questions": [["Вопрос?", ["A", "B"], 0, ""]]})
+    await storage.update_data(KEY, {"current_question": 1})
+    assert await storage.get_state(KEY) == "QuizStates:waiting_for_answer"
+    assert await storage.get_data(KEY) == {
+        "quiz_id": "a1",
+        "questions": [["Вопрос?", ["A", "B"], 0, ""]],
+        "current_question": 1
+    }
+
+
+def test_sqlite_storage_round_trip_in_the_file_of_its_worker(monkeypatch, tmp_path):
+    monkeypatch.setenv("WEBHOOK_WORKER", "1")
+    path = worker_path(str(tmp_path / "fsm.sqlite3"))
+    assert path == str(tmp_path / "fsm.worker-1.sqlite3")
+
+    async def scenario():
+        storage = SQLiteStorage(path)
+        await round_trip(storage)
+        await storage.close()
+
+        # The state survives a restart of the worker
+        storage = SQLiteStorage(path)
+        assert (await storage.get_data(KEY))["current_question"] == 1
+        await storage.close()
+
+        # Another worker has a file of its own
+        monkeypatch.setenv("WEBHOOK_WORKER", "2")
+        storage = SQLiteStorage(worker_path(str(tmp_path / "fsm.sqlite3")))
+        assert await storage.get_data(KEY) == {}
+        await storage.close()
+
+    asyncio.run(scenario())
+
+
+def test_redis_storage_round_trip(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setenv("FSM_STORAGE", "redis")
+    monkeypatch.setenv("FSM_STATE_TTL", "60")
+
+    async def scenario():
+        storage = create_storage()
+        storage.redis = fakeredis.FakeAsyncRedis()
+        await round_trip(storage)
+        # Records expire with unfinished quizzes
+        assert 0 < await storage.redis.ttl(storage.key_builder.build(KEY, "data")) <= 60
+        await storage.close()
+
+    asyncio.run(scenario())
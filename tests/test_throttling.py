@@ -0,0 +1,26 @@
+import asyncio
+from types import SimpleNamespace
+from app.middlewares.throttling import ThrottlingMiddleware
+
+
+def message(text=None, file_id=None) -> SimpleNamespace:
+    document = SimpleNamespace(file_unique_id=file_id) if file_id else None
+    return SimpleNamespace(from_user=SimpleNamespace(id=10), text=text, document=document)
+
+
+def test_documents_of_one_user_are_not_coalesced():
+    async def scenario():
+        middleware = ThrottlingMiddleware()
+        handled = []
+
+        async def handler(event, data):
+            await asyncio.sleep(0.05)
+            handled.append(event)
+
+        events = [message(file_id="lesson-1"), message(file_id="lesson-2"), message("/links"), message("/links")]
+        await asyncio.gather(*(middleware(handler, event, {}) for event in events))
+        return handled, middleware.stats()
+
+    handled, stats = asyncio.run(scenario())
+    assert len(handled) == 3
+    assert stats["coalesced"] == 1